@@ -1,25 +1,142 @@
+import logging
+import threading
+from collections import deque
+from copy import deepcopy
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the following conversation between a user and an assistant in a few sentences, keeping the facts, "
+    "names and decisions needed to carry it on. Reply with the summary only."
+)
+
+
+def estimate_tokens(text):
+    """
+    Rough number of tokens of `text` for the usual tokenizers, about 4 characters each.
+    """
+    return len(text) // 4 + 1
+
+
+def summary_request(messages, summary=None):
+    """
+    Messages asking a chat model for the summary of `messages`, which follow the conversation summed up by `summary`.
+    """
+    conversation = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    if summary:
+        conversation = f"Summary of the earlier conversation: {summary}\n{conversation}"
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": conversation},
+    ]
+
+
 class Chat:
     """
     Handles the chat using to avoid OOM issues.
+    Keeps the last `size` interactions and, with `max_tokens`, at most about that many tokens as counted by
+    `count_tokens`. Past the budget, the oldest messages are summarized in the background by
+    `summarize(messages, summary)`, which returns the summary of the whole conversation up to them, and replaced by
+    that summary; the prompt stays over the budget until then. Without `summarize`, they are dropped.
     """
 
-    def __init__(self, size):
+    def __init__(self, size, max_tokens=0, count_tokens=estimate_tokens, summarize=None):
         self.size = size
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        self.summarize = summarize
         self.init_chat_message = None
         # maxlen is necessary pair, since a each new step we add an prompt and assitant answer
-        self.buffer = []
+        self.buffer = deque()
+        self.token_counts = deque()
+        self.total_tokens = 0
+        self.summary = None
+        self.summary_tokens = 0
+        self.summarizing = False
+        # incremented by clear, so that a summary of cleared messages is discarded
+        self.epoch = 0
+        self.lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        chat = Chat(self.size, self.max_tokens, self.count_tokens, self.summarize)
+        with self.lock:
+            chat.init_chat_message = deepcopy(self.init_chat_message, memo)
+            chat.buffer = deepcopy(self.buffer, memo)
+            chat.token_counts = deque(self.token_counts)
+            chat.total_tokens = self.total_tokens
+            chat.summary = self.summary
+            chat.summary_tokens = self.summary_tokens
+        return chat
 
     def append(self, item):
-        self.buffer.append(item)
-        if len(self.buffer) == 2 * (self.size + 1):
-            self.buffer.pop(0)
-            self.buffer.pop(0)
+        with self.lock:
+            self.buffer.append(item)
+            self.token_counts.append(self.count_tokens(item["content"]))
+            self.total_tokens += self.token_counts[-1]
+            if len(self.buffer) == 2 * (self.size + 1):
+                self._pop()
+                self._pop()
+            if self.max_tokens and not self.summarizing and self.total_tokens + self.summary_tokens > self.max_tokens:
+                self._fold()
+
+    def _pop(self):
+        self.buffer.popleft()
+        self.total_tokens -= self.token_counts.popleft()
+
+    def _fold(self):
+        # down to half the budget, so that the history is not summarized again at every turn, keeping the last exchange
+        messages = []
+        tokens = self.total_tokens + self.summary_tokens
+        for message, count in zip(self.buffer, self.token_counts):
+            if tokens <= self.max_tokens // 2 or len(messages) >= len(self.buffer) - 2:
+                break
+            messages.append(message)
+            tokens -= count
+        if not messages:
+            return
+        if self.summarize is None:
+            for _ in messages:
+                self._pop()
+            return
+        self.summarizing = True
+        threading.Thread(
+            target=self._summarize, args=(messages, self.summary, self.epoch), daemon=True
+        ).start()
+
+    def _summarize(self, messages, summary, epoch):
+        try:
+            summary = self.summarize(messages, summary)
+        except Exception as e:
+            logger.warning(f"Could not summarize the chat history, dropping its oldest messages: {e!r}")
+        with self.lock:
+            self.summarizing = False
+            if epoch != self.epoch:
+                return
+            for message in messages:
+                if self.buffer and self.buffer[0] is message:
+                    self._pop()
+            self.summary = summary
+            self.summary_tokens = self.count_tokens(summary) if summary else 0
+        logger.debug(f"Summarized {len(messages)} messages of the chat history")
 
     def init_chat(self, init_chat_message):
         self.init_chat_message = init_chat_message
 
+    def clear(self):
+        with self.lock:
+            self.buffer.clear()
+            self.token_counts.clear()
+            self.total_tokens = 0
+            self.summary = None
+            self.summary_tokens = 0
+            self.epoch += 1
+
     def to_list(self):
+        with self.lock:
+            messages = list(self.buffer)
+            summary = self.summary
+        if summary:
+            messages.insert(0, {"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
         if self.init_chat_message:
-            return [self.init_chat_message] + self.buffer
-        else:
-            return self.buffer
+            messages.insert(0, self.init_chat_message)
+        return messages
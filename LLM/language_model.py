@@ -2,16 +2,22 @@ from threading import Thread
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
+    DynamicCache,
     pipeline,
+    StoppingCriteriaList,
     TextIteratorStreamer,
 )
 import torch
 
 from LLM.chat import Chat
+from LLM.prefix_cache import PrefixCache
+from LLM.sentence_segmenter import SentenceSegmenter
+from LLM.speculation import Speculator
 from baseHandler import BaseHandler
 from rich.console import Console
 import logging
-from nltk import sent_tokenize
+from utils.messages import PartialTranscript
+from utils.stopping_criteria import CancelledCriteria
 
 logger = logging.getLogger(__name__)
 
@@ -36,8 +42,16 @@ WHISPER_LANGUAGE_TO_LLM_LANGUAGE = {
 class LanguageModelHandler(BaseHandler):
     """
     Handles the language model part.
+    With `speculative_ms`, generation starts from partial transcripts that have been stable for that long and the
+    response is kept if the final transcript matches.
+    With `prefix_cache`, the KV cache of the conversation is kept between turns (see PrefixCache), so that each turn
+    only prefills the new user message.
     """
 
+    trace_stage = "first_sentence"
+    session_state = ("chat", "prefix_cache")
+    session_attributes = ("cancel_signal",)
+
     def setup(
         self,
         model_name="microsoft/Phi-3-mini-4k-instruct",
@@ -48,6 +62,10 @@ class LanguageModelHandler(BaseHandler):
         chat_size=1,
         init_chat_role=None,
         init_chat_prompt="You are a helpful AI assistant.",
+        speculative_ms=0,
+        first_chunk_min_chars=0,
+        min_chunk_chars=0,
+        prefix_cache=True,
     ):
         self.device = device
         self.torch_dtype = getattr(torch, torch_dtype)
@@ -78,9 +96,29 @@ class LanguageModelHandler(BaseHandler):
                 )
             self.chat.init_chat({"role": init_chat_role, "content": init_chat_prompt})
         self.user_role = user_role
+        self.chunking = {"first_chunk_min_chars": first_chunk_min_chars, "min_chunk_chars": min_chunk_chars}
+        self.accepts_partials = speculative_ms > 0
+        self.speculator = Speculator(speculative_ms) if speculative_ms > 0 else None
+        self.prefix_cache = PrefixCache(self.prefill_system_prompt()) if prefix_cache else None
 
         self.warmup()
 
+    def prefill_system_prompt(self):
+        """
+        Returns the token ids of the initial chat message alone and their KV cache, or None without such a message.
+        """
+        if self.chat.init_chat_message is None:
+            return None
+        try:
+            tokens = self.tokenizer.apply_chat_template([self.chat.init_chat_message], tokenize=True)
+        except Exception as e:
+            logger.warning(f"Could not prefill the system prompt: {e!r}")
+            return None
+        cache = DynamicCache()
+        with torch.no_grad():
+            self.model(torch.tensor([tokens], device=self.device), past_key_values=cache, use_cache=True)
+        return list(tokens), cache
+
     def warmup(self):
         logger.info(f"Warming up {self.__class__.__name__}")
 
@@ -116,37 +154,134 @@ class LanguageModelHandler(BaseHandler):
                 f"{self.__class__.__name__}:  warmed up! time: {start_event.elapsed_time(end_event) * 1e-3:.3f} s"
             )
 
-    def process(self, prompt):
-        logger.debug("infering language model...")
-        language_code = None
-        if isinstance(prompt, tuple):
-            prompt, language_code = prompt
-            if language_code[-5:] == "-auto":
-                language_code = language_code[:-5]
-                prompt = f"Please reply to my message in {WHISPER_LANGUAGE_TO_LLM_LANGUAGE[language_code]}. " + prompt
+    def format_prompt(self, prompt, language_code):
+        if language_code is not None and language_code[-5:] == "-auto":
+            language_code = language_code[:-5]
+            prompt = f"Please reply to my message in {WHISPER_LANGUAGE_TO_LLM_LANGUAGE[language_code]}. " + prompt
+        return prompt, language_code
 
-        self.chat.append({"role": self.user_role, "content": prompt})
-        thread = Thread(
-            target=self.pipe, args=(self.chat.to_list(),), kwargs=self.gen_kwargs
+    def generate(self, messages, language_code, is_cancelled, on_token=None, prefix_cache=None):
+        """
+        Yields the response sentence by sentence and returns the whole generated text.
+        """
+        streamer = TextIteratorStreamer(
+            self.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True,
         )
+        gen_kwargs = {
+            **self.gen_kwargs,
+            "streamer": streamer,
+            "stopping_criteria": StoppingCriteriaList(
+                [CancelledCriteria(is_cancelled)]
+            ),
+        }
+        if prefix_cache is None:
+            thread = Thread(
+                target=self.pipe, args=(messages,), kwargs=gen_kwargs
+            )
+        else:
+            thread = Thread(
+                target=self.generate_with_cache, args=(messages, prefix_cache), kwargs=gen_kwargs
+            )
         thread.start()
         if self.device == "mps":
             generated_text = ""
-            for new_text in self.streamer:
+            for new_text in streamer:
+                if on_token:
+                    on_token()
                 generated_text += new_text
             printable_text = generated_text
             torch.mps.empty_cache()
         else:
-            generated_text, printable_text = "", ""
-            for new_text in self.streamer:
+            generated_text = ""
+            segmenter = SentenceSegmenter(**self.chunking)
+            for new_text in streamer:
+                if on_token:
+                    on_token()
                 generated_text += new_text
-                printable_text += new_text
-                sentences = sent_tokenize(printable_text)
-                if len(sentences) > 1:
-                    yield (sentences[0], language_code)
-                    printable_text = new_text
-
-        self.chat.append({"role": "assistant", "content": generated_text})
+                if is_cancelled():
+                    # generation stops at the next step, drain the streamer
+                    continue
+                for sentence in segmenter.push(new_text):
+                    yield (sentence, language_code)
+            printable_text = segmenter.flush()
 
         # don't forget last sentence
         yield (printable_text, language_code)
+        return generated_text
+
+    def generate_with_cache(self, messages, prefix_cache, **gen_kwargs):
+        """
+        Generates from `messages` like the pipeline, from the KV cache of the prefix they share with the last turn.
+        """
+        gen_kwargs.pop("return_full_text", None)
+        input_ids = self.tokenizer.apply_chat_template(
+            messages, add_generation_prompt=True, return_tensors="pt"
+        ).to(self.device)
+        cache, reused = prefix_cache.take(input_ids[0].tolist())
+        logger.debug(f"prefilling {input_ids.shape[1] - reused} of {input_ids.shape[1]} prompt tokens")
+        sequences = self.model.generate(
+            input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            past_key_values=cache,
+            **gen_kwargs,
+        )
+        prefix_cache.put(sequences[0].tolist(), cache)
+
+    def speculate(self, partial):
+        self.speculator.cancel(self.session)
+        if not self.speculator.wait_stable(self.queue_in):
+            return
+        prompt, language_code = self.format_prompt(partial.text, partial.language)
+        messages = self.chat.to_list() + [{"role": self.user_role, "content": prompt}]
+        prefix_cache = self.prefix_cache
+        self.speculator.start(
+            self.session,
+            partial.text,
+            partial.language,
+            lambda is_cancelled: self.generate(messages, language_code, is_cancelled, prefix_cache=prefix_cache),
+            self.cancel_signal,
+        )
+
+    def end_session(self):
+        if self.speculator is not None:
+            self.speculator.cancel(self.session)
+        super().end_session()
+
+    def process(self, prompt):
+        if isinstance(prompt, PartialTranscript):
+            self.speculate(prompt)
+            return
+        logger.debug("infering language model...")
+        language_code = None
+        if isinstance(prompt, tuple):
+            prompt, language_code = prompt
+
+        speculation = None
+        if self.speculator is not None:
+            speculation = self.speculator.take(self.session, prompt, language_code)
+        prompt, language_code = self.format_prompt(prompt, language_code)
+
+        if speculation is not None:
+            logger.debug("using the speculative response")
+            self.mark_trace("llm_first_token")
+            generated_text = yield from speculation.outputs()
+            if speculation.error is not None and speculation.delivered:
+                # answering again would repeat what was already said
+                logger.warning("The speculative response failed midway, keeping the part already said")
+                generated_text = " ".join(text for text, _ in speculation.delivered)
+            elif speculation.error is not None:
+                logger.warning("The speculative response failed, answering the final transcript")
+                speculation = None
+        if speculation is None:
+            generated_text = yield from self.generate(
+                self.chat.to_list() + [{"role": self.user_role, "content": prompt}],
+                language_code,
+                self.is_cancelled,
+                on_token=lambda: self.mark_trace("llm_first_token"),
+                prefix_cache=self.prefix_cache,
+            )
+
+        self.chat.append({"role": self.user_role, "content": prompt})
+        self.chat.append({"role": "assistant", "content": generated_text or ""})
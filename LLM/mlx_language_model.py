@@ -1,5 +1,6 @@
 import logging
 from LLM.chat import Chat
+from LLM.sentence_segmenter import SentenceSegmenter
 from baseHandler import BaseHandler
 from mlx_lm import load, stream_generate, generate
 from rich.console import Console
@@ -29,6 +30,10 @@ class MLXLanguageModelHandler(BaseHandler):
     Handles the language model part.
     """
 
+    trace_stage = "first_sentence"
+    session_state = ("chat",)
+    session_attributes = ("cancel_signal",)
+
     def setup(
         self,
         model_name="microsoft/Phi-3-mini-4k-instruct",
@@ -39,6 +44,8 @@ class MLXLanguageModelHandler(BaseHandler):
         chat_size=1,
         init_chat_role=None,
         init_chat_prompt="You are a helpful AI assistant.",
+        first_chunk_min_chars=0,
+        min_chunk_chars=0,
     ):
         self.model_name = model_name
         self.model, self.tokenizer = load(self.model_name)
@@ -52,6 +59,7 @@ class MLXLanguageModelHandler(BaseHandler):
                 )
             self.chat.init_chat({"role": init_chat_role, "content": init_chat_prompt})
         self.user_role = user_role
+        self.chunking = {"first_chunk_min_chars": first_chunk_min_chars, "min_chunk_chars": min_chunk_chars}
 
         self.warmup()
 
@@ -97,18 +105,22 @@ class MLXLanguageModelHandler(BaseHandler):
             chat_messages, tokenize=False, add_generation_prompt=True
         )
         output = ""
-        curr_output = ""
+        segmenter = SentenceSegmenter(**self.chunking)
         for t in stream_generate(
             self.model,
             self.tokenizer,
             prompt,
             max_tokens=self.gen_kwargs["max_new_tokens"],
         ):
+            if self.is_cancelled():
+                break
+            self.mark_trace("llm_first_token")
             output += t.text
-            curr_output += t.text
-            if curr_output.endswith((".", "?", "!", "<|end|>")):
-                yield (curr_output.replace("<|end|>", ""), language_code)
-                curr_output = ""
+            for sentence in segmenter.push(t.text.replace("<|end|>", "")):
+                yield (sentence, language_code)
+        curr_output = segmenter.flush()
+        if curr_output and not self.is_cancelled():
+            yield (curr_output, language_code)
         generated_text = output.replace("<|end|>", "")
         torch.mps.empty_cache()
 
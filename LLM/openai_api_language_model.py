@@ -1,12 +1,14 @@
 import logging
 import time
 
-from nltk import sent_tokenize
 from rich.console import Console
 from openai import OpenAI
 
 from baseHandler import BaseHandler
-from LLM.chat import Chat
+from LLM.chat import Chat, summary_request
+from LLM.sentence_segmenter import SentenceSegmenter
+from LLM.speculation import Speculator
+from utils.messages import PartialTranscript
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +26,13 @@ WHISPER_LANGUAGE_TO_LLM_LANGUAGE = {
 class OpenApiModelHandler(BaseHandler):
     """
     Handles the language model part.
+    Speculative generation from partial transcripts works as in LanguageModelHandler.
     """
+
+    trace_stage = "first_sentence"
+    session_state = ("chat",)
+    session_attributes = ("cancel_signal",)
+
     def setup(
         self,
         model_name="deepseek-chat",
@@ -37,10 +45,14 @@ class OpenApiModelHandler(BaseHandler):
         chat_size=1,
         init_chat_role="system",
         init_chat_prompt="You are a helpful AI assistant.",
+        speculative_ms=0,
+        first_chunk_min_chars=0,
+        min_chunk_chars=0,
+        history_max_tokens=0,
     ):
         self.model_name = model_name
         self.stream = stream
-        self.chat = Chat(chat_size)
+        self.chat = Chat(chat_size, history_max_tokens, summarize=self.summarize)
         if init_chat_role:
             if not init_chat_prompt:
                 raise ValueError(
@@ -48,6 +60,9 @@ class OpenApiModelHandler(BaseHandler):
                 )
             self.chat.init_chat({"role": init_chat_role, "content": init_chat_prompt})
         self.user_role = user_role
+        self.chunking = {"first_chunk_min_chars": first_chunk_min_chars, "min_chunk_chars": min_chunk_chars}
+        self.accepts_partials = speculative_ms > 0
+        self.speculator = Speculator(speculative_ms) if speculative_ms > 0 else None
         self.client = OpenAI(api_key=api_key, base_url=base_url)
         self.warmup()
 
@@ -66,56 +81,115 @@ class OpenApiModelHandler(BaseHandler):
         logger.info(
             f"{self.__class__.__name__}:  warmed up! time: {(end - start):.3f} s"
         )
-    def process(self, prompt):
-        logger.debug("call api language model...")
-
-        # 1. If prompt is a (text, language_code) tuple, extract and handle "-auto" logic.
-        language_code = None
-        if isinstance(prompt, tuple):
-            prompt, language_code = prompt
-            if language_code.endswith("-auto"):
-                language_code = language_code[:-5]
-                # prepend the translation instruction to the prompt text
-                prompt = f"Please reply to my message in {WHISPER_LANGUAGE_TO_LLM_LANGUAGE[language_code]}. " + prompt
-
-        # 2. Append the new user message (with any translation‐prefix) to the Chat buffer
-        self.chat.append({"role": self.user_role, "content": prompt})
+    def summarize(self, messages, summary):
+        response = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=summary_request(messages, summary),
+        )
+        return response.choices[0].message.content
 
-        # 3. Build the messages payload from the entire history (including init_chat_message, if set)
-        messages_payload = self.chat.to_list()
+    def format_prompt(self, prompt, language_code):
+        if language_code is not None and language_code.endswith("-auto"):
+            language_code = language_code[:-5]
+            # prepend the translation instruction to the prompt text
+            prompt = f"Please reply to my message in {WHISPER_LANGUAGE_TO_LLM_LANGUAGE[language_code]}. " + prompt
+        return prompt, language_code
 
-        # 4. Call the model with streaming enabled
+    def generate(self, messages_payload, language_code, is_cancelled, on_token=None):
+        """
+        Yields the response sentence by sentence (or whole when not streaming) and returns the whole generated text.
+        """
         response = self.client.chat.completions.create(
             model=self.model_name,
             messages=messages_payload,
-            stream=True
+            stream=self.stream
         )
         print(messages_payload)
         if self.stream:
             generated_text = ""
-            printable_buffer = ""
+            segmenter = SentenceSegmenter(**self.chunking)
             for chunk in response:
+                if is_cancelled():
+                    # barge-in: stop receiving the answer
+                    response.close()
+                    break
+                if on_token:
+                    on_token()
                 new_delta = chunk.choices[0].delta.content or ""
                 generated_text += new_delta
-                printable_buffer += new_delta
 
-                # Once we detect at least one full sentence, yield it
-                sentences = sent_tokenize(printable_buffer)
-                if len(sentences) > 1:
-                    # yield the first complete sentence
-                    yield sentences[0], language_code
-                    # remove that sentence from printable_buffer
-                    printable_buffer = printable_buffer[len(sentences[0]):]
+                # yield each sentence as soon as it is complete
+                for sentence in segmenter.push(new_delta):
+                    yield sentence, language_code
 
             # After streaming ends, whatever remains is the final (partial or full) sentence
-            if printable_buffer.strip():
+            printable_buffer = segmenter.flush()
+            if printable_buffer:
                 yield printable_buffer, language_code
+            return generated_text
+
+        # (This branch only happens if self.stream == False)
+        if on_token:
+            on_token()
+        full_response = response.choices[0].message.content
+        yield full_response, language_code
+        return full_response
+
+    def speculate(self, partial):
+        self.speculator.cancel(self.session)
+        if not self.speculator.wait_stable(self.queue_in):
+            return
+        prompt, language_code = self.format_prompt(partial.text, partial.language)
+        messages_payload = self.chat.to_list() + [{"role": self.user_role, "content": prompt}]
+        self.speculator.start(
+            self.session,
+            partial.text,
+            partial.language,
+            lambda is_cancelled: self.generate(messages_payload, language_code, is_cancelled),
+            self.cancel_signal,
+        )
+
+    def end_session(self):
+        if self.speculator is not None:
+            self.speculator.cancel(self.session)
+        super().end_session()
+
+    def process(self, prompt):
+        if isinstance(prompt, PartialTranscript):
+            self.speculate(prompt)
+            return
+        logger.debug("call api language model...")
 
-            # 5. Finally append the assistant’s full response to chat history
-            self.chat.append({"role": "assistant", "content": generated_text})
+        # 1. If prompt is a (text, language_code) tuple, extract and handle "-auto" logic.
+        language_code = None
+        if isinstance(prompt, tuple):
+            prompt, language_code = prompt
+        speculation = None
+        if self.speculator is not None:
+            speculation = self.speculator.take(self.session, prompt, language_code)
+        prompt, language_code = self.format_prompt(prompt, language_code)
+
+        # 2. Use the response started on the partial transcript, or call the model on the entire history
+        # (including init_chat_message, if set) and the new user message
+        if speculation is not None:
+            logger.debug("using the speculative response")
+            self.mark_trace("llm_first_token")
+            generated_text = yield from speculation.outputs()
+            if speculation.error is not None and speculation.delivered:
+                # answering again would repeat what was already said
+                logger.warning("The speculative response failed midway, keeping the part already said")
+                generated_text = " ".join(text for text, _ in speculation.delivered)
+            elif speculation.error is not None:
+                logger.warning("The speculative response failed, answering the final transcript")
+                speculation = None
+        if speculation is None:
+            generated_text = yield from self.generate(
+                self.chat.to_list() + [{"role": self.user_role, "content": prompt}],
+                language_code,
+                self.is_cancelled,
+                on_token=lambda: self.mark_trace("llm_first_token"),
+            )
 
-        else:
-            # (This branch only happens if self.stream == False)
-            full_response = response.choices[0].message.content
-            self.chat.append({"role": "assistant", "content": full_response})
-            yield full_response, language_code
\ No newline at end of file
+        # 3. Finally append the user message and the assistant’s full response to chat history
+        self.chat.append({"role": self.user_role, "content": prompt})
+        self.chat.append({"role": "assistant", "content": generated_text or ""})
@@ -0,0 +1,58 @@
+import copy
+
+from transformers import DynamicCache
+
+
+def common_prefix_length(tokens, other, limit):
+    length = 0
+    for token, other_token in zip(tokens[:limit], other[:limit]):
+        if token != other_token:
+            break
+        length += 1
+    return length
+
+
+class PrefixCache:
+    """
+    KV cache of the last prompt and answer of a conversation with a transformers model, kept between turns so that a
+    turn only prefills the tokens following the longest prefix it shares with the previous one, usually the new user
+    message.
+    `system` is the (tokens, cache) of the system prompt alone, shared by the sessions and copied when the conversation
+    cache covers less of the prompt, e.g. on the first turn or once the oldest turns are dropped from the chat.
+    The cache is taken by a generation and given back when it is over, so that a concurrent generation, e.g. a
+    speculative one, starts from the system prompt instead.
+    """
+
+    def __init__(self, system=None):
+        self.system = system
+        self.tokens = []
+        self.cache = None
+
+    def __deepcopy__(self, memo):
+        # a copy, e.g. the state of a new session, starts a new conversation
+        return PrefixCache(self.system)
+
+    def take(self, input_ids):
+        """
+        Returns the cache to generate from `input_ids` (a list of token ids) with, and the number of tokens it covers.
+        """
+        tokens, cache = self.tokens, self.cache
+        self.tokens, self.cache = [], None
+        # the last token is always prefilled, for the model to predict the next one
+        limit = len(input_ids) - 1
+        reused = common_prefix_length(tokens, input_ids, limit) if cache is not None else 0
+        if self.system is not None:
+            system_tokens, system_cache = self.system
+            if reused < len(system_tokens) <= limit and input_ids[:len(system_tokens)] == system_tokens:
+                return copy.deepcopy(system_cache), len(system_tokens)
+        if not reused:
+            return DynamicCache(), 0
+        cache.crop(reused)
+        return cache, reused
+
+    def put(self, sequence, cache):
+        """
+        Keeps the cache of a finished generation, `sequence` being the token ids of its prompt and answer.
+        """
+        self.tokens = sequence[:cache.get_seq_length()]
+        self.cache = cache
@@ -3,15 +3,17 @@ import time
 import json
 import os
 
-from nltk import sent_tokenize
 from rich.console import Console
 from google.cloud import translate_v2 as translate
 
 from baseHandler import BaseHandler
 from LLM.chat import Chat
+from LLM.speculation import Speculator
+from utils.messages import PartialTranscript
+from utils.trace import TraceContext, Traced
 import requests
 
-from pulsochat.ChatHandler import ChatHandler
+from pulsochat.ChatHandler import ChatHandler, PhaseState
 from pulsochat.ConfigManager import ConfigManager
 from pulsochat.InteractionLogger import InteractionLogger
 
@@ -40,7 +42,20 @@ os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = key_file
 
 CHAT_SIZE = 2000
 
+
+def translate_response(translate_client, text, language_code):
+    """
+    Text of an English response chunk as given to the TTS: translated to `language_code`, except for 'en-fr'.
+    """
+    if language_code == "en-fr":
+        return text
+    return translate_client.translate(text, target_language=language_code, format_="text")["translatedText"]
+
 class PulsochatModelHandler(BaseHandler):
+    trace_stage = "first_sentence"
+    session_state = ("chat", "phase_state")
+    session_attributes = ("cancel_signal",)
+
     def setup(
         self,
         config_file,
@@ -49,17 +64,32 @@ class PulsochatModelHandler(BaseHandler):
         stream,
         temperature,
         top_p,
-        gen_kwargs={}
+        speculative_ms=0,
+        gen_kwargs={},
+        first_chunk_min_chars=0,
+        min_chunk_chars=0,
+        history_max_tokens=0,
     ):
         with open(config_file) as f:
             config = json.load(f)
 
         self.stream = stream
-        self.client = ChatHandler(config, api_key, InteractionLogger(log_dir))
-        self.chat = Chat(CHAT_SIZE)
+        self.client = ChatHandler(
+            config,
+            api_key,
+            InteractionLogger(log_dir),
+            chunking={"first_chunk_min_chars": first_chunk_min_chars, "min_chunk_chars": min_chunk_chars},
+        )
+        self.chat = Chat(CHAT_SIZE, history_max_tokens, summarize=self.client.summarize)
+        # progress through the scenario, per session like the chat
+        self.phase_state = PhaseState()
         self.translate_client = translate.Client()
         self.temperature=temperature
         self.top_p=top_p
+        self.accepts_partials = speculative_ms > 0
+        self.speculator = Speculator(speculative_ms) if speculative_ms > 0 else None
+        # sessions of the multi-session server by id, for the OSC commands to address them
+        self.sessions = {}
         # Register handlers for OSC messages
         if self.osc_server:
             self.osc_server.add_handler("/pulsochat/reset", self._handle_reset)
@@ -74,7 +104,57 @@ class PulsochatModelHandler(BaseHandler):
         end = time.time()
         logger.info(f"{self.__class__.__name__}: warmed up in {(end - start):.3f}s")
 
+    def generate(self, prompt, language_code, history, phase_state, is_cancelled, on_token=None, speculative=False):
+        """
+        Yields the translated response chunks and returns the English prompt and response.
+        """
+        if language_code != "en":
+            prompt_en = self.translate_client.translate(prompt, target_language="en", format_="text")["translatedText"]
+            #prompt_en=prompt
+        else:
+            prompt_en=prompt
+
+        response_generator = self.client.response(
+            prompt_en,
+            history,
+            temperature=self.temperature,
+            top_p=self.top_p,
+            on_token=on_token,
+            is_cancelled=is_cancelled,
+            speculative=speculative,
+            state=phase_state,
+        )
+
+        generated_text = ""
+        for chunk in response_generator:
+            generated_text += chunk
+            if is_cancelled():
+                # no need to translate what will not be said
+                continue
+            chunk_fr = translate_response(self.translate_client, chunk, language_code)
+            yield chunk_fr, language_code  # Yielding chunks in streaming mode
+        return prompt_en, generated_text
+
+    def speculate(self, partial):
+        self.speculator.cancel(self.session)
+        if self.client.question_pending(self.phase_state) or not self.speculator.wait_stable(self.queue_in):
+            return
+        history = list(self.chat.to_list())
+        phase_state = self.phase_state
+        self.speculator.start(
+            self.session,
+            partial.text,
+            partial.language,
+            lambda is_cancelled: self.generate(
+                partial.text, partial.language, history, phase_state, is_cancelled, speculative=True
+            ),
+            self.cancel_signal,
+        )
+
     def process(self, prompt):
+        if isinstance(prompt, PartialTranscript):
+            self.speculate(prompt)
+            return
         logger.debug("call api language model...")
         language_code = None
         print(f"prompt length: {len(prompt)}")
@@ -84,62 +164,102 @@ class PulsochatModelHandler(BaseHandler):
 
             logger.debug(prompt)
 
-            # Call the response generator
-
-            if language_code != "en":
-                prompt_en = self.translate_client.translate(prompt, target_language="en", format_="text")["translatedText"]
-                #prompt_en=prompt
-            else:
-                prompt_en=prompt
-
-            response_generator = self.client.response(prompt_en, self.chat.to_list(), temperature=self.temperature, top_p=self.top_p)
-
-            import time
-
-            start = time.time()
-            generated_text = ""
-            for chunk in response_generator:
-                generated_text += chunk
-                if language_code != "en-fr":
-                    chunk_fr = self.translate_client.translate(chunk, target_language=language_code, format_="text")["translatedText"]
-                    #chunk_fr = chunk
+            # Use the response started on the partial transcript, or call the response generator
+            speculation = None
+            if self.speculator is not None:
+                speculation = self.speculator.take(self.session, prompt, language_code)
+            if speculation is not None:
+                logger.debug("using the speculative response")
+                self.mark_trace("llm_first_token")
+                result = yield from speculation.outputs()
+                if speculation.error is not None and speculation.delivered:
+                    # answering again would repeat what was already said, and the English text of the part said is
+                    # not known to record the turn
+                    logger.warning("The speculative response failed midway, the turn is not recorded")
+                    return
+                elif speculation.error is not None:
+                    logger.warning("The speculative response failed, answering the final transcript")
+                    speculation = None
+                elif result is None:
+                    return
                 else:
-                    chunk_fr=chunk
-                yield chunk_fr, language_code  # Yielding chunks in streaming mode
-            end = time.time()
+                    prompt_en, generated_text = result
+                    self.client.record_interaction(prompt_en, generated_text, self.phase_state)
+            if speculation is None:
+                prompt_en, generated_text = yield from self.generate(
+                    prompt,
+                    language_code,
+                    self.chat.to_list(),
+                    self.phase_state,
+                    self.is_cancelled,
+                    on_token=lambda: self.mark_trace("llm_first_token"),
+                )
             if self.osc_client:
-                self.send_osc_message("/pulsochat/state", str(self.client.get_current_state()))
+                self.send_osc_message("/pulsochat/state", str(self.client.get_current_state(self.phase_state)))
 
 
             if not prompt == "-":
                 self.chat.append({"role": "user", "content": prompt_en})
             self.chat.append({"role": "assistant", "content": generated_text})
 
+    def switch_session(self, session):
+        if session is not None:
+            self.sessions[session.id] = session
+        super().switch_session(session)
+
+    def end_session(self):
+        if self.speculator is not None:
+            self.speculator.cancel(self.session)
+        if self.session is not None:
+            self.sessions.pop(self.session.id, None)
+        # the chat and phase state of the session are reset with the rest of its session_state
+        super().end_session()
+
+    def osc_sessions(self, session_id=None):
+        """
+        Sessions an OSC command applies to: the session of id `session_id` if given, else all of them, None standing
+        for the single client.
+        """
+        if session_id is None:
+            return list(self.sessions.values()) or [None]
+        session = self.sessions.get(int(session_id))
+        if session is None:
+            logger.warning(f"OSC command for unknown session {session_id}")
+            return []
+        return [session]
+
     def _handle_state(self, address, *args):
+        """
+        OSC handler for the phase command, followed by the id of the session to update with the multi-session server.
+        """
         logger.info(f"Received OSC state command from {address} with {args[0]}")
-        self.client.set_phase(args[0])
+        # the stored state of each session, whichever session the handler is working on
+        for session in self.osc_sessions(*args[1:2]):
+            self.client.set_phase(args[0], self.session_value(session, "phase_state"))
         #TODO treat OSC state comme ça il gère l'interlink
         # genre pendant l'interlink il arrête d'écouter....
         #logger.info("TODO treat OSC state command : ", args[0])
 
     def _handle_reset(self, address, *args):
         """
-        OSC handler for the reset command.
+        OSC handler for the reset command, followed by the id of the session to reset with the multi-session server.
         """
         logger.info("Received OSC reset command. Resetting ChatHandler and Chat.")
-        self._reset_chat_handler()
-        self._reset_chat()
-        self.queue_in.put(('-','fr'))
+        for session in self.osc_sessions(*args[:1]):
+            self._reset_chat_handler(self.session_value(session, "phase_state"))
+            self._reset_chat(self.session_value(session, "chat"))
+            prompt = ('-','fr')
+            self.queue_in.put(prompt if session is None else Traced(prompt, TraceContext(session)))
 
-    def _reset_chat_handler(self):
+    def _reset_chat_handler(self, phase_state):
         """
         Invoke the ChatHandler's reset logic, if available.
         """
         if hasattr(self.client, "reset"):
-            self.client.reset()
+            self.client.reset(phase_state)
         else:
             logger.warning("ChatHandler has no reset() method.")
 
-    def _reset_chat(self):
+    def _reset_chat(self, chat):
         #TODO shut up ! stop stream ????
-        self.chat.buffer = []
+        chat.clear()
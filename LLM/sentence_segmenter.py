@@ -0,0 +1,133 @@
+import re
+
+# words followed by a period that does not end the sentence (lowercase, without their final period)
+ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "etc", "e.g", "i.e", "cf", "approx", "fig", "inc",
+    "ltd", "co", "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+    "mme", "mlle", "mgr", "av", "sra", "srta", "dra", "ud", "uds", "p.ex",
+}
+
+# sentence-ending punctuation, possibly followed by closing quotes or brackets, then whitespace
+BOUNDARY = re.compile(r"[.!?…]+[\"'”’»)\]]*\s+|\n\s*\n\s*")
+# punctuation or whitespace at the very end, which may be the start of a boundary
+TRAILING_PUNCTUATION = re.compile(r"[.!?…\"'”’»)\]]*\s*\Z")
+LAST_WORD = re.compile(r"(\S+)\Z")
+# where the first chunk may be cut before the end of its sentence: a comma, semicolon, colon or dash
+CLAUSE = re.compile(r"[,;:](?=\s)|\s[-–—](?=\s)")
+# longest text a clause boundary can start with before its whitespace
+CLAUSE_LOOKBACK = 2
+
+
+class SentenceSegmenter:
+    """
+    Splits text streamed by a language model into sentences as soon as their end is certain.
+    Only the text received since the last sentence is kept, and only the part not scanned yet is scanned again, so
+    that segmenting an answer is linear in its length.
+    A period ends a sentence when followed by whitespace then by something other than a lowercase letter, and when it
+    does not close an abbreviation (including dotted ones like "U.S."), an initial or a list number. Decimals have no whitespace after their point.
+
+    What is returned is chunked for the TTS: with `first_chunk_min_chars`, the first chunk of an answer is cut at the
+    first clause boundary (comma, semicolon, colon, dash) past that length, to start speaking before the end of a
+    long first sentence. With `min_chunk_chars`, the next sentences are grouped into chunks of at least that length,
+    which the TTS synthesizes more efficiently than short sentences one by one. 0 disables either.
+    """
+
+    def __init__(self, first_chunk_min_chars=0, min_chunk_chars=0, abbreviations=ABBREVIATIONS):
+        self.first_chunk_min_chars = first_chunk_min_chars
+        self.min_chunk_chars = min_chunk_chars
+        self.abbreviations = abbreviations
+        self.buffer = ""
+        self.position = 0
+        self.clause_position = 0
+        self.grouped = ""
+        self.chunks = 0
+
+    def push(self, text):
+        """
+        Adds the streamed `text` and returns the chunks it completes.
+        """
+        self.buffer += text
+        chunks = []
+        for sentence in self.sentences():
+            if self.chunks and self.grouped:
+                sentence = f"{self.grouped} {sentence}"
+            if self.chunks and len(sentence) < self.min_chunk_chars:
+                self.grouped = sentence
+                continue
+            self.grouped = ""
+            chunks.append(sentence)
+            self.chunks += 1
+        if not self.chunks and self.first_chunk_min_chars:
+            clause = self.first_clause()
+            if clause:
+                chunks.append(clause)
+                self.chunks += 1
+        return chunks
+
+    def flush(self):
+        """
+        Returns the text left after the last chunk, and starts over.
+        """
+        rest = " ".join(text for text in (self.grouped, self.buffer.strip()) if text)
+        self.buffer = ""
+        self.position = 0
+        self.clause_position = 0
+        self.grouped = ""
+        self.chunks = 0
+        return rest
+
+    def first_clause(self):
+        start = max(self.clause_position, self.first_chunk_min_chars)
+        match = CLAUSE.search(self.buffer, start)
+        if match is None or match.end() == len(self.buffer):
+            # the whitespace a boundary needs may still be coming
+            self.clause_position = max(start, len(self.buffer) - CLAUSE_LOOKBACK)
+            return None
+        clause = self.buffer[:match.end()].strip().rstrip("-–—").strip()
+        self.buffer = self.buffer[match.end():].lstrip()
+        self.position = 0
+        self.clause_position = 0
+        return clause
+
+    def sentences(self):
+        """
+        Yields the sentences of the buffer whose end is certain, and removes them from the buffer.
+        """
+        while True:
+            match = BOUNDARY.search(self.buffer, self.position)
+            if match is None:
+                # e.g. a period or the first line break of a blank line, whose end comes with the next text
+                self.position = TRAILING_PUNCTUATION.search(self.buffer, self.position).start()
+                break
+            if set(match.group()) & set(".!?…") == {"."}:
+                if match.end() == len(self.buffer):
+                    # whether the sentence ends depends on what comes next
+                    self.position = match.start()
+                    break
+                if not self.ends_sentence(match):
+                    self.position = match.end()
+                    continue
+            sentence = self.buffer[:match.end()].strip()
+            self.buffer = self.buffer[match.end():]
+            self.position = 0
+            self.clause_position = 0
+            if sentence:
+                yield sentence
+
+    def ends_sentence(self, match):
+        if self.buffer[match.end()].islower():
+            return False
+        before = self.buffer[:match.start()]
+        word = LAST_WORD.search(before)
+        if word is None:
+            return True
+        word = word.group(1).lstrip("\"'“‘«([").lower()
+        if word in self.abbreviations:
+            return False
+        if all(len(letter) == 1 and letter.isalpha() for letter in word.split(".")):
+            # an initial or a dotted abbreviation, e.g. "J. R. R. Tolkien", "J.R.R. Tolkien" or "U.S."
+            return False
+        if word.isdigit() and before.strip() == word:
+            # a list number, e.g. "1. First"
+            return False
+        return True
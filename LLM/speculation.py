@@ -0,0 +1,127 @@
+import logging
+import queue
+import re
+import threading
+import time
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def _words(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def extends(text, speculated):
+    """
+    Whether the transcript `text` is the `speculated` one followed by more words or punctuation at most. Any word
+    inserted or changed within the speculated part, e.g. a "not", can change the meaning of the answer.
+    """
+    words, speculated_words = _words(text), _words(speculated)
+    return words[:len(speculated_words)] == speculated_words
+
+
+class Speculation:
+    """
+    Response generated in the background from a partial transcript, before the final transcript is known.
+    `generate(is_cancelled)` must return a generator of the handler outputs whose return value is the generated text.
+    The outputs are buffered until `outputs` is iterated, and those it yielded are kept in `delivered`. If the
+    generation fails, `error` holds the exception.
+    """
+
+    def __init__(self, text, language_code, generate, cancel_signal=None):
+        self.text = text
+        self.language_code = language_code
+        self.result = None
+        self.error = None
+        self.delivered = []
+        self._cancel_signal = cancel_signal
+        self._epoch = cancel_signal.epoch if cancel_signal is not None else None
+        self._cancelled = threading.Event()
+        self._outputs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, args=(generate,), daemon=True)
+        self._thread.start()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set() or (
+            self._cancel_signal is not None and self._cancel_signal.is_cancelled(self._epoch)
+        )
+
+    def _run(self, generate):
+        try:
+            generator = generate(self.is_cancelled)
+            while True:
+                self._outputs.put(next(generator))
+        except StopIteration as stop:
+            self.result = stop.value
+        except Exception as e:
+            logger.exception("Speculative generation failed")
+            self.error = e
+        finally:
+            self._outputs.put(_DONE)
+
+    def cancel(self):
+        self._cancelled.set()
+        self._thread.join()
+
+    def outputs(self):
+        """
+        Yields the outputs as they are generated and returns the return value of the generation.
+        """
+        while True:
+            output = self._outputs.get()
+            if output is _DONE:
+                return self.result
+            self.delivered.append(output)
+            yield output
+
+
+class Speculator:
+    """
+    Starts the response of a language model handler from a partial transcript once it has been stable for
+    `stable_ms`, and hands it over if the final transcript matches. There is at most one speculation per session.
+    """
+
+    def __init__(self, stable_ms):
+        self.stable_time = stable_ms / 1000
+        self.speculations = {}
+
+    def wait_stable(self, queue_in):
+        """
+        Returns True if nothing arrived in `queue_in` during `stable_ms`.
+        """
+        deadline = perf_counter() + self.stable_time
+        while perf_counter() < deadline:
+            if not queue_in.empty():
+                return False
+            time.sleep(0.01)
+        return True
+
+    def start(self, session, text, language_code, generate, cancel_signal=None):
+        self.cancel(session)
+        logger.debug(f"speculating on '{text}'")
+        self.speculations[session] = Speculation(text, language_code, generate, cancel_signal)
+
+    def take(self, session, text, language_code):
+        """
+        Returns the speculation of `session` if `text` extends the transcript it was started from, otherwise cancels it.
+        """
+        speculation = self.speculations.pop(session, None)
+        if speculation is None:
+            return None
+        if (
+            speculation.language_code == language_code
+            and not speculation.is_cancelled()
+            and extends(text, speculation.text)
+        ):
+            return speculation
+        logger.debug(f"final transcript does not match the speculation on '{speculation.text}'")
+        speculation.cancel()
+        return None
+
+    def cancel(self, session):
+        speculation = self.speculations.pop(session, None)
+        if speculation is not None:
+            speculation.cancel()
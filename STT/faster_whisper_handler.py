@@ -1,11 +1,11 @@
 import logging
 import os
-from time import perf_counter
 
 from faster_whisper import WhisperModel
 from rich.console import Console
 
 from baseHandler import BaseHandler
+from utils.messages import LocalAgreement, PartialAudio, PartialTranscript
 
 console = Console()
 
@@ -15,8 +15,13 @@ logger = logging.getLogger(__name__)
 class FasterWhisperSTTHandler(BaseHandler):
     """
     Handles the Speech To Text generation using a Whisper model.
+    Partial utterances are transcribed as in WhisperSTTHandler.
     """
 
+    trace_stage = "stt_done"
+    accepts_partials = True
+    session_state = ("agreement", "final_candidate")
+
     def setup(
         self,
         model_name: str = "tiny.en",
@@ -25,16 +30,13 @@ class FasterWhisperSTTHandler(BaseHandler):
         gen_kwargs={},
     ):
         self.gen_kwargs = self.adapt_gen_kwargs(gen_kwargs)
+        self.agreement = LocalAgreement()
+        self.final_candidate = None
 
         os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
         self.model = WhisperModel(model_name, device=device, compute_type=compute_type)
 
-    def process(self, audio):
-        logger.debug("infering faster whisper...")
-
-        global pipeline_start
-        pipeline_start = perf_counter()
-
+    def transcribe(self, audio):
         segments, info = self.model.transcribe(audio, **self.gen_kwargs)
         output_text = []
 
@@ -44,7 +46,34 @@ class FasterWhisperSTTHandler(BaseHandler):
             )
             output_text.append(segment.text)
 
-        pred_text = " ".join(output_text).strip()
+        return " ".join(output_text).strip()
+
+    def process_partial(self, partial):
+        logger.debug("infering faster whisper on partial utterance...")
+        pred_text = self.transcribe(partial.audio)
+        self.final_candidate = (pred_text, partial.speech_end) if partial.final_candidate else None
+        if self.agreement.update(pred_text.split()) and not self.downstream_busy():
+            yield PartialTranscript(self.agreement.text, session=self.session)
+
+    def hold_segment(self, audio):
+        # the candidate, if any, was transcribed before speech went on: the segment is longer than it looks
+        self.final_candidate = None
+        super().hold_segment(audio)
+
+    def process(self, audio):
+        if isinstance(audio, PartialAudio):
+            yield from self.process_partial(audio)
+            return
+
+        candidate, self.final_candidate = self.final_candidate, None
+        self.agreement.reset()
+        if candidate is not None and candidate[1] <= len(audio):
+            # the utterance ended with the silence the candidate was transcribed at: only silence was added since
+            logger.debug("reusing the transcript of the last partial utterance")
+            pred_text = candidate[0]
+        else:
+            logger.debug("infering faster whisper...")
+            pred_text = self.transcribe(audio)
 
         logger.debug("finished whisper inference")
         if pred_text:
@@ -1,4 +1,3 @@
-from time import perf_counter
 from transformers import (
     AutoProcessor,
     AutoModelForSpeechSeq2Seq
@@ -6,6 +5,7 @@ from transformers import (
 import torch
 from copy import copy
 from baseHandler import BaseHandler
+from utils.messages import LocalAgreement, PartialAudio, PartialTranscript
 from rich.console import Console
 import logging
 
@@ -31,8 +31,14 @@ SUPPORTED_LANGUAGES = [
 class WhisperSTTHandler(BaseHandler):
     """
     Handles the Speech To Text generation using a Whisper model.
+    With streaming transcription, the partial utterances sent by the VAD are transcribed as they grow and the words
+    agreed on by consecutive hypotheses are sent as partial transcripts.
     """
 
+    trace_stage = "stt_done"
+    accepts_partials = True
+    session_state = ("last_language", "agreement", "final_candidate")
+
     def setup(
         self,
         model_name="distil-whisper/distil-large-v3",
@@ -50,6 +56,9 @@ class WhisperSTTHandler(BaseHandler):
         self.last_language = language if language != "auto" else None
         if self.last_language is not None:
             self.gen_kwargs["language"] = self.last_language
+        self.agreement = LocalAgreement()
+        # transcript of the partial utterance ending where the trailing silence started
+        self.final_candidate = None
 
         self.processor = AutoProcessor.from_pretrained(model_name)
         self.model = AutoModelForSpeechSeq2Seq.from_pretrained(
@@ -114,12 +123,7 @@ class WhisperSTTHandler(BaseHandler):
                 f"{self.__class__.__name__}:  warmed up! time: {start_event.elapsed_time(end_event) * 1e-3:.3f} s"
             )
 
-    def process(self, spoken_prompt):
-        logger.debug("infering whisper...")
-
-        global pipeline_start
-        pipeline_start = perf_counter()
-
+    def transcribe(self, spoken_prompt):
         input_features = self.prepare_model_inputs(spoken_prompt)
         pred_ids = self.model.generate(input_features, **self.gen_kwargs)
         language_code = self.processor.tokenizer.decode(pred_ids[0, 1])[2:-2]  # remove "<|" and "|>"
@@ -138,11 +142,39 @@ class WhisperSTTHandler(BaseHandler):
         )[0]
         language_code = self.processor.tokenizer.decode(pred_ids[0, 1])[2:-2] # remove "<|" and "|>"
 
+        if self.start_language == "auto":
+            language_code += "-auto"
+        return pred_text, language_code
+
+    def process_partial(self, partial):
+        logger.debug("infering whisper on partial utterance...")
+        pred_text, language_code = self.transcribe(partial.audio)
+        self.final_candidate = (pred_text, language_code, partial.speech_end) if partial.final_candidate else None
+        if self.agreement.update(pred_text.split()) and not self.downstream_busy():
+            yield PartialTranscript(self.agreement.text, language_code, session=self.session)
+
+    def hold_segment(self, audio):
+        # the candidate, if any, was transcribed before speech went on: the segment is longer than it looks
+        self.final_candidate = None
+        super().hold_segment(audio)
+
+    def process(self, spoken_prompt):
+        if isinstance(spoken_prompt, PartialAudio):
+            yield from self.process_partial(spoken_prompt)
+            return
+
+        candidate, self.final_candidate = self.final_candidate, None
+        self.agreement.reset()
+        if candidate is not None and candidate[2] <= len(spoken_prompt):
+            # the utterance ended with the silence the candidate was transcribed at: only silence was added since
+            logger.debug("reusing the transcript of the last partial utterance")
+            pred_text, language_code = candidate[:2]
+        else:
+            logger.debug("infering whisper...")
+            pred_text, language_code = self.transcribe(spoken_prompt)
+
         logger.debug("finished whisper inference")
         console.print(f"[yellow]USER: {pred_text}")
         logger.debug(f"Language Code Whisper: {language_code}")
 
-        if self.start_language == "auto":
-            language_code += "-auto"
-            
         yield (pred_text, language_code)
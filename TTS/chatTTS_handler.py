@@ -1,9 +1,10 @@
 import ChatTTS
 import logging
 from baseHandler import BaseHandler
-import librosa
 import numpy as np
 from rich.console import Console
+from utils.framer import AudioFramer
+from utils.resampler import StreamingResampler, resample
 import torch
 
 logging.basicConfig(
@@ -15,6 +16,9 @@ console = Console()
 
 
 class ChatTTSHandler(BaseHandler):
+    trace_stage = "tts_first_chunk"
+    session_attributes = ("cancel_signal", "should_listen")
+
     def setup(
         self,
         should_listen,
@@ -57,26 +61,26 @@ class ChatTTSHandler(BaseHandler):
 
         if self.stream:
             wavs = [np.array([])]
+            resampler = StreamingResampler(24000, 16000)
+            framer = AudioFramer(self.chunk_size)
             for gen in wavs_gen:
+                if self.is_cancelled():
+                    break
                 if gen[0] is None or len(gen[0]) == 0:
-                    self.should_listen.set()
-                    return
-                audio_chunk = librosa.resample(gen[0], orig_sr=24000, target_sr=16000)
-                audio_chunk = (audio_chunk * 32768).astype(np.int16)[0]
-                while len(audio_chunk) > self.chunk_size:
-                    yield audio_chunk[: self.chunk_size]  # Return the first chunk_size samples of the audio data
-                    audio_chunk = audio_chunk[self.chunk_size :]  # Remove the samples that have already been returned
-                yield np.pad(audio_chunk, (0, self.chunk_size - len(audio_chunk)))
+                    break
+                # samples short of a whole chunk are carried over to the next generated chunk
+                yield from framer(resampler(gen[0][0]))
+            if not self.is_cancelled():
+                yield from framer(resampler.flush())
+                yield from framer.flush()
         else:
             wavs = wavs_gen
             if len(wavs[0]) == 0:
                 self.should_listen.set()
                 return
-            audio_chunk = librosa.resample(wavs[0], orig_sr=24000, target_sr=16000)
-            audio_chunk = (audio_chunk * 32768).astype(np.int16)
-            for i in range(0, len(audio_chunk), self.chunk_size):
-                yield np.pad(
-                    audio_chunk[i : i + self.chunk_size],
-                    (0, self.chunk_size - len(audio_chunk[i : i + self.chunk_size])),
-                )
+            audio_chunk = resample(wavs[0], 24000, 16000)
+            for frame in AudioFramer(self.chunk_size).frames(audio_chunk):
+                if self.is_cancelled():
+                    break
+                yield frame
         self.should_listen.set()
@@ -1,9 +1,10 @@
 from transformers import VitsModel, AutoTokenizer
 import torch
-import numpy as np
-import librosa
 from rich.console import Console
 from baseHandler import BaseHandler
+from TTS.model_pool import ModelPool
+from utils.framer import AudioFramer
+from utils.resampler import resample
 import logging
 
 logging.basicConfig(
@@ -57,6 +58,9 @@ WHISPER_LANGUAGE_TO_FACEBOOK_LANGUAGE = {
 }
 
 class FacebookMMSTTSHandler(BaseHandler):
+    trace_stage = "tts_first_chunk"
+    session_attributes = ("cancel_signal", "should_listen")
+
     def setup(
         self,
         should_listen,
@@ -65,6 +69,8 @@ class FacebookMMSTTSHandler(BaseHandler):
         language="en",
         stream=True,
         chunk_size=512,
+        preload_languages="",
+        pool_memory_mb=2048,
         **kwargs
     ):
         self.should_listen = should_listen
@@ -73,16 +79,23 @@ class FacebookMMSTTSHandler(BaseHandler):
         self.stream = stream
         self.chunk_size = chunk_size
         self.language = language
+        # models of the languages used so far, so that switching back to one of them is immediate
+        self.models = ModelPool(self._load_model, pool_memory_mb)
 
         self.load_model(self.language)
         self.warmup()
+        languages = [code.strip() for code in preload_languages.split(",") if code.strip()]
+        if languages:
+            self.models.preload(languages)
+
+    def _load_model(self, language_code):
+        model_name = f"facebook/mms-tts-{WHISPER_LANGUAGE_TO_FACEBOOK_LANGUAGE[language_code]}"
+        logger.info(f"Loading model: {model_name}")
+        return VitsModel.from_pretrained(model_name).to(self.device), AutoTokenizer.from_pretrained(model_name)
 
     def load_model(self, language_code):
         try:
-            model_name = f"facebook/mms-tts-{WHISPER_LANGUAGE_TO_FACEBOOK_LANGUAGE[language_code]}"
-            logger.info(f"Loading model: {model_name}")
-            self.model = VitsModel.from_pretrained(model_name).to(self.device)
-            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+            self.model, self.tokenizer = self.models.get(language_code)
             self.language = language_code
         except KeyError:
             logger.warning(f"Unsupported language: {language_code}. Falling back to English.")
@@ -151,21 +164,12 @@ class FacebookMMSTTSHandler(BaseHandler):
         audio_numpy = audio_output.cpu().numpy().squeeze()
         logger.debug(f"Raw audio shape: {audio_numpy.shape}, dtype: {audio_numpy.dtype}")
         
-        audio_resampled = librosa.resample(audio_numpy, orig_sr=self.model.config.sampling_rate, target_sr=16000)
+        audio_resampled = resample(audio_numpy, self.model.config.sampling_rate, 16000)
         logger.debug(f"Resampled audio shape: {audio_resampled.shape}, dtype: {audio_resampled.dtype}")
         
-        audio_int16 = (audio_resampled * 32768).astype(np.int16)
-        logger.debug(f"Final audio shape: {audio_int16.shape}, dtype: {audio_int16.dtype}")
-
-        if self.stream:
-            for i in range(0, len(audio_int16), self.chunk_size):
-                chunk = audio_int16[i:i + self.chunk_size]
-                yield np.pad(chunk, (0, self.chunk_size - len(chunk)))
-        else:
-            for i in range(0, len(audio_int16), self.chunk_size):
-                yield np.pad(
-                    audio_int16[i : i + self.chunk_size],
-                    (0, self.chunk_size - len(audio_int16[i : i + self.chunk_size])),
-                )
+        for frame in AudioFramer(self.chunk_size).frames(audio_resampled):
+            if self.is_cancelled():
+                break
+            yield frame
 
         self.should_listen.set()
\ No newline at end of file
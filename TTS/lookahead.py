@@ -0,0 +1,79 @@
+import logging
+
+from LLM.speculation import Speculation
+from utils.messages import PartialMessage, SessionEnd, SpeechSegment
+from utils.trace import unwrap
+
+logger = logging.getLogger(__name__)
+
+
+class Lookahead:
+    """
+    Synthesis of the sentence waiting next in the input queue of a TTS handler, started while the current sentence is
+    still being synthesized. Its frames are buffered (see Speculation) until the handler gets to that sentence.
+    Peeking needs a queue.Queue, e.g. a BoundedQueue: with other queues, nothing is started ahead.
+    With the multi-session server, the synthesis belongs to the session of the sentence, whose cancel signal stops it.
+    """
+
+    def __init__(self, queue_in):
+        self.queue_in = queue_in
+        self.pending = None
+
+    def peek(self):
+        """
+        Returns the sentence waiting next in the input queue and its trace, if any.
+        """
+        if not hasattr(self.queue_in, "mutex"):
+            return None, None
+        with self.queue_in.mutex:
+            if not self.queue_in.queue:
+                return None, None
+            item, trace = unwrap(self.queue_in.queue[0])
+        if isinstance(item, (bytes, PartialMessage, SpeechSegment, SessionEnd)):
+            return None, None
+        return item, trace
+
+    def start(self, synthesis, cancel_signal=None):
+        """
+        Starts synthesizing the next sentence, unless already done. `synthesis(sentence)` returns the function
+        `generate(is_cancelled)` of a Speculation yielding its frames, or None to leave it to the handler.
+        `cancel_signal` stops a sentence that belongs to no session.
+        """
+        if self.pending is not None:
+            return
+        sentence, trace = self.peek()
+        if sentence is None:
+            return
+        session = trace.session if trace is not None else None
+        if session is not None:
+            cancel_signal = session.cancel_signal
+        generate = synthesis(sentence)
+        if generate is None:
+            return
+        logger.debug(f"synthesizing '{sentence}' ahead")
+        self.pending = (sentence, session, Speculation(sentence, None, generate, cancel_signal))
+
+    def take(self, sentence):
+        """
+        Returns the synthesis started ahead for `sentence`, the item just taken from the queue, if any. Any other
+        synthesis started ahead is cancelled: its sentence was flushed from the queue.
+        """
+        pending, self.pending = self.pending, None
+        if pending is None:
+            return None
+        started_for, _, speculation = pending
+        if started_for is sentence and not speculation.is_cancelled():
+            return speculation
+        speculation.cancel()
+        return None
+
+    def cancel(self, session=None):
+        """
+        Cancels the synthesis started ahead, only if it belongs to `session` when one is given.
+        """
+        if self.pending is None:
+            return
+        _, started_for, speculation = self.pending
+        if session is None or started_for is session:
+            speculation.cancel()
+            self.pending = None
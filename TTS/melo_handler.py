@@ -1,9 +1,11 @@
 from melo.api import TTS
 import logging
 from baseHandler import BaseHandler
-import librosa
 import numpy as np
 from rich.console import Console
+from TTS.model_pool import ModelPool
+from utils.framer import AudioFramer
+from utils.resampler import resample
 import torch
 
 logger = logging.getLogger(__name__)
@@ -29,7 +31,13 @@ WHISPER_LANGUAGE_TO_MELO_SPEAKER = {
 }
 
 
+MELO_SPEED = 1.1
+
+
 class MeloTTSHandler(BaseHandler):
+    trace_stage = "tts_first_chunk"
+    session_attributes = ("cancel_signal", "should_listen")
+
     def setup(
         self,
         should_listen,
@@ -38,24 +46,90 @@ class MeloTTSHandler(BaseHandler):
         speaker_to_id="en",
         gen_kwargs={},  # Unused
         blocksize=512,
+        cache=None,
+        prewarm_texts=(),
+        preload_languages="",
+        pool_memory_mb=2048,
     ):
         self.should_listen = should_listen
         self.device = device
         self.language = language
-        self.model = TTS(
-            language=WHISPER_LANGUAGE_TO_MELO_LANGUAGE[self.language], device=device
-        )
+        # models of the languages used so far, so that switching back to one of them is immediate
+        self.models = ModelPool(self.load_model, pool_memory_mb)
+        self.model = self.models.get(self.language)
         self.speaker_id = self.model.hps.data.spk2id[
             WHISPER_LANGUAGE_TO_MELO_SPEAKER[self.language]
         ]
         self.blocksize = blocksize
+        self.cache = cache
         logger.info(f"Warming up {self.__class__.__name__} with language {speaker_to_id}")
         self.warmup()
+        if cache is not None:
+            self.prewarm(prewarm_texts)
+        languages = [code.strip() for code in preload_languages.split(",") if code.strip()]
+        if languages:
+            self.models.preload(languages)
+
+    def load_model(self, language_code):
+        return TTS(language=WHISPER_LANGUAGE_TO_MELO_LANGUAGE[language_code], device=self.device)
 
     def warmup(self):
         logger.info(f"Warming up {self.__class__.__name__}")
         _ = self.model.tts_to_file("text", self.speaker_id, quiet=True)
 
+    def prewarm(self, texts):
+        """
+        Synthesizes the sentences said word for word, e.g. the questions of a scenario, that are not cached yet.
+        Items are texts or (text, language code) pairs, like the items of the input queue.
+        """
+        language = self.language
+        for text in texts:
+            if isinstance(text, tuple):
+                text, language_code = text
+                self.use_language(language_code)
+            key = self.cache_key(text)
+            if key not in self.cache:
+                logger.info(f"Caching the audio of '{text}'")
+                self.cache.put(key, self.synthesize(text))
+        self.use_language(language)
+
+    def use_language(self, language_code):
+        """
+        Switches to the model and speaker of `language_code`, if Melo supports it.
+        """
+        if self.language == language_code:
+            return
+        console.print(f"[green]Language code: {language_code}")
+        try:
+            self.model = self.models.get(language_code)
+            self.speaker_id = self.model.hps.data.spk2id[
+                WHISPER_LANGUAGE_TO_MELO_SPEAKER[language_code]
+            ]
+            self.language = language_code
+        except KeyError:
+            console.print(
+                f"[red]Language {language_code} not supported by Melo. Using {self.language} instead."
+            )
+
+    def cache_key(self, text):
+        return self.cache.key(text, voice=self.speaker_id, language=self.language, model="melo", speed=MELO_SPEED)
+
+    def synthesize(self, text):
+        """
+        Returns the 16 kHz int16 audio of `text`, empty if it failed.
+        """
+        try:
+            audio_chunk = self.model.tts_to_file(
+                text, self.speaker_id, quiet=True, speed=MELO_SPEED
+            )
+        except (AssertionError, RuntimeError) as e:
+            logger.error(f"Error in MeloTTSHandler: {e}")
+            audio_chunk = np.array([])
+        if len(audio_chunk) == 0:
+            return np.zeros(0, dtype=np.int16)
+        audio_chunk = resample(audio_chunk, 44100, 16000)
+        return (audio_chunk * 32768).astype(np.int16)
+
     def process(self, llm_sentence):
         language_code = None
 
@@ -64,21 +138,8 @@ class MeloTTSHandler(BaseHandler):
 
         console.print(f"[green]ASSISTANT: {llm_sentence}")
 
-        if language_code is not None and self.language != language_code:
-            console.print(f"[green]Language code: {language_code}")
-            try:
-                self.model = TTS(
-                    language=WHISPER_LANGUAGE_TO_MELO_LANGUAGE[language_code],
-                    device=self.device,
-                )
-                self.speaker_id = self.model.hps.data.spk2id[
-                    WHISPER_LANGUAGE_TO_MELO_SPEAKER[language_code]
-                ]
-                self.language = language_code
-            except KeyError:
-                console.print(
-                    f"[red]Language {language_code} not supported by Melo. Using {self.language} instead."
-                )
+        if language_code is not None:
+            self.use_language(language_code)
 
         if self.device == "mps":
             import time
@@ -90,22 +151,25 @@ class MeloTTSHandler(BaseHandler):
                 time.time() - start
             )  # Removing this line makes it fail more often. I'm looking into it.
 
-        try:
-            audio_chunk = self.model.tts_to_file(
-                llm_sentence, self.speaker_id, quiet=True, speed=1.1
-            )
-        except (AssertionError, RuntimeError) as e:
-            logger.error(f"Error in MeloTTSHandler: {e}")
-            audio_chunk = np.array([])
+        audio_chunk = None
+        if self.cache is not None:
+            key = self.cache_key(llm_sentence)
+            audio_chunk = self.cache.get(key)
+        if audio_chunk is None:
+            audio_chunk = self.synthesize(llm_sentence)
+            if self.cache is not None:
+                self.cache.put(key, audio_chunk)
         if len(audio_chunk) == 0:
             self.should_listen.set()
             return
-        audio_chunk = librosa.resample(audio_chunk, orig_sr=44100, target_sr=16000)
-        audio_chunk = (audio_chunk * 32768).astype(np.int16)
-        for i in range(0, len(audio_chunk), self.blocksize):
-            yield np.pad(
-                audio_chunk[i : i + self.blocksize],
-                (0, self.blocksize - len(audio_chunk[i : i + self.blocksize])),
-            )
+        for frame in AudioFramer(self.blocksize).frames(audio_chunk):
+            if self.is_cancelled():
+                break
+            yield frame
 
         self.should_listen.set()
+
+    def cleanup(self):
+        if self.cache is not None:
+            self.cache.log_stats(self.__class__.__name__)
+        super().cleanup()
@@ -0,0 +1,88 @@
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def model_bytes(model):
+    """
+    Memory taken by the parameters and buffers of a torch module, or of the modules of a tuple.
+    """
+    if isinstance(model, tuple):
+        return sum(model_bytes(part) for part in model)
+    tensors = []
+    if hasattr(model, "parameters"):
+        tensors += list(model.parameters())
+    if hasattr(model, "buffers"):
+        tensors += list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class ModelPool:
+    """
+    TTS models by language, loaded by `load(language)` on first use and kept for the next ones, so that switching
+    language is a lookup. The least recently used models are evicted once the pool takes more than `max_memory_mb`
+    (0 for no limit), except the last loaded one. The handlers keep a reference to the model in use.
+    `preload` loads models in a background thread; a model requested while it is loading is waited for.
+    Errors of `load` (e.g. KeyError for an unsupported language) are raised by `get`.
+    """
+
+    def __init__(self, load, max_memory_mb=0):
+        self.load = load
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self.models = OrderedDict()
+        self.sizes = {}
+        self.loading = {}
+        self.lock = threading.Lock()
+
+    def get(self, language):
+        with self.lock:
+            if language in self.models:
+                self.models.move_to_end(language)
+                return self.models[language]
+            loaded = self.loading.get(language)
+            if loaded is None:
+                loaded = self.loading[language] = threading.Event()
+                loader = True
+            else:
+                loader = False
+        if not loader:
+            loaded.wait()
+            return self.get(language)
+
+        try:
+            logger.info(f"Loading the TTS model for '{language}'")
+            model = self.load(language)
+            size = model_bytes(model)
+        except BaseException:
+            with self.lock:
+                del self.loading[language]
+            loaded.set()
+            raise
+        # stored before the load is marked done, so that no caller can find the language neither loaded nor loading
+        with self.lock:
+            self.models[language] = model
+            self.sizes[language] = size
+            del self.loading[language]
+            self._evict()
+        loaded.set()
+        return model
+
+    def _evict(self):
+        while self.max_memory_bytes and len(self.models) > 1 and sum(self.sizes.values()) > self.max_memory_bytes:
+            language, _ = self.models.popitem(last=False)
+            del self.sizes[language]
+            logger.info(f"Evicted the TTS model for '{language}' from the pool")
+
+    def preload(self, languages):
+        def run():
+            for language in languages:
+                try:
+                    self.get(language)
+                except Exception as e:
+                    logger.warning(f"Could not preload the TTS model for '{language}': {e!r}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
@@ -1,16 +1,19 @@
-from threading import Thread
-from time import perf_counter
+from threading import Lock, Thread
 from baseHandler import BaseHandler
 import numpy as np
 import torch
 from transformers import (
     AutoTokenizer,
+    StoppingCriteriaList,
 )
 from parler_tts import ParlerTTSForConditionalGeneration, ParlerTTSStreamer
-import librosa
 import logging
 from rich.console import Console
 from utils.utils import next_power_of_2
+from utils.framer import AudioFramer
+from utils.resampler import StreamingResampler
+from utils.stopping_criteria import CancelledCriteria
+from TTS.lookahead import Lookahead
 from transformers.utils.import_utils import (
     is_flash_attn_2_available,
 )
@@ -44,6 +47,9 @@ WHISPER_LANGUAGE_TO_PARLER_SPEAKER = {
 
 
 class ParlerTTSHandler(BaseHandler):
+    trace_stage = "tts_first_chunk"
+    session_attributes = ("cancel_signal", "should_listen")
+
     def setup(
         self,
         should_listen,
@@ -59,8 +65,13 @@ class ParlerTTSHandler(BaseHandler):
         play_steps_s=1,
         blocksize=512,
         use_default_speakers_list=True,
+        cache=None,
+        prewarm_texts=(),
+        lookahead=False,
     ):
         self.should_listen = should_listen
+        self.model_name = model_name
+        self.cache = cache
         self.device = device
         self.torch_dtype = getattr(torch, torch_dtype)
         self.gen_kwargs = gen_kwargs
@@ -97,13 +108,25 @@ class ParlerTTSHandler(BaseHandler):
                 self.model.forward, mode=self.compile_mode, fullgraph=True
             )
 
+        # the sampling seed is global to torch, so generations run one at a time, each from its own seed
+        self.generate_lock = Lock()
+        # synthesis of the next sentence started while the current one is being synthesized
+        self.lookahead = None
+        if lookahead and self.compile_mode:
+            logger.warning("The TTS lookahead is not compatible with compilation, whose static cache cannot be shared.")
+        elif lookahead:
+            self.lookahead = Lookahead(self.queue_in)
+
         self.warmup()
+        if cache is not None:
+            self.prewarm(prewarm_texts)
 
     def prepare_model_inputs(
         self,
         prompt,
         max_length_prompt=50,
         pad=False,
+        speaker=None,
     ):
         pad_args_prompt = (
             {"padding": "max_length", "max_length": max_length_prompt} if pad else {}
@@ -111,7 +134,7 @@ class ParlerTTSHandler(BaseHandler):
 
         description = self.description
         if self.use_default_speakers_list:
-            description = self.speaker + " " + self.description
+            description = (speaker or self.speaker) + " " + self.description
 
         tokenized_description = self.description_tokenizer(
             description, return_tensors="pt"
@@ -169,12 +192,102 @@ class ParlerTTSHandler(BaseHandler):
                 f"{self.__class__.__name__}:  warmed up! time: {start_event.elapsed_time(end_event) * 1e-3:.3f} s"
             )
 
-    def process(self, llm_sentence):
+    def prewarm(self, texts):
+        """
+        Synthesizes the sentences said word for word, e.g. the questions of a scenario, that are not cached yet.
+        Items are texts or (text, language code) pairs, like the items of the input queue.
+        """
+        for item in texts:
+            text, speaker = self.sentence_speaker(item)
+            key = self.cache_key(text, speaker)
+            if key not in self.cache:
+                logger.info(f"Caching the audio of '{text}'")
+                frames = list(self.stream_frames(text, tts_gen_kwargs=self.generation_inputs(text, speaker)))
+                if frames:
+                    self.cache.put(key, np.concatenate(frames))
+
+    def cache_key(self, text, speaker=None):
+        return self.cache.key(text, voice=f"{speaker or self.speaker}: {self.description}", model=self.model_name)
+
+    def sentence_speaker(self, llm_sentence):
+        """
+        Splits an item of the input queue into its text and the speaker saying it.
+        """
         if isinstance(llm_sentence, tuple):
             llm_sentence, language_code = llm_sentence
-            self.speaker = WHISPER_LANGUAGE_TO_PARLER_SPEAKER.get(language_code, "Jason")
-            
+            return llm_sentence, WHISPER_LANGUAGE_TO_PARLER_SPEAKER.get(language_code, "Jason")
+        return llm_sentence, self.speaker
+
+    def process(self, llm_sentence):
+        started = self.lookahead.take(llm_sentence) if self.lookahead is not None else None
+        llm_sentence, self.speaker = self.sentence_speaker(llm_sentence)
+
         console.print(f"[green]ASSISTANT: {llm_sentence}")
+        if started is not None:
+            logger.debug("using the synthesis started ahead")
+            frames = self.started_frames(started, llm_sentence)
+        else:
+            frames = self.stream_frames(llm_sentence)
+        if self.cache is None:
+            yield from self.with_lookahead(frames)
+            self.should_listen.set()
+            return
+
+        key = self.cache_key(llm_sentence)
+        audio = self.cache.get(key)
+        if audio is not None:
+            if started is not None:
+                # the synthesis started ahead is not needed, free the GPU for the next sentence
+                started.cancel()
+            for frame in self.with_lookahead(AudioFramer(self.blocksize).frames(audio)):
+                if self.is_cancelled():
+                    break
+                yield frame
+        else:
+            synthesized = []
+            for frame in self.with_lookahead(frames):
+                synthesized.append(frame)
+                yield frame
+            # a synthesis started ahead that failed may have yielded part of the sentence
+            if synthesized and not self.is_cancelled() and (started is None or started.error is None):
+                self.cache.put(key, np.concatenate(synthesized))
+        self.should_listen.set()
+
+    def started_frames(self, started, llm_sentence):
+        """
+        Yields the frames of the synthesis started ahead, or synthesizes `llm_sentence` again if it failed before
+        yielding any: once part of the sentence is played, the rest of it is skipped rather than said twice.
+        """
+        yielded = False
+        for frame in started.outputs():
+            yielded = True
+            yield frame
+        if started.error is None:
+            return
+        if yielded:
+            logger.warning("The synthesis started ahead failed midway, skipping the rest of the sentence")
+            return
+        logger.warning("The synthesis started ahead failed, synthesizing the sentence again")
+        yield from self.stream_frames(llm_sentence)
+
+    def with_lookahead(self, frames):
+        """
+        Yields `frames`, starting the synthesis of the next sentence as soon as it is queued.
+        """
+        for frame in frames:
+            yield frame
+            if self.lookahead is not None:
+                # does nothing while a synthesis started ahead is pending
+                self.lookahead.start(self.lookahead_synthesis, self.cancel_signal)
+
+    def lookahead_synthesis(self, llm_sentence):
+        text, speaker = self.sentence_speaker(llm_sentence)
+        if self.cache is not None and self.cache_key(text, speaker) in self.cache:
+            return None
+        tts_gen_kwargs = self.generation_inputs(text, speaker)
+        return lambda is_cancelled: self.stream_frames(text, is_cancelled, tts_gen_kwargs)
+
+    def generation_inputs(self, llm_sentence, speaker=None):
         nb_tokens = len(self.prompt_tokenizer(llm_sentence).input_ids)
 
         pad_args = {}
@@ -185,31 +298,68 @@ class ParlerTTSHandler(BaseHandler):
             pad_args["pad"] = True
             pad_args["max_length_prompt"] = pad_length
 
-        tts_gen_kwargs = self.prepare_model_inputs(
+        return self.prepare_model_inputs(
             llm_sentence,
+            speaker=speaker,
             **pad_args,
         )
 
+    def stream_frames(self, llm_sentence, is_cancelled=None, tts_gen_kwargs=None):
+        """
+        Synthesizes `llm_sentence`, yielding frames of 16 kHz int16 audio as they are generated.
+        """
+        is_cancelled = is_cancelled or self.is_cancelled
+        if tts_gen_kwargs is None:
+            tts_gen_kwargs = self.generation_inputs(llm_sentence)
+
         streamer = ParlerTTSStreamer(
             self.model, device=self.device, play_steps=self.play_steps
         )
-        tts_gen_kwargs = {"streamer": streamer, **tts_gen_kwargs}
-        torch.manual_seed(0)
-        thread = Thread(target=self.model.generate, kwargs=tts_gen_kwargs)
+        tts_gen_kwargs = {
+            "streamer": streamer,
+            "stopping_criteria": StoppingCriteriaList(
+                [CancelledCriteria(is_cancelled)]
+            ),
+            **tts_gen_kwargs,
+        }
+        errors = []
+        thread = Thread(target=self.seeded_generate, args=(errors,), kwargs=tts_gen_kwargs)
         thread.start()
 
-        for i, audio_chunk in enumerate(streamer):
-            global pipeline_start
-            if i == 0 and "pipeline_start" in globals():
-                logger.info(
-                    f"Time to first audio: {perf_counter() - pipeline_start:.3f}"
-                )
-            audio_chunk = librosa.resample(audio_chunk, orig_sr=44100, target_sr=16000)
-            audio_chunk = (audio_chunk * 32768).astype(np.int16)
-            for i in range(0, len(audio_chunk), self.blocksize):
-                yield np.pad(
-                    audio_chunk[i : i + self.blocksize],
-                    (0, self.blocksize - len(audio_chunk[i : i + self.blocksize])),
-                )
-
-        self.should_listen.set()
+        # the filter state and the samples short of a whole block are carried over from one streamed chunk to the next
+        resampler = StreamingResampler(44100, 16000)
+        framer = AudioFramer(self.blocksize)
+        for audio_chunk in streamer:
+            if is_cancelled():
+                # generation stops at the next step, drain the streamer
+                continue
+            yield from framer(resampler(audio_chunk))
+        if errors:
+            raise errors[0]
+        if not is_cancelled():
+            yield from framer(resampler.flush())
+            yield from framer.flush()
+
+    def seeded_generate(self, errors, **tts_gen_kwargs):
+        try:
+            # a synthesis started ahead waits for the current one, rather than reseeding while it samples
+            with self.generate_lock:
+                torch.manual_seed(0)
+                self.model.generate(**tts_gen_kwargs)
+        except Exception as e:
+            logger.exception("Parler-TTS generation failed")
+            errors.append(e)
+            # otherwise the streamer waits for audio forever
+            tts_gen_kwargs["streamer"].end()
+
+    def end_session(self):
+        if self.lookahead is not None:
+            self.lookahead.cancel(self.session)
+        super().end_session()
+
+    def cleanup(self):
+        if self.lookahead is not None:
+            self.lookahead.cancel()
+        if self.cache is not None:
+            self.cache.log_stats(self.__class__.__name__)
+        super().cleanup()
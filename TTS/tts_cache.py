@@ -0,0 +1,88 @@
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class TTSCache:
+    """
+    Content-addressed cache of synthesized sentences, as 16 kHz int16 audio, keyed by everything that determines the
+    audio (see `key`).
+    Recently used sentences are kept in memory up to `max_memory_mb`. With `cache_dir`, every sentence is also written
+    to a raw int16 file there, memory-mapped when read back, so that the cache survives restarts.
+    """
+
+    def __init__(self, cache_dir=None, max_memory_mb=64):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(text, voice=None, language=None, model=None, speed=None):
+        description = json.dumps([text, voice, language, model, speed], default=str)
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pcm")
+
+    def __contains__(self, key):
+        return key in self.memory or bool(self.cache_dir and os.path.exists(self._path(key)))
+
+    def get(self, key):
+        audio = self.memory.get(key)
+        if audio is not None:
+            self.memory.move_to_end(key)
+        elif self.cache_dir and os.path.exists(self._path(key)) and os.path.getsize(self._path(key)):
+            audio = np.memmap(self._path(key), dtype=np.int16, mode="r")
+            self._remember(key, audio)
+        if audio is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return audio
+
+    def put(self, key, audio):
+        audio = np.ascontiguousarray(audio, dtype=np.int16)
+        if len(audio) == 0:
+            return
+        self._remember(key, audio)
+        if self.cache_dir:
+            # written under another name first, so that a sentence is never read half written
+            path = self._path(key)
+            audio.tofile(f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+
+    def _remember(self, key, audio):
+        if key in self.memory:
+            self.memory_bytes -= self.memory.pop(key).nbytes
+        self.memory[key] = audio
+        self.memory_bytes += audio.nbytes
+        while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+
+    def log_stats(self, name):
+        if self.hits + self.misses:
+            logger.info(
+                f"{name} cache: {self.hits} hits out of {self.hits + self.misses} sentences "
+                f"({100 * self.hits / (self.hits + self.misses):.1f}%)"
+            )
+
+
+def scenario_questions(config_file):
+    """
+    Fixed questions of the phases of a pulsochat scenario, which are said word for word.
+    """
+    with open(config_file) as f:
+        config = json.load(f)
+    return [phase["question"] for phase in config.get("scenario", []) if phase.get("question")]
@@ -0,0 +1,123 @@
+import logging
+import threading
+from time import perf_counter
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class VADStream:
+    """
+    Per-stream handle of a BatchedVADScheduler, used by a VADIterator in place of the model.
+    It keeps the recurrent state of its stream between frames.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.state = None
+        self.context = None
+        self.frame = None
+        self.prob = None
+
+    def reset_states(self):
+        self.state, self.context = self.scheduler.model.initial_state(1, self.scheduler.sampling_rate)
+
+    def __call__(self, x, sampling_rate):
+        if sampling_rate != self.scheduler.sampling_rate:
+            raise ValueError(
+                f"The batched VAD runs at {self.scheduler.sampling_rate} Hz, got {sampling_rate} Hz."
+            )
+        frame = x.numpy() if torch.is_tensor(x) else np.asarray(x, dtype=np.float32)
+        return torch.tensor([self.scheduler.submit(self, frame)])
+
+    def close(self):
+        self.scheduler.unregister(self)
+
+
+class BatchedVADScheduler:
+    """
+    Scores the frames of several audio streams (one per session) with a single batched forward of a model exposing
+    `initial_state` and `forward`, such as SileroOnnxModel.
+    Each stream thread submits its current frame and waits. The scheduler runs a batch as soon as every registered
+    stream has submitted a frame, or `max_wait_ms` after the first frame arrived, then hands each stream its probability
+    and updated state.
+    """
+
+    def __init__(self, stop_event, model, sampling_rate=16000, max_wait_ms=5):
+        self.stop_event = stop_event
+        self.model = model
+        self.sampling_rate = sampling_rate
+        self.max_wait = max_wait_ms / 1000
+        self.streams = []
+        self.pending = []
+        self.condition = threading.Condition()
+        self.batches = 0
+        self.frames = 0
+
+    def stream(self):
+        stream = VADStream(self)
+        stream.reset_states()
+        with self.condition:
+            self.streams.append(stream)
+        return stream
+
+    def unregister(self, stream):
+        with self.condition:
+            if stream in self.streams:
+                self.streams.remove(stream)
+            if stream in self.pending:
+                self.pending.remove(stream)
+            self.condition.notify_all()
+
+    def submit(self, stream, frame):
+        with self.condition:
+            stream.frame = frame
+            stream.prob = None
+            self.pending.append(stream)
+            self.condition.notify_all()
+            while stream.prob is None:
+                if self.stop_event.is_set():
+                    return 0.0
+                self.condition.wait(0.1)
+            return stream.prob
+
+    def collect(self):
+        """
+        Waits for the frames of the next batch and takes them out of the pending list.
+        """
+        with self.condition:
+            while not self.pending:
+                if self.stop_event.is_set():
+                    return []
+                self.condition.wait(0.1)
+            deadline = perf_counter() + self.max_wait
+            while len(self.pending) < len(self.streams):
+                remaining = deadline - perf_counter()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch, self.pending = self.pending, []
+        return batch
+
+    def run(self):
+        while not self.stop_event.is_set():
+            batch = self.collect()
+            if not batch:
+                continue
+            frames = np.stack([stream.frame for stream in batch])
+            state = np.concatenate([stream.state for stream in batch], axis=1)
+            context = np.concatenate([stream.context for stream in batch], axis=0)
+            probs, state, context = self.model.forward(frames, state, context, self.sampling_rate)
+            with self.condition:
+                for i, stream in enumerate(batch):
+                    stream.state = state[:, i:i + 1]
+                    stream.context = context[i:i + 1]
+                    stream.prob = float(probs[i])
+                self.condition.notify_all()
+            self.batches += 1
+            self.frames += len(batch)
+        if self.batches:
+            logger.info(f"Batched VAD: {self.frames / self.batches:.2f} frames per batch on average")
+        logger.info("Batched VAD scheduler stopped.")
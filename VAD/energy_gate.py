@@ -0,0 +1,49 @@
+import numpy as np
+
+# the noise floor follows quieter frames at once and rises by FLOOR_RISE_DB per second otherwise
+FLOOR_RISE_DB = 1.0
+MIN_DB = -100.0
+# the gate opens `margin_db` above the noise floor and closes HYSTERESIS_DB below that
+HYSTERESIS_DB = 3.0
+
+
+class EnergyGate:
+    """
+    Tells whether a frame is loud enough to be worth running the VAD model on, from its RMS level relative to an
+    estimate of the noise floor, with hysteresis so that the gate does not flicker around its threshold.
+    """
+
+    def __init__(self, margin_db=10.0, sampling_rate=16000):
+        self.margin_db = margin_db
+        self.sampling_rate = sampling_rate
+        self.floor_db = None
+        self.is_open = True
+        self.frames = 0
+        self.skipped = 0
+
+    @staticmethod
+    def level_db(samples):
+        if len(samples) == 0:
+            return MIN_DB
+        power = float(np.dot(samples, samples)) / len(samples)
+        return max(10 * np.log10(power), MIN_DB) if power > 0 else MIN_DB
+
+    def __call__(self, samples):
+        """
+        Updates the noise floor with `samples` and returns whether the gate is open.
+        """
+        level = self.level_db(samples)
+        if self.floor_db is None or level < self.floor_db:
+            self.floor_db = level
+        else:
+            self.floor_db += FLOOR_RISE_DB * len(samples) / self.sampling_rate
+
+        threshold = self.floor_db + self.margin_db
+        if self.is_open:
+            self.is_open = level >= threshold - HYSTERESIS_DB
+        else:
+            self.is_open = level >= threshold
+        self.frames += 1
+        if not self.is_open:
+            self.skipped += 1
+        return self.is_open
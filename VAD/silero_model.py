@@ -0,0 +1,94 @@
+import logging
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+VAD_BACKENDS = ("hub", "jit", "onnx")
+
+
+class SileroOnnxModel:
+    """
+    Silero VAD v5 run with ONNX Runtime, from a local `silero_vad.onnx` file.
+    The recurrent state (shape (2, batch, 128)) and the audio context prepended to each frame are explicit,
+    so that `forward` can score frames of several independent streams in one call.
+    Calling the model directly scores the frames of a single stream, keeping its state, like the TorchScript model.
+    """
+
+    STATE_SIZE = 128
+
+    def __init__(self, path, num_threads=1):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            logger.error("The onnx VAD backend needs ONNX Runtime. You might need to run: pip install onnxruntime")
+            raise e
+        options = onnxruntime.SessionOptions()
+        options.inter_op_num_threads = 1
+        options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.reset_states()
+
+    @staticmethod
+    def context_size(sampling_rate):
+        return 64 if sampling_rate == 16000 else 32
+
+    def initial_state(self, batch_size, sampling_rate):
+        """
+        Returns the (state, context) of `batch_size` streams starting from silence.
+        """
+        state = np.zeros((2, batch_size, self.STATE_SIZE), dtype=np.float32)
+        context = np.zeros((batch_size, self.context_size(sampling_rate)), dtype=np.float32)
+        return state, context
+
+    def forward(self, frames, state, context, sampling_rate):
+        """
+        Scores a (batch, samples) array of frames. Returns the speech probability of each frame along with
+        the updated state and context.
+        """
+        frames = np.concatenate([context, frames], axis=1)
+        probs, state = self.session.run(
+            None,
+            {"input": frames, "state": state, "sr": np.array(sampling_rate, dtype=np.int64)},
+        )
+        return probs[:, 0], state, frames[:, -context.shape[1]:]
+
+    def reset_states(self):
+        self._state = None
+        self._context = None
+        self._sampling_rate = None
+
+    def __call__(self, x, sampling_rate):
+        frames = x.numpy() if torch.is_tensor(x) else np.asarray(x, dtype=np.float32)
+        if frames.ndim == 1:
+            frames = frames[np.newaxis]
+        if self._state is None or sampling_rate != self._sampling_rate:
+            self._state, self._context = self.initial_state(len(frames), sampling_rate)
+            self._sampling_rate = sampling_rate
+        probs, self._state, self._context = self.forward(frames, self._state, self._context, sampling_rate)
+        return torch.from_numpy(probs)
+
+
+def load_silero_vad(backend="hub", model_path=None):
+    """
+    Loads Silero VAD:
+    - "hub": downloads the TorchScript model with torch.hub (needs network access or a warm hub cache).
+    - "jit": loads a local TorchScript `silero_vad.jit` file.
+    - "onnx": runs a local `silero_vad.onnx` file with ONNX Runtime.
+    """
+    if backend not in VAD_BACKENDS:
+        raise ValueError(f"Unknown VAD backend '{backend}'. Choose one of {', '.join(VAD_BACKENDS)}.")
+    if backend == "hub":
+        model, _ = torch.hub.load("snakers4/silero-vad", "silero_vad")
+        return model
+    if model_path is None:
+        raise ValueError(f"The {backend} VAD backend needs --vad_model_path.")
+    logger.info(f"Loading Silero VAD from {model_path}")
+    if backend == "jit":
+        model = torch.jit.load(model_path, map_location="cpu")
+        model.eval()
+        return model
+    return SileroOnnxModel(model_path)
@@ -0,0 +1,105 @@
+import logging
+import threading
+
+from utils.audio_buffers import GrowableBuffer
+
+logger = logging.getLogger(__name__)
+
+# each block is enhanced along with the audio before it (CONTEXT_MS) and after it (LOOKAHEAD_MS), whose enhanced
+# version is thrown away, so that the filters are warmed up and the block edges have no artifacts
+BLOCK_MS = 500
+CONTEXT_MS = 250
+LOOKAHEAD_MS = 50
+
+
+class StreamingEnhancer:
+    """
+    Enhances an utterance block by block while it is being recorded, so that little is left to enhance when it ends.
+    `enhance` is the function enhancing a whole array, e.g. VADHandler.enhance_audio.
+    The blocks are enhanced by a worker thread, so that `update` returns at once and the VAD keeps up with the audio;
+    `finish` waits for the block in progress, if any, and enhances the rest itself.
+    """
+
+    def __init__(self, enhance, sampling_rate=16000):
+        self.enhance = enhance
+        self.block_samples = int(sampling_rate * BLOCK_MS / 1000)
+        self.context_samples = int(sampling_rate * CONTEXT_MS / 1000)
+        self.lookahead_samples = int(sampling_rate * LOOKAHEAD_MS / 1000)
+        self.condition = threading.Condition()
+        self.busy = False
+        self.closed = False
+        self.failed = False
+        self.reset()
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def reset(self):
+        with self.condition:
+            while self.busy:
+                self.condition.wait()
+            # copy of the utterance, only ever appended to, that the worker reads while the VAD records the next frames
+            self.input = GrowableBuffer()
+            self.output = GrowableBuffer()
+            self.failed = False
+
+    def update(self, audio):
+        """
+        Hands over `audio`, the utterance recorded so far, whose complete blocks the worker enhances.
+        """
+        with self.condition:
+            if len(audio) > len(self.input):
+                self.input.append(audio[len(self.input):])
+                self.condition.notify_all()
+
+    def finish(self, audio):
+        """
+        Enhances what is left of `audio`, the whole utterance, and returns its enhanced version.
+        """
+        with self.condition:
+            while self.busy:
+                self.condition.wait()
+            if len(self.output) < len(audio):
+                self._enhance_block(audio, len(audio), 0)
+            enhanced = self.output.view()[:len(audio)]
+            self.input = GrowableBuffer()
+            self.output = GrowableBuffer()
+            self.failed = False
+        return enhanced
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def _block_ready(self):
+        return not self.failed and len(self.input) - len(self.output) >= self.block_samples + self.lookahead_samples
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while not self.closed and not self._block_ready():
+                    self.condition.wait()
+                if self.closed:
+                    return
+                self.busy = True
+                audio, output = self.input.view(), self.output
+            try:
+                # outside of the lock, for update not to wait
+                self._enhance_block(audio, len(output) + self.block_samples, self.lookahead_samples, output)
+            except Exception:
+                logger.exception("Streaming enhancement failed, the rest of the utterance is enhanced at its end")
+                with self.condition:
+                    # no more blocks for this utterance
+                    self.failed = True
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    def _enhance_block(self, audio, end, lookahead, output=None):
+        output = self.output if output is None else output
+        start = len(output)
+        begin = max(0, start - self.context_samples)
+        enhanced = self.enhance(audio[begin:end + lookahead])
+        output.append(enhanced[start - begin:end - begin])
@@ -1,4 +1,6 @@
 import torchaudio
+from VAD.silero_model import load_silero_vad
+from VAD.streaming_enhancement import StreamingEnhancer
 from VAD.vad_iterator import VADIterator
 from baseHandler import BaseHandler
 import numpy as np
@@ -6,6 +8,8 @@ import torch
 from rich.console import Console
 
 from utils.utils import int2float
+from utils.messages import PartialAudio, SpeechSegment
+from utils.trace import TraceContext
 from df.enhance import enhance, init_df
 import logging
 import tempfile
@@ -20,8 +24,12 @@ class VADHandler(BaseHandler):
     """
     Handles voice activity detection. When voice activity is detected, audio will be accumulated until the end of speech is detected and then passed
     to the following part.
+    Speech going on past `max_speech_ms` is cut at its least speech-like point and the first part is passed on right
+    away as a SpeechSegment.
     """
 
+    trace_stage = "vad_end"
+
     def setup(
         self,
         should_listen,
@@ -32,67 +40,179 @@ class VADHandler(BaseHandler):
         max_speech_ms=float("inf"),
         speech_pad_ms=30,
         audio_enhancement=False,
+        streaming_enhancement=False,
+        vad_backend="hub",
+        vad_model_path=None,
+        model=None,
+        partial_interval_ms=0,
+        adaptive_endpointing=False,
+        energy_gate_db=0,
     ):
         self.should_listen = should_listen
         self.sample_rate = sample_rate
         self.min_silence_ms = min_silence_ms
         self.min_speech_ms = min_speech_ms
         self.max_speech_ms = max_speech_ms
-        self.model, _ = torch.hub.load("snakers4/silero-vad", "silero_vad")
+        # a shared model can be given, e.g. a stream of the batched VAD scheduler
+        self.model = model if model is not None else load_silero_vad(vad_backend, vad_model_path)
         self.iterator = VADIterator(
             self.model,
             threshold=thresh,
             sampling_rate=sample_rate,
             min_silence_duration_ms=min_silence_ms,
             speech_pad_ms=speech_pad_ms,
-            osc_client = self.osc_client
+            osc_client = self.osc_client,
+            adaptive_endpointing=adaptive_endpointing,
+            max_speech_duration_ms=max_speech_ms,
+            energy_gate_db=energy_gate_db,
         )
+        self.segmented = False
+        self.partial_interval_samples = int(sample_rate * partial_interval_ms / 1000)
+        self.last_partial_samples = 0
         self.audio_enhancement = audio_enhancement
         if audio_enhancement:
             self.enhanced_model, self.df_state, _ = init_df()
+        # enhances the utterance while it is being recorded rather than once it ended
+        self.enhancer = None
+        if audio_enhancement and streaming_enhancement:
+            self.enhancer = StreamingEnhancer(self.enhance_audio, sample_rate)
 
     def process(self, audio_chunk):
         audio_int16 = np.frombuffer(audio_chunk, dtype=np.int16)
         audio_float32 = int2float(audio_int16)
+        was_triggered = self.iterator.triggered
+        was_silent = bool(self.iterator.temp_end)
         vad_output = self.iterator(torch.from_numpy(audio_float32))
+        if self.iterator.triggered and not was_triggered:
+            self.last_partial_samples = 0
+            if self.enhancer is not None:
+                self.enhancer.reset()
+            if self.cancel_signal is not None and self.answering():
+                logger.debug("VAD: start of speech, cancelling the current answer")
+                self.cancel_signal.trigger()
+        if vad_output is not None and self.iterator.triggered:
+            # forced split of an over-long utterance, which goes on
+            logger.debug(f"VAD: speech segment of {len(vad_output) / self.sample_rate:.2f}s")
+            self.segmented = True
+            self.last_partial_samples = 0
+            yield SpeechSegment(self.finish_enhancement(vad_output), session=self.session)
+            return
+        if self.enhancer is not None and self.iterator.triggered:
+            self.enhancer.update(self.iterator.buffer.view())
+        if self.partial_interval_samples and self.iterator.triggered:
+            yield from self.partial_audio(entered_silence=bool(self.iterator.temp_end) and not was_silent)
         if vad_output is not None and len(vad_output) != 0:
             logger.debug("VAD: end of speech detected")
-            array = torch.cat(vad_output).cpu().numpy()
+            endpoint = self.iterator.last_endpoint
+            logger.debug(
+                f"VAD: waited {endpoint['silence_ms']:.0f} ms of silence, {endpoint['saved_ms']:.0f} ms less than the fixed timeout"
+            )
+            array = vad_output
             duration_ms = len(array) / self.sample_rate * 1000
-            if duration_ms < self.min_speech_ms or duration_ms > self.max_speech_ms:
+            # the end of a segmented utterance is passed on however short, its beginning is already on its way
+            segmented, self.segmented = self.segmented, False
+            if duration_ms < self.min_speech_ms and not segmented:
                 logger.debug(
                     f"audio input of duration: {len(array) / self.sample_rate}s, skipping"
                 )
             else:
                 self.should_listen.clear()
                 logger.debug("Stop listening")
-                if self.audio_enhancement:
-                    if self.sample_rate != self.df_state.sr():
-                        audio_float32 = torchaudio.functional.resample(
-                            torch.from_numpy(array),
-                            orig_freq=self.sample_rate,
-                            new_freq=self.df_state.sr(),
-                        )
-                        enhanced = enhance(
-                            self.enhanced_model,
-                            self.df_state,
-                            audio_float32.unsqueeze(0),
-                        )
-                        enhanced = torchaudio.functional.resample(
-                            enhanced,
-                            orig_freq=self.df_state.sr(),
-                            new_freq=self.sample_rate,
-                        )
-                    else:
-                        enhanced = enhance(
-                            self.enhanced_model, self.df_state, audio_float32
-                        )
-                    array = enhanced.numpy().squeeze()
+                array = self.finish_enhancement(array)
                 #tmp_wav_path = self.save_audio_to_tmp_wav(array, self.sample_rate)
                 #logger.info(f"Temporary WAV file saved at: {tmp_wav_path}")
+                self.trace = TraceContext(session=self.session)
                 yield array
 
 
+    def answering(self):
+        """
+        Whether the assistant is answering: from the end of an utterance until the TTS is done with the answer, during
+        which should_listen is clear, then while its audio waits to be sent.
+        """
+        return not self.should_listen.is_set() or self.cancel_signal.pending()
+
+    def enhance_audio(self, array):
+        if not self.audio_enhancement:
+            return array
+        audio = torch.from_numpy(array)
+        if self.sample_rate != self.df_state.sr():
+            audio = torchaudio.functional.resample(
+                audio,
+                orig_freq=self.sample_rate,
+                new_freq=self.df_state.sr(),
+            )
+            enhanced = enhance(
+                self.enhanced_model,
+                self.df_state,
+                audio.unsqueeze(0),
+            )
+            enhanced = torchaudio.functional.resample(
+                enhanced,
+                orig_freq=self.df_state.sr(),
+                new_freq=self.sample_rate,
+            )
+        else:
+            enhanced = enhance(self.enhanced_model, self.df_state, audio.unsqueeze(0))
+        return enhanced.numpy().squeeze()
+
+    def finish_enhancement(self, array):
+        """
+        Returns the enhanced version of the utterance `array`, most of which is already enhanced in streaming mode.
+        """
+        if self.enhancer is not None:
+            return self.enhancer.finish(array)
+        return self.enhance_audio(array)
+
+    def partial_audio(self, entered_silence):
+        """
+        Sends the utterance in progress for streaming transcription, every `partial_interval_ms` of new audio if the
+        STT is not busy, and always when a silence starts since it may be the end of the utterance.
+        """
+        audio = self.iterator.buffer.view()
+        if not entered_silence:
+            if self.iterator.temp_end:
+                # nothing new to transcribe during the silence
+                return
+            if len(audio) - self.last_partial_samples < self.partial_interval_samples:
+                return
+            if self.downstream_busy():
+                return
+        self.last_partial_samples = len(audio)
+        # enhancement is applied to the final utterance only, so its transcript may differ
+        final_candidate = entered_silence and not self.audio_enhancement
+        speech_end = self.iterator.post_start if final_candidate else None
+        yield PartialAudio(audio, final_candidate, session=self.session, speech_end=speech_end)
+
+    def end_session(self):
+        self.iterator.reset_states()
+        self.segmented = False
+        if self.enhancer is not None:
+            self.enhancer.reset()
+        if self.cancel_signal is not None:
+            # stop the answer to the client who left
+            self.cancel_signal.trigger()
+        super().end_session()
+
+    def cleanup(self):
+        stats = self.iterator.endpoint_stats
+        if stats["turns"]:
+            logger.info(
+                f"VAD endpointing: {stats['turns']} turns, {stats['silence_ms'] / stats['turns']:.0f} ms of silence "
+                f"waited per turn on average, {stats['saved_ms']:.0f} ms saved in total"
+            )
+        gate = self.iterator.energy_gate
+        if gate is not None and gate.frames:
+            logger.info(
+                f"VAD energy gate: {gate.skipped} of {gate.frames} frames ({100 * gate.skipped / gate.frames:.1f}%) "
+                "skipped without running the model"
+            )
+        if hasattr(self.model, "close"):
+            self.model.close()
+        if self.enhancer is not None:
+            self.enhancer.close()
+        super().cleanup()
+
     def save_audio_to_tmp_wav(self, audio_array, sample_rate):
         # Create a temporary file that won't be automatically deleted
         tmp_file = tempfile.NamedTemporaryFile(suffix='.wav', delete=False)
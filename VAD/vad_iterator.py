@@ -1,5 +1,28 @@
+import logging
+from collections import deque
+
+import numpy as np
 import torch
 
+from utils.audio_buffers import GrowableBuffer, RingBuffer
+from VAD.energy_gate import EnergyGate
+
+# Adaptive endpointing: the silence timeout is scaled by FINISHED_TURN_FACTOR when the speech probability drops
+# by at least SHARP_DROP (from the mean of the last SPEECH_HISTORY speech frames) after FINISHED_TURN_MS of speech,
+# and by FRAGMENT_FACTOR after less than FINISHED_TURN_MS of speech.
+SPEECH_HISTORY = 4
+SHARP_DROP = 0.6
+FINISHED_TURN_MS = 1000
+FINISHED_TURN_FACTOR = 0.5
+FRAGMENT_FACTOR = 1.5
+
+# Forced split: an utterance reaching max_speech_duration_ms is cut at its least speech-like frame among
+# the last SPLIT_SEARCH_MS.
+SPLIT_SEARCH_MS = 1000
+
+logger = logging.getLogger(__name__)
+
+
 class VADIterator:
     def __init__(
         self,
@@ -8,7 +31,10 @@ class VADIterator:
         sampling_rate: int = 16000,
         min_silence_duration_ms: int = 100,
         speech_pad_ms: int = 30,
-        osc_client=None
+        osc_client=None,
+        adaptive_endpointing: bool = False,
+        max_speech_duration_ms: float = float("inf"),
+        energy_gate_db: float = 0,
     ):
         self.model = model
         self.threshold = threshold
@@ -22,6 +48,21 @@ class VADIterator:
 
         self.min_silence_samples = int(sampling_rate * min_silence_duration_ms / 1000)
         self.speech_pad_samples = int(sampling_rate * speech_pad_ms / 1000)
+        self.initial_buffer_samples = 8 * sampling_rate
+        self.adaptive_endpointing = adaptive_endpointing
+        self.finished_turn_samples = int(sampling_rate * FINISHED_TURN_MS / 1000)
+        self.max_speech_samples = None
+        if max_speech_duration_ms != float("inf"):
+            self.max_speech_samples = int(sampling_rate * max_speech_duration_ms / 1000)
+        self.split_search_samples = int(sampling_rate * SPLIT_SEARCH_MS / 1000)
+        if self.max_speech_samples is not None:
+            self.split_search_samples = min(self.split_search_samples, self.max_speech_samples // 2)
+        # silence waited before the ends of speech, and waiting saved compared to min_silence_duration_ms
+        self.endpoint_stats = {"turns": 0, "silence_ms": 0.0, "saved_ms": 0.0}
+        self.last_endpoint = None
+        self.pre_buffer = RingBuffer(self.speech_pad_samples)  # Pre-padding buffer.
+        # Skips the model on frames close to the noise floor while no speech is going on.
+        self.energy_gate = EnergyGate(energy_gate_db, sampling_rate) if energy_gate_db else None
         self.reset_states()
 
     def reset_states(self):
@@ -29,39 +70,46 @@ class VADIterator:
         self.triggered = False
         self.temp_end = 0
         self.current_sample = 0
-        self.buffer = []           # Main speech buffer.
-        self.pre_buffer = torch.tensor([])  # Pre-padding buffer.
-        self.post_buffer = torch.tensor([]) # Post-padding buffer.
+        self.buffer = None  # Main speech buffer, allocated at the start of speech.
+        self.pre_buffer.clear()
+        self.post_start = None  # Start of the post-padding audio in the main buffer.
+        self.speech_start = 0
+        self.silence_timeout = self.min_silence_samples
+        self.speech_probs = deque(maxlen=SPEECH_HISTORY)  # Probabilities of the last speech frames.
+        # end position in the main buffer and speech probability of each frame of the utterance
+        self.frame_ends = []
+        self.frame_probs = []
 
     @torch.no_grad()
     def __call__(self, x):
         if not torch.is_tensor(x):
             try:
-                x = torch.Tensor(x)
+                x = torch.from_numpy(np.asarray(x, dtype=np.float32))
             except Exception:
                 raise TypeError("Audio cannot be cast to tensor. Cast it manually")
+        samples = x.numpy()
 
         window_size_samples = x.shape[0]
         self.current_sample += window_size_samples
 
         # Update pre_buffer: keep the last speech_pad_samples worth of audio.
-        if self.pre_buffer.numel() == 0:
-            self.pre_buffer = x.clone()
-        else:
-            self.pre_buffer = torch.cat((self.pre_buffer, x))
-        if self.pre_buffer.numel() > self.speech_pad_samples:
-            self.pre_buffer = self.pre_buffer[-self.speech_pad_samples:]
+        self.pre_buffer.write(samples)
+
+        if self.energy_gate is not None:
+            was_open = self.energy_gate.is_open
+            if not self.energy_gate(samples) and not self.triggered:
+                if was_open:
+                    # the model resumes from silence when the gate opens again
+                    self.model.reset_states()
+                return None
 
         # Obtain speech probability.
         speech_prob = self.model(x, self.sampling_rate).item()
 
-        # If speech resumes, clear the post_buffer.
+        # If speech resumes, the transitional (post) audio already in the main buffer is kept.
         if speech_prob >= self.threshold and self.temp_end:
             # This means we had a dip but speech came back.
-            if self.post_buffer.numel() > 0:
-                # Incorporate any transitional audio back into the main buffer.
-                self.buffer.append(self.post_buffer.clone())
-                self.post_buffer = torch.tensor([])
+            self.post_start = None
             self.temp_end = 0
 
         # If speech is just starting.
@@ -70,44 +118,86 @@ class VADIterator:
                 self.osc_client.send_message("/vad_handler/speech_detected", "start")
             print("------------------- start of speech detected ----------------")
             self.triggered = True
+            self.speech_start = self.current_sample - window_size_samples
             # Start with the pre-buffer for pre-padding.
-            self.buffer = [self.pre_buffer.clone()]
-            # Clear any old post-buffer.
-            self.post_buffer = torch.tensor([])
+            self.buffer = GrowableBuffer(self.initial_buffer_samples)
+            self.buffer.append_ring(self.pre_buffer)
+            self.post_start = None
             return None
 
         # If in an active speech segment:
         if self.triggered:
-            # If the probability is below threshold (even if it's above threshold - 0.15),
-            # accumulate into post_buffer.
+            # Both speech and transitional (post) audio go to the main buffer, post audio being
+            # cut down to the padding once enough silence has been observed.
+            self.buffer.append(samples)
+            self.frame_ends.append(len(self.buffer))
+            self.frame_probs.append(speech_prob)
             if speech_prob < self.threshold:
                 # Begin tracking the moment we started to lose confidence.
                 if not self.temp_end:
                     self.temp_end = self.current_sample
-                self.post_buffer = torch.cat((self.post_buffer, x))
+                    self.post_start = len(self.buffer) - window_size_samples
+                    self.silence_timeout = self.endpoint_timeout(speech_prob)
                 # Check if enough silence has been observed.
-                if self.current_sample - self.temp_end >= self.min_silence_samples:
-                    # Once enough silence, take post_buffer as padding.
-                    if self.post_buffer.numel() >= self.speech_pad_samples:
-                        pad_chunk = self.post_buffer[:self.speech_pad_samples]
-                    else:
-                        pad_chunk = self.post_buffer.clone()
-                    self.buffer.append(pad_chunk)
+                if self.current_sample - self.temp_end >= self.silence_timeout:
+                    # Once enough silence, take post audio as padding.
+                    self.buffer.truncate(self.post_start + self.speech_pad_samples)
                     if self.osc_client:
                         self.osc_client.send_message("/vad_handler/speech_detected", "stop")
                     print("------------------- end of speech detected ----------------")
-                    utterance = self.buffer
+                    self.record_endpoint()
+                    # the buffer is handed over as is, the next utterance gets a new one
+                    utterance = self.buffer.view()
                     self.reset_states()
                     return utterance
-                else:
-                    # Not enough silence yet; wait.
-                    return None
             else:
-                # If speech probability is back above threshold,
-                # then the current chunk is considered active speech.
-                # If we had accumulated any transitional (post) audio, add it to the main buffer.
-                if self.post_buffer.numel() > 0:
-                    self.buffer.append(self.post_buffer.clone())
-                    self.post_buffer = torch.tensor([])
-                self.buffer.append(x)
+                self.speech_probs.append(speech_prob)
+                if self.max_speech_samples is not None and len(self.buffer) >= self.max_speech_samples:
+                    return self.split()
         return None
+
+    def split(self):
+        """
+        Cuts the utterance in progress in the middle of its least speech-like recent frame and returns the first
+        part. The rest stays in the main buffer and speech goes on.
+        """
+        search_start = len(self.buffer) - self.split_search_samples
+        candidates = [i for i, end in enumerate(self.frame_ends) if end > search_start]
+        lowest = min(candidates, key=lambda i: self.frame_probs[i])
+        window_size_samples = self.frame_ends[lowest] - (self.frame_ends[lowest - 1] if lowest else 0)
+        cut = self.frame_ends[lowest] - window_size_samples // 2
+        logger.debug(
+            f"forced split at {cut / self.sampling_rate:.2f}s (speech probability {self.frame_probs[lowest]:.2f})"
+        )
+
+        utterance = self.buffer.view()
+        segment, rest = utterance[:cut], utterance[cut:]
+        # the segment is handed over as is, the rest goes to a new buffer
+        self.buffer = GrowableBuffer(self.initial_buffer_samples)
+        self.buffer.append(rest)
+        self.frame_ends = [end - cut for end in self.frame_ends[lowest + 1:]]
+        self.frame_probs = self.frame_probs[lowest + 1:]
+        self.speech_start = self.current_sample - len(rest)
+        return segment
+
+    def endpoint_timeout(self, speech_prob):
+        """
+        Silence to wait for, in samples, before ending an utterance whose silence starts with a frame of
+        probability `speech_prob`.
+        """
+        if not self.adaptive_endpointing:
+            return self.min_silence_samples
+        if self.current_sample - self.speech_start < self.finished_turn_samples:
+            # a short fragment, the speaker may well go on
+            return int(self.min_silence_samples * FRAGMENT_FACTOR)
+        if self.speech_probs and np.mean(self.speech_probs) - speech_prob >= SHARP_DROP:
+            return int(self.min_silence_samples * FINISHED_TURN_FACTOR)
+        return self.min_silence_samples
+
+    def record_endpoint(self):
+        silence_ms = (self.current_sample - self.temp_end) * 1000 / self.sampling_rate
+        saved_ms = (self.min_silence_samples - self.silence_timeout) * 1000 / self.sampling_rate
+        self.last_endpoint = {"silence_ms": silence_ms, "saved_ms": saved_ms}
+        self.endpoint_stats["turns"] += 1
+        self.endpoint_stats["silence_ms"] += silence_ms
+        self.endpoint_stats["saved_ms"] += saved_ms
@@ -26,4 +26,16 @@ class FacebookMMSTTSHandlerArguments:
             "help": "The torch data type to use for the TTS model. Default is 'float32'."
         },
     )
+    facebook_mms_preload_languages: str = field(
+        default="",
+        metadata={
+            "help": "Comma separated languages whose models are loaded in the background at startup, e.g. 'fr,en', so that switching to them does not stall the conversation. Default is '' (models are loaded on first use)."
+        },
+    )
+    facebook_mms_pool_memory_mb: int = field(
+        default=2048,
+        metadata={
+            "help": "Memory the loaded models may take, in MB, before the least recently used ones are unloaded. 0 for no limit. Default is 2048."
+        },
+    )
     
@@ -69,3 +69,15 @@ class LanguageModelHandlerArguments:
             "help": "Number of interactions assitant-user to keep for the chat. None for no limitations."
         },
     )
+    lm_speculative_ms: int = field(
+        default=0,
+        metadata={
+            "help": "Speculative generation: start answering a partial transcript (see --partial_interval_ms) once it has been stable for the given number of milliseconds, and keep the answer if the final transcript matches. Default is 0 (disabled)."
+        },
+    )
+    lm_prefix_cache: bool = field(
+        default=True,
+        metadata={
+            "help": "Keep the KV cache of the conversation between turns, and of the initial chat prompt, so that each turn only prefills the new user message. Default is True."
+        },
+    )
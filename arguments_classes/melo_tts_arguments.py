@@ -21,3 +21,15 @@ class MeloTTSHandlerArguments:
             "help": "Mapping of speaker names to speaker IDs. Default is ['EN-Newest']."
         },
     )
+    melo_preload_languages: str = field(
+        default="",
+        metadata={
+            "help": "Comma separated languages whose models are loaded in the background at startup, e.g. 'fr,en', so that switching to them does not stall the conversation. Default is '' (models are loaded on first use)."
+        },
+    )
+    melo_pool_memory_mb: int = field(
+        default=2048,
+        metadata={
+            "help": "Memory the loaded models may take, in MB, before the least recently used ones are unloaded. 0 for no limit. Default is 2048."
+        },
+    )
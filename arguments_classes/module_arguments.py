@@ -69,6 +69,54 @@ class ModuleArguments:
         },
     )
 
+    max_sessions: int = field(
+        default=1,
+        metadata={
+            "help": "Number of clients served at the same time in socket mode. Above 1, each client gets its own VAD and chat history while the STT, LLM and TTS models are shared. Default is 1."
+        },
+    )
+    barge_in: bool = field(
+        default=False,
+        metadata={
+            "help": "Keep listening while the answer is generated and played, and cancel it as soon as the user speaks. Default is False."
+        },
+    )
+    process_stages: str = field(
+        default="",
+        metadata={
+            "help": "Comma separated pipeline parts to run in their own process instead of a thread, among 'vad', 'stt', 'llm' and 'tts', e.g. 'stt,tts'. Audio is passed to and from them through shared memory. Not compatible with --barge_in, --enable_osc nor --max_sessions above 1. Default is '' (all parts are threads)."
+        },
+    )
+    tts_cache: bool = field(
+        default=False,
+        metadata={
+            "help": "Cache the audio of the sentences synthesized by the melo and parler TTS, so that repeated sentences (greetings, fillers, scenario questions) are not synthesized again. With the pulsochat LLM, the questions of the scenario are synthesized at startup. Default is False."
+        },
+    )
+    tts_cache_dir: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "Directory where the TTS cache also keeps the audio of every sentence, so that it survives restarts. Default is None (memory only)."
+        },
+    )
+    tts_cache_memory_mb: int = field(
+        default=64,
+        metadata={
+            "help": "Memory used by the TTS cache for the most recently used sentences, in MB. Default is 64 (~35 minutes of audio)."
+        },
+    )
+    first_chunk_min_chars: int = field(
+        default=0,
+        metadata={
+            "help": "Cut the first chunk of each answer given to the TTS at the first comma, semicolon, colon or dash past this many characters, rather than at the end of its sentence, to start speaking sooner. Used by all the LLM handlers. Default is 0 (first chunk is a whole sentence)."
+        },
+    )
+    min_chunk_chars: int = field(
+        default=0,
+        metadata={
+            "help": "Group the sentences following the first chunk of an answer into chunks of at least this many characters, which the TTS synthesizes more efficiently. Used by all the LLM handlers. Default is 0 (one sentence per chunk)."
+        },
+    )
     enable_osc: bool = field(
         default=False,
         metadata={
@@ -99,3 +147,63 @@ class ModuleArguments:
             "help": "The port that receives OSC messages."
         },
     )
+    recv_audio_chunks_queue_size: int = field(
+        default=256,
+        metadata={
+            "help": "Maximum number of audio chunks waiting for the VAD. 0 for no limit. Default is 256 (~8 s of 32 ms chunks)."
+        },
+    )
+    recv_audio_chunks_queue_policy: str = field(
+        default="drop_oldest",
+        metadata={
+            "help": "What to do when the received audio queue is full. Either 'block', 'drop_oldest' or 'drop_newest'. Default is 'drop_oldest'."
+        },
+    )
+    spoken_prompt_queue_size: int = field(
+        default=4,
+        metadata={
+            "help": "Maximum number of utterances waiting for the STT. 0 for no limit. Default is 4."
+        },
+    )
+    spoken_prompt_queue_policy: str = field(
+        default="block",
+        metadata={
+            "help": "What to do when the utterance queue is full. Either 'block', 'drop_oldest' or 'drop_newest'. Default is 'block', since a dropped utterance is a lost turn."
+        },
+    )
+    text_prompt_queue_size: int = field(
+        default=4,
+        metadata={
+            "help": "Maximum number of transcripts waiting for the LLM. 0 for no limit. Default is 4."
+        },
+    )
+    text_prompt_queue_policy: str = field(
+        default="block",
+        metadata={
+            "help": "What to do when the transcript queue is full. Either 'block', 'drop_oldest' or 'drop_newest'. Default is 'block', since a dropped transcript is a lost turn."
+        },
+    )
+    lm_response_queue_size: int = field(
+        default=64,
+        metadata={
+            "help": "Maximum number of LLM sentences waiting for the TTS. 0 for no limit. Default is 64."
+        },
+    )
+    lm_response_queue_policy: str = field(
+        default="block",
+        metadata={
+            "help": "What to do when the LLM response queue is full. Either 'block', 'drop_oldest' or 'drop_newest'. Default is 'block'."
+        },
+    )
+    send_audio_chunks_queue_size: int = field(
+        default=512,
+        metadata={
+            "help": "Maximum number of synthesized audio chunks waiting to be sent. 0 for no limit. Default is 512 (~16 s of 32 ms chunks)."
+        },
+    )
+    send_audio_chunks_queue_policy: str = field(
+        default="block",
+        metadata={
+            "help": "What to do when the synthesized audio queue is full. Either 'block', 'drop_oldest' or 'drop_newest'. Default is 'block'."
+        },
+    )
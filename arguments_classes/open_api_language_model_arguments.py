@@ -54,4 +54,16 @@ class OpenApiLanguageModelHandlerArguments:
             "help": "The stream parameter typically indicates whether data should be transmitted in a continuous flow rather"
                     " than in a single, complete response, often used for handling large or real-time data.Default is False"
         },
-    )
\ No newline at end of file
+    )
+    open_api_history_max_tokens: int = field(
+        default=0,
+        metadata={
+            "help": "Approximate number of tokens of chat history sent with each request. Past it, the oldest messages are summarized in the background and replaced by their summary. Default is 0 (no limit but --open_api_chat_size)."
+        },
+    )
+    open_api_speculative_ms: int = field(
+        default=0,
+        metadata={
+            "help": "Speculative generation: start answering a partial transcript (see --partial_interval_ms) once it has been stable for the given number of milliseconds, and keep the answer if the final transcript matches. Default is 0 (disabled)."
+        },
+    )
@@ -65,3 +65,9 @@ class ParlerTTSHandlerArguments:
             "help": "Whether to use the default list of speakers or not."
         },
     )
+    tts_lookahead: bool = field(
+        default=False,
+        metadata={
+            "help": "Start synthesizing the next sentence of the answer while the current one is still being synthesized, so that there is no gap between sentences. Not compatible with --tts_compile_mode. Default is False."
+        },
+    )
@@ -42,3 +42,15 @@ class PulsochatLanguageModelHandlerArguments:
         },
 
     )
+    pulsochat_history_max_tokens: int = field(
+        default=2000,
+        metadata={
+            "help": "Approximate number of tokens of chat history sent with each request. Past it, the oldest messages are summarized in the background and replaced by their summary, so that prompts stay about the same size through a long session. 0 for no limit. Default is 2000."
+        },
+    )
+    pulsochat_speculative_ms: int = field(
+        default=0,
+        metadata={
+            "help": "Speculative generation: start answering a partial transcript (see --partial_interval_ms) once it has been stable for the given number of milliseconds, and keep the answer if the final transcript matches. Default is 0 (disabled)."
+        },
+    )
@@ -1,4 +1,5 @@
 from dataclasses import dataclass, field
+from typing import Optional
 
 
 @dataclass
@@ -30,7 +31,7 @@ class VADHandlerArguments:
     max_speech_ms: float = field(
         default=float("inf"),
         metadata={
-            "help": "Maximum length of continuous speech before forcing a split. Default is infinite, allowing for uninterrupted speech segments."
+            "help": "Maximum length of continuous speech before forcing a split. The utterance is cut at its least speech-like point within the last second and the first part is transcribed while the user goes on speaking. Default is infinite, allowing for uninterrupted speech segments."
         },
     )
     speech_pad_ms: int = field(
@@ -45,3 +46,39 @@ class VADHandlerArguments:
             "help": "improves sound quality by applying techniques like noise reduction, equalization, and echo cancellation. Default is False."
         },
     )
+    streaming_enhancement: bool = field(
+        default=False,
+        metadata={
+            "help": "With audio_enhancement, enhance the utterance in blocks of 500 ms while it is being recorded, instead of all at once when it ends, so that enhancement adds almost no latency. Default is False."
+        },
+    )
+    vad_backend: str = field(
+        default="hub",
+        metadata={
+            "help": "How Silero VAD is loaded and run. 'hub' downloads it with torch.hub, 'jit' loads a local TorchScript file and 'onnx' runs a local ONNX file with ONNX Runtime. Default is 'hub'."
+        },
+    )
+    vad_model_path: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "Path of the local Silero VAD model file (silero_vad.jit or silero_vad.onnx) for the 'jit' and 'onnx' backends."
+        },
+    )
+    partial_interval_ms: int = field(
+        default=0,
+        metadata={
+            "help": "Streaming transcription: while the user speaks, send the utterance in progress to the STT every given number of milliseconds so that stable partial transcripts are available before the end of speech. Supported by whisper and faster-whisper. Default is 0 (disabled)."
+        },
+    )
+    adaptive_endpointing: bool = field(
+        default=False,
+        metadata={
+            "help": "Adapt the silence waited before ending an utterance: halve min_silence_ms when the speech probability drops sharply after more than 1 s of speech, and wait 1.5 times longer after shorter fragments. Default is False."
+        },
+    )
+    energy_gate_db: float = field(
+        default=0,
+        metadata={
+            "help": "Skip the VAD model on frames less than this many dB above the estimated noise floor while no speech is going on (with 3 dB of hysteresis). The frames still feed the speech padding. 0 disables the gate. Default is 0."
+        },
+    )
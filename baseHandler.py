@@ -1,6 +1,12 @@
+from copy import deepcopy
 from time import perf_counter
 import logging
 
+from utils.latency_histogram import LatencyHistogram
+from utils.messages import PartialMessage, SessionEnd, SpeechSegment, merge_transcripts
+from utils.queues import SESSION_END
+from utils.trace import Traced, unwrap
+
 logger = logging.getLogger(__name__)
 
 
@@ -11,16 +17,43 @@ class BaseHandler:
     To stop a handler properly, set the stop_event and, to avoid queue deadlocks, place b"END" in the input queue.
     Objects placed in the input queue will be processed by the `process` method, and the yielded results will be placed in the output queue.
     The cleanup method handles stopping the handler, and b"END" is placed in the output queue.
+    Partial results sent while the user is still speaking (see utils.messages) are skipped unless `accepts_partials` is set.
+    The beginning of an over-long utterance may come first as a SpeechSegment: its outputs are held back and merged
+    into the outputs of the rest of the utterance (see `hold_segment`).
+    SESSION_END marks the disconnection of the client: the part resets its state (see `end_session`) and keeps running.
+    With the multi-session server, a SessionEnd does the same for the state of its session only.
+    When a `cancel_signal` is given, outputs of an input are discarded once the signal is triggered (barge-in),
+    and `is_cancelled` lets the implemented part stop its own work early.
+    Items may come wrapped in `Traced` along with the TraceContext of their turn: the payload is given to `process`,
+    the context is kept in `self.trace` and its `trace_stage` is marked when the first output is yielded.
+    With the multi-session server, a part shared by all the clients switches to the session of each traced item
+    before processing it (see `switch_session`).
     """
 
-    def __init__(self, stop_event, queue_in, queue_out, osc_client=None, osc_server=None, setup_args=(), setup_kwargs={}):
+    trace_stage = None
+    accepts_partials = False
+    # attributes holding per-client state: each session works on its own copy of their value after setup
+    session_state = ()
+    # attributes replaced by the attribute of the same name of the session, e.g. its should_listen event
+    session_attributes = ()
+
+    def __init__(self, stop_event, queue_in, queue_out, osc_client=None, osc_server=None, cancel_signal=None, session=None, setup_args=(), setup_kwargs={}):
         self.stop_event = stop_event
         self.queue_in = queue_in
         self.queue_out = queue_out
         self.osc_client = osc_client
         self.osc_server = osc_server
+        self.cancel_signal = cancel_signal
+        self.session = session
+        self._epoch = 0
+        self.trace = None
+        self._held_outputs = {}
         self.setup(*setup_args, **setup_kwargs)
-        self._times = []
+        self._initial_state = {name: deepcopy(getattr(self, name)) for name in self.session_state}
+        self._sessionless_state = {name: getattr(self, name) for name in self.session_state}
+        self._sessionless_attributes = {name: getattr(self, name) for name in self.session_attributes}
+        self._latency = LatencyHistogram()
+        self._last_time = None
 
         # Start OSC server if provided
         if self.osc_server:
@@ -40,25 +73,166 @@ class BaseHandler:
                 # sentinelle signal to avoid queue deadlock
                 logger.debug("Stopping thread")
                 break
+            if isinstance(input, bytes) and input == SESSION_END:
+                logger.debug(f"{self.__class__.__name__}: session ended")
+                self.end_session()
+                continue
+            if isinstance(input, SessionEnd):
+                logger.debug(f"{self.__class__.__name__}: {input.session} ended")
+                self.switch_session(input.session)
+                self.end_session()
+                continue
+            input, self.trace = unwrap(input)
+            if isinstance(input, SpeechSegment):
+                self.switch_session(input.session)
+                self.hold_segment(input.audio)
+                continue
+            if isinstance(input, PartialMessage):
+                if not self.accepts_partials:
+                    continue
+                self.switch_session(input.session)
+            elif self.trace is not None:
+                self.switch_session(self.trace.session)
+            if self.cancel_signal is not None:
+                self._epoch = self.cancel_signal.epoch
+            held = self._held_outputs.pop(self.session, None)
             start_time = perf_counter()
-            for output in self.process(input):
-                self._times.append(perf_counter() - start_time)
+            for output in self.iter_merged(self.process(input), held, partial=isinstance(input, PartialMessage)):
+                if self.is_cancelled():
+                    # keep iterating so that process can finish its bookkeeping
+                    continue
+                self._last_time = perf_counter() - start_time
+                self._latency.record(self._last_time)
                 if self.last_time > self.min_time_to_debug:
                     logger.debug(f"{self.__class__.__name__}: {self.last_time: .3f} s")
+                if self.trace is not None:
+                    if self.trace_stage:
+                        self.trace.mark(self.trace_stage)
+                    output = Traced(output, self.trace)
                 self.queue_out.put(output)
                 start_time = perf_counter()
 
         self.cleanup()
         self.queue_out.put(b"END")
 
+    def hold_segment(self, audio):
+        """
+        Processes the audio of a SpeechSegment and holds its outputs back until the end of the utterance.
+        """
+        self._held_outputs.setdefault(self.session, []).extend(self.process(audio))
+
+    def iter_merged(self, outputs, held, partial):
+        """
+        Yields `outputs` with the held outputs of the segments of the utterance merged into the first one.
+        They stay held while processing partial inputs, and are yielded on their own if the end of the utterance
+        gives no output.
+        """
+        if not held:
+            yield from outputs
+            return
+        merged = partial
+        for output in outputs:
+            if isinstance(output, PartialMessage):
+                yield merge_transcripts(held, output)
+            elif not merged:
+                merged = True
+                yield merge_transcripts(held, output)
+            else:
+                yield output
+        if partial:
+            self._held_outputs[self.session] = held
+        elif not merged:
+            yield merge_transcripts(held[:-1], held[-1])
+
     @property
     def last_time(self):
-        return self._times[-1]
+        return self._last_time
+
+    def latency_snapshot(self):
+        """
+        Count and p50/p95/p99 (in seconds) of the time taken by `process` to yield each output.
+        """
+        return self._latency.snapshot()
 
     @property
     def min_time_to_debug(self):
         return 0.001
 
+    def switch_session(self, session):
+        """
+        Swaps in the state of `session` (None for the single-client pipeline): its own copy of the
+        `session_state` attributes, created on first use, and its `session_attributes`.
+        """
+        if session is self.session:
+            return
+        state = {name: getattr(self, name) for name in self.session_state}
+        if self.session is None:
+            self._sessionless_state = state
+        else:
+            self.session.state[id(self)] = state
+
+        if session is None:
+            state = self._sessionless_state
+            attributes = self._sessionless_attributes
+        else:
+            state = session.state.get(id(self))
+            if state is None:
+                state = deepcopy(self._initial_state)
+            attributes = {name: getattr(session, name) for name in self.session_attributes}
+        for name, value in {**state, **attributes}.items():
+            setattr(self, name, value)
+        self.session = session
+
+    def end_session(self):
+        """
+        Called when the client disconnects. Restores the `session_state` attributes to their value after setup,
+        discards the outputs not consumed yet and forwards SESSION_END so that the following parts do the same.
+        With the multi-session server, only the outputs of the current session are discarded and a SessionEnd is
+        forwarded instead.
+        """
+        for name, value in self._initial_state.items():
+            setattr(self, name, deepcopy(value))
+        self._held_outputs.pop(self.session, None)
+        self.trace = None
+        if self.session is None:
+            if hasattr(self.queue_out, "flush"):
+                self.queue_out.flush()
+            self.queue_out.put(SESSION_END)
+            return
+        if hasattr(self.queue_out, "flush"):
+            self.queue_out.flush(self.session.belongs)
+        self.queue_out.put(SessionEnd(self.session))
+
+    def session_value(self, session, name):
+        """
+        Value of the `session_state` attribute `name` for `session`, whether it is swapped in or stored, so that it
+        can be updated from another thread, e.g. by an OSC command.
+        """
+        if session is self.session:
+            return getattr(self, name)
+        if session is None:
+            return self._sessionless_state[name]
+        return session.state.setdefault(id(self), deepcopy(self._initial_state))[name]
+
+    def downstream_busy(self):
+        """
+        Whether outputs are still waiting in the output queue, in which case partial results may be skipped.
+        """
+        return hasattr(self.queue_out, "empty") and not self.queue_out.empty()
+
+    def is_cancelled(self):
+        """
+        Whether the cancel signal was triggered since the current input was taken.
+        """
+        return self.cancel_signal is not None and self.cancel_signal.is_cancelled(self._epoch)
+
+    def mark_trace(self, stage):
+        """
+        Records `stage` in the TraceContext of the item being processed, if any.
+        """
+        if self.trace is not None:
+            self.trace.mark(stage)
+
     def cleanup(self):
         logger.info(f"{self.__class__.__name__}: Cleaning up...")
         if self.osc_server:
@@ -5,6 +5,8 @@ import time
 import logging
 from pythonosc.udp_client import SimpleUDPClient
 
+from utils.trace import unwrap
+
 logger = logging.getLogger(__name__)
 
 class LocalAudioStreamer:
@@ -19,13 +21,15 @@ class LocalAudioStreamer:
         list_play_chunk_size=512,
         enable_osc=False,
         osc_ip="127.0.0.1",
-        osc_port=8001
+        osc_port=8001,
+        barge_in=False,
     ):
         self.list_play_chunk_size = list_play_chunk_size
         self.input_device = input_device
         self.output_device = output_device
         self.input_channel = input_channel
         self.output_channel = output_channel
+        self.barge_in = barge_in
 
         self.stop_event = threading.Event()
         self.input_queue = input_queue
@@ -43,6 +47,9 @@ class LocalAudioStreamer:
                 logger.warning(f"Audio callback error: {status}")
 
             selected_input_channel = indata[:, self.input_channel]  # Select specified input channel
+            if self.barge_in and not self.output_queue.empty():
+                # keep feeding the VAD while playing so that the user can interrupt
+                self.input_queue.put(selected_input_channel.copy())
             if self.output_queue.empty():
                 self.input_queue.put(selected_input_channel.copy())  # Capture only the selected input channel
                 outdata[:] = 0  # Silence if no output available
@@ -53,7 +60,7 @@ class LocalAudioStreamer:
 
             else:
                 try:
-                    output_data = self.output_queue.get()
+                    output_data, trace = unwrap(self.output_queue.get())
                     if output_data.ndim == 1:
                         selected_output_channel = output_data  # Use directly if 1D
                     else:
@@ -62,6 +69,8 @@ class LocalAudioStreamer:
                     # Ensure all channels except the specified output channel are set to zero
                     outdata[:] = 0  # Default to silence
                     outdata[:, self.output_channel] = selected_output_channel  # Send audio to specified output channel
+                    if trace is not None:
+                        trace.mark("first_byte_sent")
                     # **Detect if output is non-silent**
                     if self.enable_osc:
                         if np.any(np.abs(selected_output_channel) > 0):  # Check if there is actual audio
@@ -0,0 +1,255 @@
+import socket
+import logging
+import threading
+import itertools
+from queue import Full
+from threading import Event
+
+from utils.cancellation import CancelSignal
+from utils.framer import send_frames, take_queued_frames
+from utils.messages import SessionEnd
+from utils.queues import BoundedQueue, is_control_message
+from utils.trace import Traced, unwrap
+
+logger = logging.getLogger(__name__)
+
+# seconds a client has to open its send connection after its receive one
+PAIRING_TIMEOUT_S = 10
+
+
+class Session:
+    """
+    State of one client: its sockets, its own VAD input and audio output queues, its should_listen event and
+    cancel signal, and the per-session state of the parts shared by all clients (see BaseHandler.switch_session).
+    The cancel signal stops the answers to the client when it leaves and, with barge-in, when it speaks.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, recv_conn, addr, recv_queue_size, send_queue_size):
+        self.id = next(self._ids)
+        self.addr = addr
+        self.recv_conn = recv_conn
+        self.send_conn = None
+        self.stop_event = Event()
+        self.should_listen = Event()
+        self.recv_queue = BoundedQueue(recv_queue_size, "drop_oldest", name=f"session {self.id} recv")
+        self.send_queue = BoundedQueue(send_queue_size, "block", name=f"session {self.id} send")
+        self.cancel_signal = None
+        self.state = {}
+        self.vad = None
+
+    def belongs(self, item):
+        return isinstance(item, Traced) and item.trace.session is self
+
+    def __repr__(self):
+        return f"Session({self.id}, {self.addr})"
+
+
+class SharedQueueWriter:
+    """
+    Output queue of a per-session part feeding a queue shared by all the sessions.
+    Control messages are kept to the session so that closing it does not stop the shared parts.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def put(self, item, block=True, timeout=None):
+        if is_control_message(item):
+            return
+        self.queue.put(item, block, timeout)
+
+    def empty(self):
+        return self.queue.empty()
+
+
+class SessionServer:
+    """
+    Serves several clients with a single pipeline. Each client opens a connection to the receive port then one to the
+    send port, as listen_and_play.py does; connections are paired in that order. Every session gets its own VAD,
+    created by `make_vad(session)`, while the STT, LLM and TTS parts and their models are shared. The synthesized audio
+    of the shared `queue_in` is routed to the session its turn belongs to.
+    """
+
+    def __init__(
+        self,
+        stop_event,
+        queue_in,
+        make_vad,
+        recv_host="0.0.0.0",
+        recv_port=12345,
+        send_host="0.0.0.0",
+        send_port=12346,
+        chunk_size=1024,
+        max_sessions=4,
+        recv_queue_size=256,
+        send_queue_size=512,
+        barge_in=False,
+        shared_queues=(),
+    ):
+        self.stop_event = stop_event
+        self.queue_in = queue_in
+        self.make_vad = make_vad
+        self.recv_address = (recv_host, recv_port)
+        self.send_address = (send_host, send_port)
+        self.chunk_size = chunk_size
+        self.max_sessions = max_sessions
+        self.recv_queue_size = recv_queue_size
+        self.send_queue_size = send_queue_size
+        self.barge_in = barge_in
+        # shared queues whose items of a session are flushed when its answer is cancelled
+        self.shared_queues = list(shared_queues)
+        self.sessions = []
+        self.pending_send_conns = []
+        self.lock = threading.Lock()
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self.accept_loop, args=(self.recv_address, self.on_recv_connection)),
+            threading.Thread(target=self.accept_loop, args=(self.send_address, self.on_send_connection)),
+            threading.Thread(target=self.route),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for session in list(self.sessions):
+            self.close_session(session)
+        logger.info("SessionServer stopped.")
+
+    def accept_loop(self, address, on_connection):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind(address)
+            s.listen(self.max_sessions)
+            s.settimeout(2.0)
+            logger.info(f"Session server listening on {address[0]}:{address[1]} ...")
+            while not self.stop_event.is_set():
+                try:
+                    conn, addr = s.accept()
+                except socket.timeout:
+                    continue
+                on_connection(conn, addr)
+
+    def on_recv_connection(self, conn, addr):
+        with self.lock:
+            if len(self.sessions) >= self.max_sessions:
+                logger.warning(f"Refusing {addr}: {self.max_sessions} sessions already open.")
+                conn.close()
+                return
+            session = Session(conn, addr, self.recv_queue_size, self.send_queue_size)
+            session.cancel_signal = CancelSignal([*self.shared_queues, session.send_queue], match=session.belongs)
+            self.sessions.append(session)
+            self.pair()
+
+        logger.info(f"{session} opened")
+        timer = threading.Timer(PAIRING_TIMEOUT_S, self.close_unpaired, args=(session,))
+        timer.daemon = True
+        timer.start()
+        session.vad = self.make_vad(session)
+        session.should_listen.set()
+        threading.Thread(target=session.vad.run).start()
+        threading.Thread(target=self.receive, args=(session,)).start()
+
+    def on_send_connection(self, conn, addr):
+        with self.lock:
+            self.pending_send_conns.append(conn)
+            self.pair()
+
+    def pair(self):
+        for session in self.sessions:
+            if not self.pending_send_conns:
+                return
+            if session.send_conn is None:
+                session.send_conn = self.pending_send_conns.pop(0)
+                threading.Thread(target=self.send, args=(session,)).start()
+
+    def close_unpaired(self, session):
+        if session.send_conn is None and not session.stop_event.is_set():
+            logger.warning(f"{session} opened no send connection within {PAIRING_TIMEOUT_S}s, closing it.")
+            self.close_session(session)
+
+    def receive_full_chunk(self, conn, chunk_size):
+        data = b""
+        while len(data) < chunk_size:
+            packet = conn.recv(chunk_size - len(data))
+            if not packet:
+                return None
+            data += packet
+        return data
+
+    def receive(self, session):
+        try:
+            while not self.stop_event.is_set() and not session.stop_event.is_set():
+                audio_chunk = self.receive_full_chunk(session.recv_conn, self.chunk_size)
+                if audio_chunk is None:
+                    logger.info(f"{session} closed by client.")
+                    break
+                if self.barge_in or session.should_listen.is_set():
+                    session.recv_queue.put(audio_chunk)
+        except OSError as e:
+            logger.warning(f"{session} receive error: {e}")
+        self.close_session(session)
+
+    def send(self, session):
+        while not self.stop_event.is_set():
+            audio_chunk, trace = unwrap(session.send_queue.get())
+            if isinstance(audio_chunk, bytes) and audio_chunk == b"END":
+                break
+            # frames already waiting go out in the same system call
+            queued, control = take_queued_frames(session.send_queue)
+            frames = [(audio_chunk, trace)] + queued
+            try:
+                send_frames(session.send_conn, [frame for frame, _ in frames])
+            except OSError as e:
+                logger.warning(f"{session} send error: {e}")
+                self.close_session(session)
+                break
+            for _, trace in frames:
+                if trace is not None:
+                    trace.mark("first_byte_sent")
+            if control == b"END":
+                break
+
+    def route(self):
+        """
+        Dispatches the synthesized audio of the shared TTS to the session it belongs to.
+        Audio for a session whose send queue is full is dropped, so that a slow client never stalls the others.
+        """
+        while not self.stop_event.is_set():
+            item = self.queue_in.get()
+            if isinstance(item, bytes) and item == b"END":
+                break
+            if isinstance(item, SessionEnd):
+                continue
+            _, trace = unwrap(item)
+            session = trace.session if trace is not None else None
+            if session is None or session.stop_event.is_set():
+                continue
+            try:
+                session.send_queue.put_nowait(item)
+            except Full:
+                session.send_queue.dropped += 1
+                if session.send_queue.dropped == 1 or session.send_queue.dropped % 100 == 0:
+                    logger.warning(f"{session} send queue full: dropped {session.send_queue.dropped} chunk(s)")
+
+    def close_session(self, session):
+        with self.lock:
+            if session not in self.sessions:
+                return
+            self.sessions.remove(session)
+        session.stop_event.set()
+        session.cancel_signal.trigger()
+        # goes through the VAD of the session then the shared parts, which drop its state and pending work
+        session.recv_queue.put(SessionEnd(session))
+        session.recv_queue.put(b"END")
+        session.send_queue.flush()
+        session.send_queue.put(b"END")
+        for conn in (session.recv_conn, session.send_conn):
+            if conn is not None:
+                try:
+                    conn.close()
+                except OSError:
+                    pass
+        logger.info(f"{session} closed")
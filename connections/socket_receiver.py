@@ -3,6 +3,8 @@ import logging
 import time
 from rich.console import Console
 
+from utils.queues import SESSION_END
+
 logger = logging.getLogger(__name__)
 console = Console()
 
@@ -20,10 +22,12 @@ class SocketReceiver:
         host="0.0.0.0",
         port=12345,
         chunk_size=1024,
+        barge_in=False,
     ):
         self.stop_event = stop_event
         self.queue_out = queue_out
         self.should_listen = should_listen
+        self.barge_in = barge_in
         self.chunk_size = chunk_size
         self.host = host
         self.port = port
@@ -75,11 +79,12 @@ class SocketReceiver:
                     while not self.stop_event.is_set():
                         audio_chunk = self.receive_full_chunk(conn, self.chunk_size)
                         if audio_chunk is None:
-                            # connection fermée côté client
-                            self.queue_out.put(b"END")
+                            # connection fermée côté client : on réinitialise la session sans arrêter le pipeline
+                            self.queue_out.flush()
+                            self.queue_out.put(SESSION_END)
                             logger.warning("Connection closed by client.")
                             break
-                        if self.should_listen.is_set():
+                        if self.barge_in or self.should_listen.is_set():
                             self.queue_out.put(audio_chunk)
 
                     # Une fois la boucle terminée, fermer la connexion
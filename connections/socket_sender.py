@@ -3,6 +3,10 @@ import logging
 import time
 from rich.console import Console
 
+from utils.framer import send_frames, take_queued_frames
+from utils.queues import SESSION_END
+from utils.trace import unwrap
+
 logger = logging.getLogger(__name__)
 console = Console()
 
@@ -48,16 +52,34 @@ class SocketSender:
 
                     # Étape 2 : envoyer les chunks de la queue
                     while not self.stop_event.is_set():
-                        audio_chunk = self.queue_in.get()
+                        audio_chunk, trace = unwrap(self.queue_in.get())
+                        if isinstance(audio_chunk, bytes) and audio_chunk == SESSION_END:
+                            logger.info("Client session ended, closing Sender connection.")
+                            break
+                        # frames already waiting go out in the same system call
+                        frames, control = [(audio_chunk, trace)], None
+                        if not (isinstance(audio_chunk, bytes) and audio_chunk == b"END"):
+                            queued, control = take_queued_frames(self.queue_in)
+                            frames += queued
+                            if control == b"END":
+                                frames.append((control, None))
                         try:
-                            conn.sendall(audio_chunk)
+                            send_frames(conn, [frame for frame, _ in frames])
                         except (BrokenPipeError, ConnectionResetError) as e:
                             logger.warning(f"Sender connection lost: {e}")
+                            if control is None:
+                                self.discard_until_session_end()
                             break
+                        for _, trace in frames:
+                            if trace is not None:
+                                trace.mark("first_byte_sent")
 
-                        if isinstance(audio_chunk, bytes) and audio_chunk == b"END":
+                        if isinstance(frames[-1][0], bytes) and frames[-1][0] == b"END":
                             logger.info("END signal received, closing Sender connection.")
                             break
+                        if control == SESSION_END:
+                            logger.info("Client session ended, closing Sender connection.")
+                            break
 
                     # On ferme la connexion courante avant de retenter
                     conn.close()
@@ -70,3 +92,12 @@ class SocketSender:
 
         logger.info("SocketSender stopped.")
 
+    def discard_until_session_end(self):
+        """
+        Drops the audio left for a client whose connection is lost, so that it is not sent to the next client.
+        """
+        while not self.stop_event.is_set():
+            item, _ = unwrap(self.queue_in.get())
+            if isinstance(item, bytes) and item in (SESSION_END, b"END"):
+                return
+
@@ -1,6 +1,21 @@
 import openai
 import json
-from nltk.tokenize import sent_tokenize
+
+from LLM.chat import summary_request
+from LLM.sentence_segmenter import SentenceSegmenter
+
+class PhaseState:
+    """Progress of one conversation through the scenario: its phase, whether the phase's question was asked,
+    and the number of interactions in the phase.
+    """
+
+    def __init__(self):
+        # The current phase is set externally via set_phase (by name).
+        self.current_phase = None
+        # Tracks whether the question in the current phase has already been sent.
+        self.question_asked = False
+        self.nb_interactions = 0
+
 
 class ChatHandler:
     """Manages chat interactions using an externally provided phase.
@@ -8,9 +23,11 @@ class ChatHandler:
     Each phase is defined in the configuration file by a name and consists of an optional
     question and a prompt. The set_phase method uses the phase name to update the current phase.
     All responses are streamed.
+    The progress through the scenario is kept in a PhaseState, which the methods take as `state` so that several
+    conversations can share a ChatHandler; without it, the ChatHandler's own `state` is used.
     """
 
-    def __init__(self, config, api_key, logger):
+    def __init__(self, config, api_key, logger, chunking=None):
         self.config = config
         self.api_key = api_key
         self.logger = logger
@@ -18,32 +35,31 @@ class ChatHandler:
         self.meta_prompt = config.get("meta_prompt", "")
         # Load the scenario (a list of phases) from the config.
         self.scenario = config.get("scenario", [])
-        # The current phase is set externally via set_phase (by name).
-        self.current_phase = None
-        # Tracks whether the question in the current phase has already been sent.
-        self.question_asked = False
+        self.state = PhaseState()
         self.client = openai.OpenAI()
-        self.nb_interactions=0
+        # arguments of the SentenceSegmenter cutting the streamed responses
+        self.chunking = chunking or {}
 
 
-    def set_phase(self, phase_name):
+    def set_phase(self, phase_name, state=None):
         """
         Updates the current phase by its name.
         Searches the scenario list for a phase with the matching "name".
         Resets the question_asked flag so that the phase's question (if any) will be sent.
         """
+        state = state or self.state
         for phase in self.scenario:
             if phase.get("name") == phase_name:
-                #if self.current_phase:
-                #    if self.current_phase["name"]!=phase["name"]:
-                self.nb_interactions=0
-                self.current_phase = phase
-                self.question_asked = False
+                #if state.current_phase:
+                #    if state.current_phase["name"]!=phase["name"]:
+                state.nb_interactions=0
+                state.current_phase = phase
+                state.question_asked = False
                 self.logger.log_interaction("SYSTEM", f"Phase set to: {phase_name}")
                 print(f"changed phase to: {phase_name}")
                 return
         self.logger.log_interaction("SYSTEM", f"Phase not found: {phase_name}")
-        self.current_phase = None
+        state.current_phase = None
 
     def _build_messages(self, message, history, prompt):
         """
@@ -58,33 +74,67 @@ class ChatHandler:
         #    messages.append({"role": "system", "content": prompt})
         return messages
 
-    def _handle_streaming_response(self, response_obj, message):
+    def _handle_streaming_response(self, response_obj, message, on_token=None, is_cancelled=None, log=True):
         """
         Processes a streaming response from the API, yielding complete sentences.
+        If given, on_token is called each time a chunk is received, and the stream is closed
+        as soon as is_cancelled returns True.
         """
         full_response = ""
-        buffer_text = ""
+        segmenter = SentenceSegmenter(**self.chunking)
         for chunk in response_obj:
+            if is_cancelled and is_cancelled():
+                response_obj.close()
+                segmenter.flush()
+                break
+            if on_token:
+                on_token()
             new_text = new_text = chunk.choices[0].delta.content or ""
             full_response += new_text
-            buffer_text += new_text
-            sentences = sent_tokenize(buffer_text)
-            if len(sentences) > 1:
-                for sentence in sentences[:-1]:
-                    yield sentence.replace("?", " ? ")
-                buffer_text = sentences[-1]
+            for sentence in segmenter.push(new_text):
+                yield sentence.replace("?", " ? ")
+        buffer_text = segmenter.flush()
         if buffer_text:
             yield buffer_text
-        self.logger.log_interaction(message, full_response)
+        if log:
+            self.logger.log_interaction(message, full_response)
+
+    def summarize(self, messages, summary=None):
+        """
+        Summary of the conversation up to `messages`, following the `summary` of the earlier ones.
+        """
+        response_obj = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=summary_request(messages, summary),
+        )
+        return response_obj.choices[0].message.content
+
+    def question_pending(self, state=None):
+        """
+        Whether the next response is the question of the current phase rather than a generated text.
+        """
+        state = state or self.state
+        phase = state.current_phase
+        if phase is None:
+            phase = self.scenario[0] if self.scenario else {}
+        return not state.question_asked and bool(phase.get("question"))
+
+    def record_interaction(self, message, response, state=None):
+        """
+        Logs and counts an interaction whose response was generated speculatively.
+        """
+        state = state or self.state
+        self.logger.log_interaction(message, response)
+        state.nb_interactions += 1
 
-    def get_current_state(self):
-        return self.nb_interactions
+    def get_current_state(self, state=None):
+        return (state or self.state).nb_interactions
 
-    def reset(self):
+    def reset(self, state=None):
         print(f"ChatHandler - Reset")
-        self.nb_interactions=0
+        (state or self.state).nb_interactions=0
 
-    def response(self, message, history=None, temperature=1.0, top_p=1.0):
+    def response(self, message, history=None, temperature=1.0, top_p=1.0, on_token=None, is_cancelled=None, speculative=False, state=None):
         """
         Generates a response based on the user message, conversation history, and the current phase.
 
@@ -93,29 +143,32 @@ class ChatHandler:
           - Otherwise, the "prompt" is used to generate text via the API.
 
         This method always streams the response.
+        A speculative response is neither logged nor counted, see `record_interaction`. It must not be requested
+        while a question is pending.
         """
         if history is None:
             history = []
+        state = state or self.state
 
         # If no phase is set, fall back to the first phase if available.
-        if self.current_phase is None:
+        if state.current_phase is None:
             if self.scenario:
                 print("init phase")
-                self.current_phase = self.scenario[0]
-                self.question_asked = False
+                state.current_phase = self.scenario[0]
+                state.question_asked = False
             else:
-                self.current_phase = {"prompt": ""}
-        print(f"ChatHandler - Current phase: {self.current_phase}")
+                state.current_phase = {"prompt": ""}
+        print(f"ChatHandler - Current phase: {state.current_phase}")
         # If there's an optional question and it hasn't been sent, yield it directly.
-        if not self.question_asked and self.current_phase.get("question"):
-            self.question_asked = True
-            question_text = self.current_phase.get("question")
+        if not state.question_asked and state.current_phase.get("question"):
+            state.question_asked = True
+            question_text = state.current_phase.get("question")
             self.logger.log_interaction(message, question_text)
-            self.nb_interactions+=1
+            state.nb_interactions+=1
             yield question_text
             return
 
-        prompt = self.current_phase.get("prompt", "")
+        prompt = state.current_phase.get("prompt", "")
 
         #if prompt:
         messages = self._build_messages(message, history, prompt)
@@ -127,6 +180,7 @@ class ChatHandler:
             top_p=top_p,
             temperature=temperature
         )
-        self.nb_interactions+=1
-        for part in self._handle_streaming_response(response_obj, message):
+        if not speculative:
+            state.nb_interactions+=1
+        for part in self._handle_streaming_response(response_obj, message, on_token, is_cancelled, log=not speculative):
             yield part
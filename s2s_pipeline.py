@@ -3,8 +3,8 @@ import os
 import sys
 from copy import copy
 from pathlib import Path
-from queue import Queue
 from threading import Event
+import multiprocessing
 from typing import Optional
 from sys import platform
 from VAD.vad_handler import VADHandler
@@ -35,6 +35,10 @@ from transformers import (
     HfArgumentParser,
 )
 
+from utils.cancellation import CancelSignal
+from utils.process_stage import ProcessStage
+from utils.queues import BoundedQueue
+from utils.shared_audio_queue import SharedAudioQueue
 from utils.thread_manager import ThreadManager
 
 import sounddevice as sd
@@ -212,16 +216,80 @@ def prepare_all_args(
     rename_args(facebook_mms_tts_handler_kwargs, "facebook_mms")
 
 
-def initialize_queues_and_events():
-    return {
-        "stop_event": Event(),
-        "should_listen": Event(),
-        "recv_audio_chunks_queue": Queue(),
-        "send_audio_chunks_queue": Queue(),
-        "spoken_prompt_queue": Queue(),
-        "text_prompt_queue": Queue(),
-        "lm_response_queue": Queue(),
+QUEUE_NAMES = (
+    "recv_audio_chunks_queue",
+    "send_audio_chunks_queue",
+    "spoken_prompt_queue",
+    "text_prompt_queue",
+    "lm_response_queue",
+)
+
+# input and output queues of the parts that can run in their own process
+STAGE_QUEUES = {
+    "vad": ("recv_audio_chunks_queue", "spoken_prompt_queue"),
+    "stt": ("spoken_prompt_queue", "text_prompt_queue"),
+    "llm": ("text_prompt_queue", "lm_response_queue"),
+    "tts": ("lm_response_queue", "send_audio_chunks_queue"),
+}
+
+# shared memory slot size of each queue: audio chunks, whole utterances (~1 min of float32 at 16 kHz), or none for text
+SHARED_SLOT_BYTES = {
+    "recv_audio_chunks_queue": 16 * 1024,
+    "send_audio_chunks_queue": 16 * 1024,
+    "spoken_prompt_queue": 4 * 1024 * 1024,
+    "text_prompt_queue": 0,
+    "lm_response_queue": 0,
+}
+
+
+def get_process_stages(module_kwargs):
+    stages = {stage.strip() for stage in module_kwargs.process_stages.split(",") if stage.strip()}
+    unknown = stages - set(STAGE_QUEUES)
+    if unknown:
+        raise ValueError(
+            f"Unknown process stage(s) {', '.join(sorted(unknown))}. Choose among {', '.join(STAGE_QUEUES)}."
+        )
+    if stages and (module_kwargs.barge_in or module_kwargs.enable_osc or module_kwargs.max_sessions > 1):
+        raise ValueError("--process_stages cannot be used with --barge_in, --enable_osc or --max_sessions above 1.")
+    return stages
+
+
+def initialize_queues_and_events(module_kwargs):
+    process_stages = get_process_stages(module_kwargs)
+    # events and queues reached by a child process must be shared between processes
+    context = multiprocessing.get_context("spawn")
+    shared_queues = {name for stage in process_stages for name in STAGE_QUEUES[stage]}
+    event_class = context.Event if process_stages else Event
+    queues_and_events = {
+        "stop_event": event_class(),
+        "should_listen": event_class(),
     }
+    for name in QUEUE_NAMES:
+        kwargs = dict(
+            maxsize=getattr(module_kwargs, f"{name}_size"),
+            policy=getattr(module_kwargs, f"{name}_policy"),
+            name=name,
+        )
+        if name in shared_queues:
+            queues_and_events[name] = SharedAudioQueue(
+                slot_bytes=SHARED_SLOT_BYTES[name], context=context, **kwargs
+            )
+        else:
+            queues_and_events[name] = BoundedQueue(**kwargs)
+    return queues_and_events
+
+
+def build_handler(module_kwargs, stage, handler_class, stop_event, queue_in, queue_out, **kwargs):
+    """
+    Instantiates a pipeline part, or wraps it in a ProcessStage if it is listed in --process_stages.
+    """
+    if stage not in get_process_stages(module_kwargs):
+        return handler_class(stop_event, queue_in=queue_in, queue_out=queue_out, **kwargs)
+    for key in ("osc_client", "osc_server", "cancel_signal"):
+        kwargs.pop(key, None)
+    return ProcessStage(
+        handler_class, stop_event, queue_in, queue_out, log_level=module_kwargs.log_level, **kwargs
+    )
 
 
 def build_pipeline(
@@ -249,6 +317,11 @@ def build_pipeline(
     spoken_prompt_queue = queues_and_events["spoken_prompt_queue"]
     text_prompt_queue = queues_and_events["text_prompt_queue"]
     lm_response_queue = queues_and_events["lm_response_queue"]
+    multi_session = module_kwargs.mode != "local" and module_kwargs.max_sessions > 1
+    cancel_signal = None
+    vad_scheduler = None
+    if module_kwargs.barge_in and not multi_session:
+        cancel_signal = CancelSignal([lm_response_queue, send_audio_chunks_queue])
     if module_kwargs.mode == "local":
         from connections.local_audio_streamer import LocalAudioStreamer
 
@@ -281,10 +354,58 @@ def build_pipeline(
             input_channel=module_kwargs.input_channel,  # Input channel index
             output_channel=module_kwargs.output_channel,
             enable_osc=module_kwargs.enable_osc,
-            osc_port=module_kwargs.osc_send_port
+            osc_port=module_kwargs.osc_send_port,
+            barge_in=module_kwargs.barge_in,
         )
         comms_handlers = [local_audio_streamer]
         should_listen.set()
+    elif multi_session:
+        from connections.session_server import SessionServer, SharedQueueWriter
+
+        if vad_handler_kwargs.vad_backend == "onnx":
+            from VAD.batched_vad import BatchedVADScheduler
+            from VAD.silero_model import load_silero_vad
+
+            # one model scores the frames of all the sessions in batches
+            vad_scheduler = BatchedVADScheduler(
+                stop_event,
+                load_silero_vad(vad_handler_kwargs.vad_backend, vad_handler_kwargs.vad_model_path),
+                sampling_rate=vad_handler_kwargs.sample_rate,
+            )
+
+        def make_vad(session):
+            vad_kwargs = vars(vad_handler_kwargs)
+            if vad_scheduler is not None:
+                vad_kwargs = {**vad_kwargs, "model": vad_scheduler.stream()}
+            return VADHandler(
+                session.stop_event,
+                queue_in=session.recv_queue,
+                queue_out=SharedQueueWriter(spoken_prompt_queue),
+                setup_args=(session.should_listen,),
+                setup_kwargs=vad_kwargs,
+                osc_client=osc_client,
+                # the VAD cancels the answer when the user starts speaking
+                cancel_signal=session.cancel_signal if module_kwargs.barge_in else None,
+                session=session,
+            )
+
+        comms_handlers = [
+            SessionServer(
+                stop_event,
+                send_audio_chunks_queue,
+                make_vad,
+                recv_host=socket_receiver_kwargs.recv_host,
+                recv_port=socket_receiver_kwargs.recv_port,
+                send_host=socket_sender_kwargs.send_host,
+                send_port=socket_sender_kwargs.send_port,
+                chunk_size=socket_receiver_kwargs.chunk_size,
+                max_sessions=module_kwargs.max_sessions,
+                recv_queue_size=module_kwargs.recv_audio_chunks_queue_size,
+                send_queue_size=module_kwargs.send_audio_chunks_queue_size,
+                barge_in=module_kwargs.barge_in,
+                shared_queues=[lm_response_queue, send_audio_chunks_queue],
+            )
+        ]
     else:
         from connections.socket_receiver import SocketReceiver
         from connections.socket_sender import SocketSender
@@ -297,6 +418,7 @@ def build_pipeline(
                 host=socket_receiver_kwargs.recv_host,
                 port=socket_receiver_kwargs.recv_port,
                 chunk_size=socket_receiver_kwargs.chunk_size,
+                barge_in=module_kwargs.barge_in,
             ),
             SocketSender(
                 stop_event,
@@ -316,34 +438,54 @@ def build_pipeline(
         osc_client = OSCClient(module_kwargs.osc_send_address, module_kwargs.osc_send_port)
         osc_server = OSCServer(module_kwargs.osc_receive_address, module_kwargs.osc_receive_port)
 
-    vad = VADHandler(
-        stop_event,
-        queue_in=recv_audio_chunks_queue,
-        queue_out=spoken_prompt_queue,
-        setup_args=(should_listen,),
-        setup_kwargs=vars(vad_handler_kwargs),
-        osc_client = osc_client,
-        osc_server = osc_server
-    )
+    # with the multi-session server, each session gets its own VAD, possibly sharing a batched model
+    vad_handlers = []
+    if multi_session:
+        if vad_scheduler is not None:
+            vad_handlers.append(vad_scheduler)
+    else:
+        vad_handlers.append(
+            build_handler(
+                module_kwargs,
+                "vad",
+                VADHandler,
+                stop_event,
+                queue_in=recv_audio_chunks_queue,
+                queue_out=spoken_prompt_queue,
+                setup_args=(should_listen,),
+                setup_kwargs=vars(vad_handler_kwargs),
+                osc_client = osc_client,
+                osc_server = osc_server,
+                cancel_signal=cancel_signal,
+            )
+        )
 
     stt = get_stt_handler(module_kwargs, stop_event, spoken_prompt_queue, text_prompt_queue, whisper_stt_handler_kwargs, faster_whisper_stt_handler_kwargs, paraformer_stt_handler_kwargs)
-    lm = get_llm_handler(module_kwargs, stop_event, text_prompt_queue, lm_response_queue, language_model_handler_kwargs, open_api_language_model_handler_kwargs, pulsochat_language_model_handler_kwargs, mlx_language_model_handler_kwargs, osc_client, osc_server)
-    tts = get_tts_handler(module_kwargs, stop_event, lm_response_queue, send_audio_chunks_queue, should_listen, parler_tts_handler_kwargs, melo_tts_handler_kwargs, chat_tts_handler_kwargs, facebook_mms_tts_handler_kwargs)
+    lm = get_llm_handler(module_kwargs, stop_event, text_prompt_queue, lm_response_queue, language_model_handler_kwargs, open_api_language_model_handler_kwargs, pulsochat_language_model_handler_kwargs, mlx_language_model_handler_kwargs, osc_client, osc_server, cancel_signal)
+    tts_cache_kwargs = get_tts_cache_kwargs(module_kwargs, pulsochat_language_model_handler_kwargs, whisper_stt_handler_kwargs.language)
+    tts = get_tts_handler(module_kwargs, stop_event, lm_response_queue, send_audio_chunks_queue, should_listen, parler_tts_handler_kwargs, melo_tts_handler_kwargs, chat_tts_handler_kwargs, facebook_mms_tts_handler_kwargs, cancel_signal, tts_cache_kwargs)
 
-    return ThreadManager([*comms_handlers, vad, stt, lm, tts])
+    shared_queues = [item for item in queues_and_events.values() if isinstance(item, SharedAudioQueue)]
+    return ThreadManager([*comms_handlers, *vad_handlers, stt, lm, tts], shared_queues)
 
 
 def get_stt_handler(module_kwargs, stop_event, spoken_prompt_queue, text_prompt_queue, whisper_stt_handler_kwargs, faster_whisper_stt_handler_kwargs, paraformer_stt_handler_kwargs):
     if module_kwargs.stt == "moonshine":
         from STT.moonshine_handler import MoonshineSTTHandler
-        return MoonshineSTTHandler(
+        return build_handler(
+            module_kwargs,
+            "stt",
+            MoonshineSTTHandler,
             stop_event,
             queue_in=spoken_prompt_queue,
             queue_out=text_prompt_queue,
         )
     if module_kwargs.stt == "whisper":
         from STT.whisper_stt_handler import WhisperSTTHandler
-        return WhisperSTTHandler(
+        return build_handler(
+            module_kwargs,
+            "stt",
+            WhisperSTTHandler,
             stop_event,
             queue_in=spoken_prompt_queue,
             queue_out=text_prompt_queue,
@@ -351,7 +493,10 @@ def get_stt_handler(module_kwargs, stop_event, spoken_prompt_queue, text_prompt_
         )
     elif module_kwargs.stt == "whisper-mlx":
         from STT.lightning_whisper_mlx_handler import LightningWhisperSTTHandler
-        return LightningWhisperSTTHandler(
+        return build_handler(
+            module_kwargs,
+            "stt",
+            LightningWhisperSTTHandler,
             stop_event,
             queue_in=spoken_prompt_queue,
             queue_out=text_prompt_queue,
@@ -359,7 +504,10 @@ def get_stt_handler(module_kwargs, stop_event, spoken_prompt_queue, text_prompt_
         )
     elif module_kwargs.stt == "paraformer":
         from STT.paraformer_handler import ParaformerSTTHandler
-        return ParaformerSTTHandler(
+        return build_handler(
+            module_kwargs,
+            "stt",
+            ParaformerSTTHandler,
             stop_event,
             queue_in=spoken_prompt_queue,
             queue_out=text_prompt_queue,
@@ -368,7 +516,10 @@ def get_stt_handler(module_kwargs, stop_event, spoken_prompt_queue, text_prompt_
     elif module_kwargs.stt == "faster-whisper":
         from STT.faster_whisper_handler import FasterWhisperSTTHandler
 
-        return FasterWhisperSTTHandler(
+        return build_handler(
+            module_kwargs,
+            "stt",
+            FasterWhisperSTTHandler,
             stop_event,
             queue_in=spoken_prompt_queue,
             queue_out=text_prompt_queue,
@@ -388,56 +539,111 @@ def get_llm_handler(
     pulsochat_language_model_handler_kwargs,
     mlx_language_model_handler_kwargs,
     osc_client = None,
-    osc_server = None
+    osc_server = None,
+    cancel_signal=None,
 ):
+    chunking_kwargs = {
+        "first_chunk_min_chars": module_kwargs.first_chunk_min_chars,
+        "min_chunk_chars": module_kwargs.min_chunk_chars,
+    }
     if module_kwargs.llm == "transformers":
         from LLM.language_model import LanguageModelHandler
-        return LanguageModelHandler(
+        return build_handler(
+            module_kwargs,
+            "llm",
+            LanguageModelHandler,
             stop_event,
             queue_in=text_prompt_queue,
             queue_out=lm_response_queue,
-            setup_kwargs=vars(language_model_handler_kwargs),
+            cancel_signal=cancel_signal,
+            setup_kwargs={**vars(language_model_handler_kwargs), **chunking_kwargs},
         )
     elif module_kwargs.llm == "open_api":
         from LLM.openai_api_language_model import OpenApiModelHandler
-        return OpenApiModelHandler(
+        return build_handler(
+            module_kwargs,
+            "llm",
+            OpenApiModelHandler,
             stop_event,
             queue_in=text_prompt_queue,
             queue_out=lm_response_queue,
-            setup_kwargs=vars(open_api_language_model_handler_kwargs),
+            cancel_signal=cancel_signal,
+            setup_kwargs={**vars(open_api_language_model_handler_kwargs), **chunking_kwargs},
         )
     elif module_kwargs.llm == "pulsochat":
         from LLM.pulsochat_language_model import PulsochatModelHandler
-        return PulsochatModelHandler(
+        return build_handler(
+            module_kwargs,
+            "llm",
+            PulsochatModelHandler,
             stop_event,
             queue_in=text_prompt_queue,
             queue_out=lm_response_queue,
+            cancel_signal=cancel_signal,
             osc_client=osc_client,
             osc_server=osc_server,
-            setup_kwargs=vars(pulsochat_language_model_handler_kwargs),
+            setup_kwargs={**vars(pulsochat_language_model_handler_kwargs), **chunking_kwargs},
         )
     elif module_kwargs.llm == "mlx-lm":
         from LLM.mlx_language_model import MLXLanguageModelHandler
-        return MLXLanguageModelHandler(
+        return build_handler(
+            module_kwargs,
+            "llm",
+            MLXLanguageModelHandler,
             stop_event,
             queue_in=text_prompt_queue,
             queue_out=lm_response_queue,
-            setup_kwargs=vars(mlx_language_model_handler_kwargs),
+            cancel_signal=cancel_signal,
+            setup_kwargs={**vars(mlx_language_model_handler_kwargs), **chunking_kwargs},
         )
 
     else:
         raise ValueError("The LLM should be either transformers or mlx-lm")
 
 
-def get_tts_handler(module_kwargs, stop_event, lm_response_queue, send_audio_chunks_queue, should_listen, parler_tts_handler_kwargs, melo_tts_handler_kwargs, chat_tts_handler_kwargs, facebook_mms_tts_handler_kwargs):
+def get_tts_cache_kwargs(module_kwargs, pulsochat_language_model_handler_kwargs, language=None):
+    """
+    Setup arguments of the TTS cache, given to the melo and parler TTS: the cache itself and the sentences to
+    synthesize at startup, i.e. the questions of the pulsochat scenario, as (text, language code) items translated to
+    the conversation `language` like the pulsochat answers, so that they get the cache keys of the sentences said.
+    """
+    if not module_kwargs.tts_cache:
+        return {}
+    if module_kwargs.tts not in ("parler", "melo"):
+        logger.warning(f"The TTS cache is not available with the {module_kwargs.tts} TTS.")
+        return {}
+    from TTS.tts_cache import TTSCache, scenario_questions
+
+    prewarm_texts = []
+    if module_kwargs.llm == "pulsochat" and pulsochat_language_model_handler_kwargs.config_file:
+        if not language or language.endswith("auto"):
+            logger.warning("The scenario questions are not cached at startup: the conversation language is not fixed.")
+        else:
+            from LLM.pulsochat_language_model import translate_response
+            from google.cloud import translate_v2 as translate
+
+            translate_client = translate.Client()
+            prewarm_texts = [
+                (translate_response(translate_client, question, language), language)
+                for question in scenario_questions(pulsochat_language_model_handler_kwargs.config_file)
+            ]
+    cache = TTSCache(module_kwargs.tts_cache_dir, module_kwargs.tts_cache_memory_mb)
+    return {"cache": cache, "prewarm_texts": prewarm_texts}
+
+
+def get_tts_handler(module_kwargs, stop_event, lm_response_queue, send_audio_chunks_queue, should_listen, parler_tts_handler_kwargs, melo_tts_handler_kwargs, chat_tts_handler_kwargs, facebook_mms_tts_handler_kwargs, cancel_signal=None, tts_cache_kwargs={}):
     if module_kwargs.tts == "parler":
         from TTS.parler_handler import ParlerTTSHandler
-        return ParlerTTSHandler(
+        return build_handler(
+            module_kwargs,
+            "tts",
+            ParlerTTSHandler,
             stop_event,
             queue_in=lm_response_queue,
             queue_out=send_audio_chunks_queue,
+            cancel_signal=cancel_signal,
             setup_args=(should_listen,),
-            setup_kwargs=vars(parler_tts_handler_kwargs),
+            setup_kwargs={**vars(parler_tts_handler_kwargs), **tts_cache_kwargs},
         )
     elif module_kwargs.tts == "melo":
         try:
@@ -447,12 +653,16 @@ def get_tts_handler(module_kwargs, stop_event, lm_response_queue, send_audio_chu
                 "Error importing MeloTTSHandler. You might need to run: python -m unidic download"
             )
             raise e
-        return MeloTTSHandler(
+        return build_handler(
+            module_kwargs,
+            "tts",
+            MeloTTSHandler,
             stop_event,
             queue_in=lm_response_queue,
             queue_out=send_audio_chunks_queue,
+            cancel_signal=cancel_signal,
             setup_args=(should_listen,),
-            setup_kwargs=vars(melo_tts_handler_kwargs),
+            setup_kwargs={**vars(melo_tts_handler_kwargs), **tts_cache_kwargs},
         )
     elif module_kwargs.tts == "chatTTS":
         try:
@@ -460,19 +670,27 @@ def get_tts_handler(module_kwargs, stop_event, lm_response_queue, send_audio_chu
         except RuntimeError as e:
             logger.error("Error importing ChatTTSHandler")
             raise e
-        return ChatTTSHandler(
+        return build_handler(
+            module_kwargs,
+            "tts",
+            ChatTTSHandler,
             stop_event,
             queue_in=lm_response_queue,
             queue_out=send_audio_chunks_queue,
+            cancel_signal=cancel_signal,
             setup_args=(should_listen,),
             setup_kwargs=vars(chat_tts_handler_kwargs),
         )
     elif module_kwargs.tts == "facebookMMS":
         from TTS.facebookmms_handler import FacebookMMSTTSHandler
-        return FacebookMMSTTSHandler(
+        return build_handler(
+            module_kwargs,
+            "tts",
+            FacebookMMSTTSHandler,
             stop_event,
             queue_in=lm_response_queue,
             queue_out=send_audio_chunks_queue,
+            cancel_signal=cancel_signal,
             setup_args=(should_listen,),
             setup_kwargs=vars(facebook_mms_tts_handler_kwargs),
         )
@@ -516,7 +734,7 @@ def main():
         facebook_mms_tts_handler_kwargs,
     )
 
-    queues_and_events = initialize_queues_and_events()
+    queues_and_events = initialize_queues_and_events(module_kwargs)
 
     pipeline_manager = build_pipeline(
         module_kwargs,
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the tests import the pipeline modules from the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# manual scripts, not tests
+collect_ignore = ["osc_server_test.py"]
@@ -0,0 +1,70 @@
+import queue
+
+import numpy as np
+
+from utils.framer import AudioFramer, send_frames, take_queued_frames
+from utils.queues import SESSION_END
+from utils.trace import TraceContext, Traced
+
+
+def test_frames_carry_the_remainder_over():
+    framer = AudioFramer(4)
+    frames = list(framer(np.arange(6, dtype=np.int16)))
+    frames += list(framer(np.arange(6, 9, dtype=np.int16)))
+    assert [frame.tolist() for frame in frames] == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert [frame.tolist() for frame in framer.flush()] == [[8, 0, 0, 0]]
+    assert list(framer.flush()) == []
+
+
+def test_float_audio_is_converted_to_int16():
+    frames = list(AudioFramer(3).frames(np.array([0.0, 0.5, -0.5, -1.0], dtype=np.float32)))
+    assert [frame.tolist() for frame in frames] == [[0, 16384, -16384], [-32768, 0, 0]]
+    assert all(frame.dtype == np.int16 for frame in frames)
+
+
+def test_whole_frames_need_no_padding():
+    frames = list(AudioFramer(2).frames(np.arange(4, dtype=np.int16)))
+    assert [frame.tolist() for frame in frames] == [[0, 1], [2, 3]]
+
+
+def test_take_queued_frames_stops_at_a_control_message():
+    queue_in = queue.Queue()
+    trace = TraceContext()
+    for item in (b"a", Traced(b"b", trace), SESSION_END, b"c"):
+        queue_in.put(item)
+    frames, control = take_queued_frames(queue_in)
+    assert frames == [(b"a", None), (b"b", trace)]
+    assert control == SESSION_END
+    assert queue_in.get_nowait() == b"c"
+
+
+def test_take_queued_frames_is_bounded():
+    queue_in = queue.Queue()
+    for i in range(5):
+        queue_in.put(bytes([i]))
+    frames, control = take_queued_frames(queue_in, max_frames=3)
+    assert [frame for frame, _ in frames] == [b"\x00", b"\x01", b"\x02"]
+    assert control is None
+    assert queue_in.qsize() == 2
+
+
+class PartialSendConn:
+    """
+    Socket whose sendmsg sends at most `limit` bytes per call.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = b""
+
+    def sendmsg(self, buffers):
+        data = b"".join(bytes(buffer) for buffer in buffers)[:self.limit]
+        self.data += data
+        return len(data)
+
+
+def test_send_frames_resumes_partial_sends():
+    frames = [np.arange(i, i + 4, dtype=np.int16) for i in range(0, 12, 4)]
+    conn = PartialSendConn(limit=5)
+    send_frames(conn, frames)
+    assert conn.data == b"".join(frame.tobytes() for frame in frames)
@@ -0,0 +1,42 @@
+from utils.messages import LocalAgreement, PartialTranscript, merge_transcripts
+
+
+def test_commits_the_words_the_last_hypotheses_agree_on():
+    agreement = LocalAgreement(n=2)
+    assert agreement.update("i want".split()) == []
+    assert agreement.update("i want to".split()) == ["i", "want"]
+    assert agreement.update("i want to go".split()) == ["to"]
+    assert agreement.text == "i want to"
+
+
+def test_committed_words_are_never_taken_back():
+    agreement = LocalAgreement(n=2)
+    agreement.update("the cat sat".split())
+    agreement.update("the cat sat down".split())
+    assert agreement.update("a cat sat down".split()) == []
+    assert agreement.update("a cat sat down".split()) == []
+    assert agreement.text == "the cat sat"
+
+
+def test_longer_agreement_needs_more_hypotheses():
+    agreement = LocalAgreement(n=3)
+    agreement.update("hello".split())
+    assert agreement.update("hello world".split()) == []
+    assert agreement.update("hello world again".split()) == ["hello"]
+
+
+def test_reset_starts_a_new_utterance():
+    agreement = LocalAgreement(n=2)
+    agreement.update("yes".split())
+    agreement.update("yes".split())
+    agreement.reset()
+    assert agreement.text == ""
+    assert agreement.update("no".split()) == []
+
+
+def test_merge_transcripts_prepends_the_held_text():
+    held = [("The first part", "en")]
+    assert merge_transcripts(held, ("and the rest.", "en")) == ("The first part and the rest.", "en")
+    merged = merge_transcripts(held, PartialTranscript("and the", "en"))
+    assert isinstance(merged, PartialTranscript)
+    assert merged.text == "The first part and the"
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+from TTS.model_pool import ModelPool
+
+
+class FakeModel:
+    def __init__(self, language, size):
+        self.language = language
+        self.size = size
+
+    def parameters(self):
+        return [FakeTensor(self.size)]
+
+
+class FakeTensor:
+    def __init__(self, size):
+        self.size = size
+
+    def numel(self):
+        return self.size
+
+    def element_size(self):
+        return 1
+
+
+def counting_loader(size=1, delay=0.0):
+    loads = []
+
+    def load(language):
+        loads.append(language)
+        time.sleep(delay)
+        return FakeModel(language, size)
+
+    return load, loads
+
+
+def test_get_loads_once_and_reuses():
+    load, loads = counting_loader()
+    pool = ModelPool(load)
+    assert pool.get("fr") is pool.get("fr")
+    assert loads == ["fr"]
+
+
+def test_concurrent_gets_load_a_language_once():
+    for _ in range(50):
+        load, loads = counting_loader(delay=0.001)
+        pool = ModelPool(load)
+        barrier = threading.Barrier(4)
+        models = []
+
+        def get():
+            barrier.wait()
+            models.append(pool.get("fr"))
+            models.append(pool.get("fr"))
+
+        threads = [threading.Thread(target=get) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert loads == ["fr"]
+        assert all(model is models[0] for model in models)
+
+
+def test_least_recently_used_model_is_evicted_over_budget():
+    load, loads = counting_loader(size=600 * 1024)
+    pool = ModelPool(load, max_memory_mb=1)
+    pool.get("fr")
+    pool.get("en")
+    assert list(pool.models) == ["en"]
+    pool.get("fr")
+    assert loads == ["fr", "en", "fr"]
+
+
+def test_load_error_is_raised_and_not_cached():
+    def load(language):
+        raise KeyError(language)
+
+    pool = ModelPool(load)
+    with pytest.raises(KeyError):
+        pool.get("xx")
+    assert not pool.loading
+    with pytest.raises(KeyError):
+        pool.get("xx")
+
+
+def test_preload_loads_in_background():
+    load, loads = counting_loader()
+    pool = ModelPool(load)
+    pool.preload(["fr", "en"]).join()
+    assert loads == ["fr", "en"]
+    assert set(pool.models) == {"fr", "en"}
@@ -0,0 +1,91 @@
+import threading
+from queue import Full
+
+import pytest
+
+from utils.queues import SESSION_END, BoundedQueue
+from utils.trace import TraceContext, Traced
+
+
+def drain(queue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get())
+    return items
+
+
+def test_drop_oldest_keeps_the_newest_items():
+    queue = BoundedQueue(2, "drop_oldest")
+    for item in (1, 2, 3):
+        queue.put(item)
+    assert drain(queue) == [2, 3]
+    assert queue.dropped == 1
+
+
+def test_drop_newest_keeps_the_oldest_items():
+    queue = BoundedQueue(2, "drop_newest")
+    for item in (1, 2, 3):
+        queue.put(item)
+    assert drain(queue) == [1, 2]
+    assert queue.dropped == 1
+
+
+@pytest.mark.parametrize("policy", ["block", "drop_oldest", "drop_newest"])
+def test_control_messages_are_never_dropped_nor_blocked(policy):
+    queue = BoundedQueue(1, policy)
+    queue.put(1)
+    queue.put(SESSION_END, timeout=0.1)
+    queue.put(b"END", timeout=0.1)
+    assert drain(queue) == [1, SESSION_END, b"END"]
+
+
+def test_block_raises_full_when_the_data_fills_the_queue():
+    queue = BoundedQueue(2, "block")
+    queue.put(1)
+    queue.put(2)
+    with pytest.raises(Full):
+        queue.put_nowait(3)
+    with pytest.raises(Full):
+        queue.put(3, timeout=0.01)
+
+
+def test_block_does_not_count_control_messages():
+    queue = BoundedQueue(2, "block")
+    queue.put(SESSION_END)
+    queue.put(1)
+    # the control message does not take the slot of the second item
+    queue.put(2, timeout=0.1)
+    assert drain(queue) == [SESSION_END, 1, 2]
+
+
+def test_block_waits_for_the_consumer():
+    queue = BoundedQueue(1, "block")
+    queue.put(1)
+    put_done = threading.Event()
+
+    def produce():
+        queue.put(2)
+        put_done.set()
+
+    thread = threading.Thread(target=produce)
+    thread.start()
+    assert not put_done.wait(0.05)
+    assert queue.get() == 1
+    assert put_done.wait(1)
+    thread.join()
+    assert drain(queue) == [2]
+
+
+def test_flush_keeps_control_messages_and_unmatched_items():
+    queue = BoundedQueue(0)
+    session, other = object(), object()
+    mine, theirs = Traced(1, TraceContext(session)), Traced(2, TraceContext(other))
+    for item in (mine, SESSION_END, theirs):
+        queue.put(item)
+    assert queue.flush(lambda item: item.trace.session is session) == 1
+    assert drain(queue) == [SESSION_END, theirs]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        BoundedQueue(1, "drop_all")
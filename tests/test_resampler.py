@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from utils.resampler import StreamingResampler, resample
+
+
+def sine(frequency, sample_rate, seconds):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    return np.sin(2 * np.pi * frequency * t).astype(np.float32)
+
+
+@pytest.mark.parametrize("orig_sr, target_sr", [(44100, 16000), (16000, 48000), (24000, 16000)])
+def test_output_length(orig_sr, target_sr):
+    audio = sine(440, orig_sr, 0.5)
+    assert len(resample(audio, orig_sr, target_sr)) == int(np.ceil(len(audio) * target_sr / orig_sr))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 100, 512, 5000])
+def test_chunks_match_the_whole_array(chunk_size):
+    audio = sine(440, 44100, 0.5)
+    resampler = StreamingResampler(44100, 16000)
+    chunks = [resampler(audio[i:i + chunk_size]) for i in range(0, len(audio), chunk_size)]
+    streamed = np.concatenate(chunks + [resampler.flush()])
+    np.testing.assert_allclose(streamed, resample(audio, 44100, 16000), atol=1e-5)
+
+
+def test_resampled_sine_keeps_its_frequency():
+    resampled = resample(sine(1000, 44100, 1.0), 44100, 16000)
+    expected = sine(1000, 16000, 1.0)
+    # away from the edges, where the filter sees the zeros before and after the audio
+    np.testing.assert_allclose(resampled[1000:-1000], expected[1000:-1000], atol=1e-2)
+
+
+def test_frequencies_above_the_target_nyquist_are_removed():
+    resampled = resample(sine(12000, 44100, 1.0), 44100, 16000)
+    assert np.abs(resampled[1000:-1000]).max() < 1e-2
+
+
+def test_same_rate_is_identity():
+    audio = sine(440, 16000, 0.1)
+    resampler = StreamingResampler(16000, 16000)
+    np.testing.assert_array_equal(resampler(audio), audio)
+    assert len(resampler.flush()) == 0
+
+
+def test_flush_resets_for_the_next_audio():
+    audio = sine(440, 44100, 0.2)
+    resampler = StreamingResampler(44100, 16000)
+    first = np.concatenate([resampler(audio), resampler.flush()])
+    second = np.concatenate([resampler(audio), resampler.flush()])
+    np.testing.assert_array_equal(first, second)
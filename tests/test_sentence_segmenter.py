@@ -0,0 +1,67 @@
+from LLM.sentence_segmenter import SentenceSegmenter
+
+
+def segment(pieces, **kwargs):
+    segmenter = SentenceSegmenter(**kwargs)
+    chunks = []
+    for piece in pieces:
+        chunks.extend(segmenter.push(piece))
+    rest = segmenter.flush()
+    return chunks + ([rest] if rest else [])
+
+
+def test_splits_sentences_as_they_complete():
+    segmenter = SentenceSegmenter()
+    assert segmenter.push("Hello there. How") == ["Hello there."]
+    assert segmenter.push(" are you? I am") == ["How are you?"]
+    assert segmenter.flush() == "I am"
+
+
+def test_period_at_the_end_waits_for_the_next_text():
+    segmenter = SentenceSegmenter()
+    assert segmenter.push("It costs 3.") == []
+    assert segmenter.push("50 euros. Then") == ["It costs 3.50 euros."]
+
+
+def test_abbreviations_initials_and_list_numbers_do_not_end_sentences():
+    assert segment(["Dr. Smith met J. R. R. Tolkien. He left."]) == ["Dr. Smith met J. R. R. Tolkien.", "He left."]
+    assert segment(["1. First item. Second item."]) == ["1. First item.", "Second item."]
+
+
+def test_dotted_abbreviations_do_not_end_sentences():
+    assert segment(["He moved to the U.S. Army in 1990. Then he left."]) == [
+        "He moved to the U.S. Army in 1990.",
+        "Then he left.",
+    ]
+    assert segment(["Written by J.R.R. Tolkien. It is long."]) == ["Written by J.R.R. Tolkien.", "It is long."]
+
+
+def test_dotted_abbreviation_split_across_pushes():
+    assert segment(["the U.", "S. Army is big. Yes"]) == ["the U.S. Army is big.", "Yes"]
+
+
+def test_blank_line_ends_a_paragraph():
+    assert segment(["A title\n\nThe text."]) == ["A title", "The text."]
+
+
+def test_blank_line_split_across_pushes():
+    segmenter = SentenceSegmenter()
+    assert segmenter.push("A title\n") == []
+    assert segmenter.push("\nThe text") == ["A title"]
+    assert segmenter.flush() == "The text"
+
+
+def test_blank_line_split_between_whitespace_pushes():
+    assert segment(["A title", "\n", " ", "\n", "The text."]) == ["A title", "The text."]
+
+
+def test_first_chunk_is_cut_at_a_clause():
+    segmenter = SentenceSegmenter(first_chunk_min_chars=10)
+    assert segmenter.push("Well, as far as I know, it") == ["Well, as far as I know,"]
+    # only the first chunk of an answer is cut at a clause
+    assert segmenter.push(" works, mostly. Then") == ["it works, mostly."]
+
+
+def test_short_sentences_are_grouped_after_the_first_chunk():
+    chunks = segment(["Yes. No. Maybe. Perhaps so. Fine."], min_chunk_chars=12)
+    assert chunks == ["Yes.", "No. Maybe. Perhaps so.", "Fine."]
@@ -0,0 +1,108 @@
+import queue
+import time
+
+import numpy as np
+import pytest
+
+from utils.queues import SESSION_END
+from utils.shared_audio_queue import SharedAudioQueue
+from utils.trace import TraceContext, Traced
+
+
+@pytest.fixture
+def make_queue():
+    queues = []
+
+    def make(*args, **kwargs):
+        shared_queue = SharedAudioQueue(*args, **kwargs)
+        queues.append(shared_queue)
+        return shared_queue
+
+    yield make
+    for shared_queue in queues:
+        shared_queue.close()
+        shared_queue.unlink()
+
+
+def get_all(shared_queue, count):
+    return [shared_queue.get(timeout=1) for _ in range(count)]
+
+
+def wait_fed():
+    # the multiprocessing queue hands items over to its pipe in a background thread
+    time.sleep(0.1)
+
+
+def test_arrays_and_bytes_go_through_shared_memory(make_queue):
+    shared_queue = make_queue(4)
+    audio = np.arange(512, dtype=np.int16)
+    trace = TraceContext()
+    shared_queue.put(Traced(audio, trace))
+    shared_queue.put(b"\x01\x02")
+    item, data = get_all(shared_queue, 2)
+    np.testing.assert_array_equal(item.payload, audio)
+    assert item.trace.trace_id == trace.trace_id
+    assert data == b"\x01\x02"
+    # the slots are free again
+    assert not any(shared_queue._busy)
+
+
+def test_large_and_other_items_are_pickled(make_queue):
+    shared_queue = make_queue(4, slot_bytes=64)
+    audio = np.arange(1000, dtype=np.float32)
+    shared_queue.put(audio)
+    shared_queue.put(("text", "en"))
+    large, text = get_all(shared_queue, 2)
+    np.testing.assert_array_equal(large, audio)
+    assert text == ("text", "en")
+
+
+def test_block_raises_full_without_counting_control_messages(make_queue):
+    shared_queue = make_queue(2, "block")
+    shared_queue.put(SESSION_END)
+    shared_queue.put(b"a")
+    shared_queue.put(b"b", timeout=0.1)
+    with pytest.raises(queue.Full):
+        shared_queue.put_nowait(b"c")
+    assert get_all(shared_queue, 3) == [SESSION_END, b"a", b"b"]
+    shared_queue.put_nowait(b"c")
+    assert shared_queue.get(timeout=1) == b"c"
+
+
+def test_drop_oldest_keeps_control_messages_in_order(make_queue):
+    shared_queue = make_queue(2, "drop_oldest")
+    for item in (b"1", SESSION_END, b"2", b"3"):
+        shared_queue.put(item)
+    shared_queue.put(b"END")
+    assert get_all(shared_queue, 4) == [SESSION_END, b"2", b"3", b"END"]
+    assert shared_queue.dropped == 1
+    assert not any(shared_queue._busy)
+
+
+def test_drop_newest(make_queue):
+    shared_queue = make_queue(2, "drop_newest")
+    for item in (b"1", b"2", b"3"):
+        shared_queue.put(item)
+    assert get_all(shared_queue, 2) == [b"1", b"2"]
+    assert shared_queue.dropped == 1
+
+
+def test_flush_discards_the_matching_items(make_queue):
+    shared_queue = make_queue(8)
+    mine, theirs = TraceContext(), TraceContext()
+    for item in (Traced(b"a", mine), SESSION_END, Traced(b"b", theirs), Traced(b"c", mine)):
+        shared_queue.put(item)
+    wait_fed()
+    flushed = shared_queue.flush(lambda item: item.trace.trace_id == mine.trace_id)
+    assert flushed == 2
+    control, kept = get_all(shared_queue, 2)
+    assert control == SESSION_END
+    assert (kept.payload, kept.trace.trace_id) == (b"b", theirs.trace_id)
+    # the flushed items freed their place
+    for item in (b"d", b"e", b"f"):
+        shared_queue.put_nowait(item)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        SharedAudioQueue(1, "drop_all")
@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+
+from TTS.tts_cache import TTSCache, scenario_questions
+
+
+def audio(length, value=1):
+    return np.full(length, value, dtype=np.int16)
+
+
+def test_key_depends_on_everything_that_changes_the_audio():
+    key = TTSCache.key("Hello.", voice="Jenny", language="en", model="parler", speed=1.0)
+    assert key == TTSCache.key("Hello.", voice="Jenny", language="en", model="parler", speed=1.0)
+    assert key != TTSCache.key("Hello!", voice="Jenny", language="en", model="parler", speed=1.0)
+    assert key != TTSCache.key("Hello.", voice="Jon", language="en", model="parler", speed=1.0)
+    assert key != TTSCache.key("Hello.", voice="Jenny", language="fr", model="parler", speed=1.0)
+    assert key != TTSCache.key("Hello.", voice="Jenny", language="en", model="parler", speed=1.2)
+
+
+def test_get_counts_hits_and_misses():
+    cache = TTSCache()
+    assert cache.get("a") is None
+    cache.put("a", audio(10))
+    np.testing.assert_array_equal(cache.get("a"), audio(10))
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_empty_audio_is_not_cached():
+    cache = TTSCache()
+    cache.put("a", audio(0))
+    assert "a" not in cache
+
+
+def test_least_recently_used_sentences_are_evicted():
+    # room for two sentences of 256 KiB
+    cache = TTSCache(max_memory_mb=0.5)
+    cache.put("a", audio(128 * 1024))
+    cache.put("b", audio(128 * 1024))
+    cache.get("a")
+    cache.put("c", audio(128 * 1024))
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+
+
+def test_sentences_survive_in_the_cache_dir(tmp_path):
+    TTSCache(cache_dir=str(tmp_path)).put("a", audio(10, value=7))
+    cache = TTSCache(cache_dir=str(tmp_path))
+    assert "a" in cache
+    np.testing.assert_array_equal(cache.get("a"), audio(10, value=7))
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_scenario_questions(tmp_path):
+    config_file = tmp_path / "config.json"
+    config_file.write_text(json.dumps({"scenario": [{"question": "How are you?"}, {"name": "free talk"}]}))
+    assert scenario_questions(str(config_file)) == ["How are you?"]
@@ -0,0 +1,82 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-capacity buffer keeping the last `capacity` samples written to it, without allocating on write.
+    """
+
+    def __init__(self, capacity, dtype=np.float32):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=dtype)
+        self._end = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def clear(self):
+        self._end = 0
+        self._size = 0
+
+    def write(self, samples):
+        n = len(samples)
+        if self.capacity == 0:
+            return
+        if n >= self.capacity:
+            self._data[:] = samples[n - self.capacity:]
+            self._end = 0
+            self._size = self.capacity
+            return
+        first = min(n, self.capacity - self._end)
+        self._data[self._end:self._end + first] = samples[:first]
+        self._data[:n - first] = samples[first:]
+        self._end = (self._end + n) % self.capacity
+        self._size = min(self._size + n, self.capacity)
+
+    def read_into(self, out):
+        """
+        Copies the buffered samples, oldest first, at the start of `out` and returns their number.
+        """
+        if self._size == 0:
+            return 0
+        start = (self._end - self._size) % self.capacity
+        first = min(self._size, self.capacity - start)
+        out[:first] = self._data[start:start + first]
+        out[first:self._size] = self._data[:self._size - first]
+        return self._size
+
+
+class GrowableBuffer:
+    """
+    Contiguous buffer of samples whose capacity doubles when full, so that appending is amortized O(1).
+    `view` returns the samples without copying them.
+    """
+
+    def __init__(self, capacity=16000, dtype=np.float32):
+        self._data = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def reserve(self, size):
+        if size > len(self._data):
+            data = np.empty(max(size, 2 * len(self._data)), dtype=self._data.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+
+    def append(self, samples):
+        self.reserve(self._size + len(samples))
+        self._data[self._size:self._size + len(samples)] = samples
+        self._size += len(samples)
+
+    def append_ring(self, ring):
+        self.reserve(self._size + len(ring))
+        self._size += ring.read_into(self._data[self._size:])
+
+    def truncate(self, size):
+        self._size = min(self._size, size)
+
+    def view(self):
+        return self._data[:self._size]
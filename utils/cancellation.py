@@ -0,0 +1,47 @@
+import threading
+import logging
+
+from utils.queues import is_control_message
+
+logger = logging.getLogger(__name__)
+
+
+class CancelSignal:
+    """
+    Barge-in signal shared by the pipeline parts. Each `trigger` starts a new epoch: work started
+    in an older epoch is stale and should stop as soon as possible.
+    The queues given at construction are flushed on trigger, control messages excepted.
+    If `match` is given, only the queued items for which it returns True are flushed.
+    """
+
+    def __init__(self, queues=(), match=None):
+        self.queues = list(queues)
+        self.match = match
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    @property
+    def epoch(self):
+        return self._epoch
+
+    def is_cancelled(self, epoch):
+        return self._epoch != epoch
+
+    def pending(self):
+        """
+        Whether the queues hold items a trigger would flush, e.g. audio of the answer not sent yet.
+        """
+        for queue in self.queues:
+            with queue.mutex:
+                if any(
+                    not is_control_message(item) and (self.match is None or self.match(item))
+                    for item in queue.queue
+                ):
+                    return True
+        return False
+
+    def trigger(self):
+        with self._lock:
+            self._epoch += 1
+            flushed = sum(queue.flush(self.match) for queue in self.queues)
+        logger.debug(f"Barge-in: cancelled epoch {self._epoch - 1}, flushed {flushed} item(s)")
@@ -0,0 +1,89 @@
+import queue
+
+import numpy as np
+
+from utils.queues import is_control_message
+from utils.trace import unwrap
+
+# most frames the senders coalesce into a single system call
+MAX_COALESCED_FRAMES = 16
+
+
+class AudioFramer:
+    """
+    Cuts synthesized audio into int16 frames of `frame_size` samples for the senders.
+    Each chunk of audio is converted once into a single buffer and the frames are views of it, so that nothing is
+    allocated per frame. The samples left over at the end of a chunk are carried over to the next one: only the last
+    frame of the audio, yielded by `flush`, is padded with silence.
+    Float audio is expected in [-1, 1]; int16 audio is framed as is.
+    """
+
+    def __init__(self, frame_size):
+        self.frame_size = frame_size
+        self.remainder = np.zeros(0, dtype=np.int16)
+
+    def __call__(self, audio):
+        audio = np.asarray(audio)
+        carried = len(self.remainder)
+        samples = np.empty(carried + len(audio), dtype=np.int16)
+        samples[:carried] = self.remainder
+        if audio.dtype == np.int16:
+            samples[carried:] = audio
+        else:
+            np.multiply(audio, 32768, out=samples[carried:], casting="unsafe")
+        end = len(samples) - len(samples) % self.frame_size
+        self.remainder = samples[end:]
+        for i in range(0, end, self.frame_size):
+            yield samples[i:i + self.frame_size]
+
+    def flush(self):
+        """
+        Yields the samples left, padded to a whole frame, and starts over.
+        """
+        if len(self.remainder):
+            frame = np.zeros(self.frame_size, dtype=np.int16)
+            frame[:len(self.remainder)] = self.remainder
+            yield frame
+        self.remainder = np.zeros(0, dtype=np.int16)
+
+    def frames(self, audio):
+        """
+        Frames the whole audio of a sentence.
+        """
+        yield from self(audio)
+        yield from self.flush()
+
+
+def take_queued_frames(queue_in, max_frames=MAX_COALESCED_FRAMES):
+    """
+    Takes the audio frames already waiting in `queue_in`, without blocking, up to `max_frames`.
+    Returns the (frame, trace) pairs taken and the control message met, if any, which ends the batch.
+    """
+    frames = []
+    while len(frames) < max_frames:
+        try:
+            item = queue_in.get_nowait()
+        except queue.Empty:
+            break
+        if is_control_message(item):
+            return frames, item
+        frames.append(unwrap(item))
+    return frames, None
+
+
+def send_frames(conn, frames):
+    """
+    Sends `frames` (bytes or int16 arrays) with a single scatter-gather call where the platform has one.
+    """
+    if len(frames) == 1 or not hasattr(conn, "sendmsg"):
+        for frame in frames:
+            conn.sendall(frame)
+        return
+    buffers = [memoryview(frame).cast("B") for frame in frames]
+    while buffers:
+        sent = conn.sendmsg(buffers)
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers[0])
+            buffers.pop(0)
+        if sent:
+            buffers[0] = buffers[0][sent:]
@@ -0,0 +1,76 @@
+import math
+import threading
+
+
+class LatencyHistogram:
+    """
+    Fixed-memory streaming histogram of durations in seconds.
+    Values are counted in logarithmic buckets whose width is `precision` times their lower bound
+    (HDR-style), so percentiles keep a bounded relative error however many values are recorded.
+    Values outside [min_value, max_value] are clamped to the first or last bucket.
+    """
+
+    def __init__(self, min_value=1e-6, max_value=1e3, precision=0.01):
+        self.min_value = min_value
+        self.max_value = max_value
+        self._log_base = math.log1p(precision)
+        n_buckets = int(math.ceil(math.log(max_value / min_value) / self._log_base)) + 1
+        self._counts = [0] * n_buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * len(self._counts)
+            self.count = 0
+            self.total = 0.0
+            self.min = math.inf
+            self.max = 0.0
+
+    def _bucket(self, value):
+        if value <= self.min_value:
+            return 0
+        index = int(math.log(value / self.min_value) / self._log_base)
+        return min(index, len(self._counts) - 1)
+
+    def record(self, value):
+        with self._lock:
+            self._counts[self._bucket(value)] += 1
+            self.count += 1
+            self.total += value
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+
+    def _percentile(self, percentile):
+        if self.count == 0:
+            return None
+        rank = max(1, math.ceil(percentile / 100 * self.count))
+        seen = 0
+        for index, bucket_count in enumerate(self._counts):
+            seen += bucket_count
+            if seen >= rank:
+                # middle of the bucket, kept within the observed range
+                value = self.min_value * math.exp((index + 0.5) * self._log_base)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def percentile(self, percentile):
+        with self._lock:
+            return self._percentile(percentile)
+
+    def snapshot(self):
+        """
+        Returns count, mean, min, max, p50, p95 and p99 (in seconds) of the recorded values.
+        """
+        with self._lock:
+            if self.count == 0:
+                return {"count": 0}
+            return {
+                "count": self.count,
+                "mean": self.total / self.count,
+                "min": self.min,
+                "max": self.max,
+                "p50": self._percentile(50),
+                "p95": self._percentile(95),
+                "p99": self._percentile(99),
+            }
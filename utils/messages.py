@@ -0,0 +1,119 @@
+from collections import deque
+
+
+class PartialMessage:
+    """
+    Intermediate result sent ahead of the final one while the user is still speaking.
+    Parts that do not set `accepts_partials` skip them (see BaseHandler.run).
+    `session` is the client session they belong to with the multi-session server.
+    """
+
+    __slots__ = ("session",)
+
+
+class PartialAudio(PartialMessage):
+    """
+    Audio of the utterance in progress, from its start, sent by the VAD for streaming transcription.
+    `final_candidate` is set when the window ends where the trailing silence starts: if that silence turns out to be
+    the end of the utterance, the transcript of this window is the final one. `speech_end` is then the offset where
+    that silence starts, which the final utterance, cut a padding after it, always reaches.
+    """
+
+    __slots__ = ("audio", "final_candidate", "speech_end")
+
+    def __init__(self, audio, final_candidate=False, session=None, speech_end=None):
+        self.audio = audio
+        self.final_candidate = final_candidate
+        self.session = session
+        self.speech_end = speech_end
+
+
+class PartialTranscript(PartialMessage):
+    """
+    Stable beginning of the transcript of the utterance in progress.
+    """
+
+    __slots__ = ("text", "language")
+
+    def __init__(self, text, language=None, session=None):
+        self.text = text
+        self.language = language
+        self.session = session
+
+
+class SpeechSegment:
+    """
+    Beginning of an utterance longer than `max_speech_ms`, cut off by the VAD while the user goes on speaking.
+    The outputs of the part processing it are held back and merged into those of the rest of the utterance
+    (see BaseHandler.hold_segment).
+    """
+
+    __slots__ = ("audio", "session")
+
+    def __init__(self, audio, session=None):
+        self.audio = audio
+        self.session = session
+
+
+class SessionEnd:
+    """
+    Disconnection of one client of the multi-session server. Unlike SESSION_END, which resets a part dedicated to a
+    single client, it makes the shared parts drop the state and the pending work of that session only
+    (see BaseHandler.end_session).
+    """
+
+    __slots__ = ("session",)
+
+    def __init__(self, session):
+        self.session = session
+
+
+def merge_transcripts(held, output):
+    """
+    Prepends the text of the transcripts `held` to `output`, a transcript given either as text, as (text, language)
+    or as a PartialTranscript. The language of `output` is kept.
+    """
+    texts = [transcript[0] if isinstance(transcript, tuple) else transcript for transcript in held]
+    if isinstance(output, PartialTranscript):
+        text = " ".join([*texts, output.text]).strip()
+        return PartialTranscript(text, output.language, session=output.session)
+    if isinstance(output, tuple):
+        return (" ".join([*texts, output[0]]).strip(), *output[1:])
+    return " ".join([*texts, output]).strip()
+
+
+class LocalAgreement:
+    """
+    LocalAgreement-n policy of streaming transcription: the words on which the last `n` hypotheses of the growing
+    utterance agree are committed. Committed words are never taken back.
+    """
+
+    def __init__(self, n=2):
+        self.hypotheses = deque(maxlen=n)
+        self.committed = []
+
+    def reset(self):
+        self.hypotheses.clear()
+        self.committed = []
+
+    def update(self, words):
+        """
+        Adds the hypothesis `words` and returns the newly committed words.
+        """
+        self.hypotheses.append(words)
+        if len(self.hypotheses) < self.hypotheses.maxlen:
+            return []
+        agreed = []
+        for position_words in zip(*self.hypotheses):
+            if any(word != position_words[0] for word in position_words):
+                break
+            agreed.append(position_words[0])
+        if len(agreed) <= len(self.committed) or agreed[:len(self.committed)] != self.committed:
+            return []
+        new_words = agreed[len(self.committed):]
+        self.committed = agreed
+        return new_words
+
+    @property
+    def text(self):
+        return " ".join(self.committed)
@@ -0,0 +1,42 @@
+import logging
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+CONTEXT = multiprocessing.get_context("spawn")
+
+
+def _run_handler(handler_class, args, kwargs, log_level):
+    logging.basicConfig(
+        level=log_level.upper(),
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    try:
+        handler = handler_class(*args, **kwargs)
+        handler.run()
+    finally:
+        # the queues are SharedAudioQueue, unlinked by the parent process
+        for shared_queue in args[1:]:
+            shared_queue.close()
+
+
+class ProcessStage:
+    """
+    Runs a pipeline part in its own process, for true multi-core parallelism.
+    The handler is built in the child process from its class and constructor arguments, which must therefore be
+    picklable: queues have to be SharedAudioQueue and events multiprocessing events.
+    ProcessStage exposes `run` and `stop_event` so that ThreadManager can drive it like any other handler.
+    """
+
+    def __init__(self, handler_class, stop_event, queue_in, queue_out, log_level="info", **kwargs):
+        self.stop_event = stop_event
+        self.process = CONTEXT.Process(
+            target=_run_handler,
+            args=(handler_class, (stop_event, queue_in, queue_out), kwargs, log_level),
+            name=handler_class.__name__,
+        )
+
+    def run(self):
+        self.process.start()
+        logger.info(f"{self.process.name} running in process {self.process.pid}")
+        self.process.join()
@@ -0,0 +1,112 @@
+from queue import Full, Queue
+from time import monotonic
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Sent by the socket receiver when its client disconnects: each part resets its per-client state and forwards it,
+# while staying up for the next client (unlike b"END", which stops the pipeline).
+SESSION_END = b"SESSION_END"
+
+# Sentinels travelling through the pipeline queues. They are never dropped nor
+# counted against the queue size, otherwise a full queue could swallow a shutdown.
+CONTROL_MESSAGES = (b"END", SESSION_END)
+
+QUEUE_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+
+def is_control_message(item):
+    return isinstance(item, bytes) and item in CONTROL_MESSAGES
+
+
+class BoundedQueue(Queue):
+    """
+    Queue with a size limit and an overflow policy:
+    - "block": the producer waits until the consumer frees a slot (standard Queue behaviour).
+    - "drop_oldest": the oldest queued item is discarded to make room for the new one.
+    - "drop_newest": the new item is discarded.
+    The number of discarded items is available in `dropped`. A maxsize <= 0 means unbounded.
+    """
+
+    def __init__(self, maxsize=0, policy="block", name=None):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(
+                f"Unknown queue policy '{policy}'. Choose one of {', '.join(QUEUE_POLICIES)}."
+            )
+        super().__init__(maxsize)
+        self.policy = policy
+        self.name = name
+        self.dropped = 0
+
+    def _data_size(self):
+        # control messages do not take a slot
+        return sum(1 for item in self.queue if not is_control_message(item))
+
+    def put(self, item, block=True, timeout=None):
+        if self.maxsize <= 0:
+            return super().put(item, block, timeout)
+
+        with self.not_full:
+            if not is_control_message(item):
+                if self.policy == "block":
+                    self._wait_for_slot(block, timeout)
+                elif self._is_full():
+                    if self.policy == "drop_newest":
+                        self._count_drop()
+                        return
+                    self._drop_oldest()
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def _is_full(self):
+        return len(self.queue) >= self.maxsize and self._data_size() >= self.maxsize
+
+    def _wait_for_slot(self, block, timeout):
+        # as Queue.put, with the control messages left out of the size
+        if not block:
+            if self._is_full():
+                raise Full
+        elif timeout is None:
+            while self._is_full():
+                self.not_full.wait()
+        elif timeout < 0:
+            raise ValueError("'timeout' must be a non-negative number")
+        else:
+            end = monotonic() + timeout
+            while self._is_full():
+                remaining = end - monotonic()
+                if remaining <= 0.0:
+                    raise Full
+                self.not_full.wait(remaining)
+
+    def _drop_oldest(self):
+        for i, queued in enumerate(self.queue):
+            if not is_control_message(queued):
+                del self.queue[i]
+                self._count_drop()
+                return
+
+    def _count_drop(self):
+        self.dropped += 1
+        logger.debug(f"{self.name or 'queue'} full: dropped {self.dropped} item(s) so far")
+
+    def flush(self, match=None):
+        """
+        Discards every queued item except control messages and returns how many were discarded.
+        If `match` is given, only the items for which it returns True are discarded.
+        """
+        with self.mutex:
+            kept = [
+                item
+                for item in self.queue
+                if is_control_message(item) or (match is not None and not match(item))
+            ]
+            flushed = len(self.queue) - len(kept)
+            self.queue.clear()
+            self.queue.extend(kept)
+            self.unfinished_tasks = max(0, self.unfinished_tasks - flushed)
+            if self.unfinished_tasks == 0:
+                self.all_tasks_done.notify_all()
+            self.not_full.notify_all()
+        return flushed
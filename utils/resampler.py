@@ -0,0 +1,93 @@
+from functools import lru_cache
+from math import ceil, gcd
+
+import numpy as np
+
+# zero crossings of the windowed sinc on each side of its center, at the lower of the two rates
+ZERO_CROSSINGS = 16
+# cutoff of the low-pass filter, as a fraction of the lower Nyquist frequency
+ROLLOFF = 0.945
+KAISER_BETA = 8.6
+MAX_BLOCK = 4096
+
+
+@lru_cache(maxsize=None)
+def _filter_bank(up, down):
+    """
+    Polyphase decomposition of the windowed-sinc low-pass filter resampling by `up`/`down`: row `p` holds the taps
+    applied to the input samples, most recent first, for the outputs of phase `p`.
+    Returns the bank and the half length of the filter in input samples.
+    """
+    cutoff = ROLLOFF * min(1.0, up / down)
+    half = ceil(ZERO_CROSSINGS / cutoff)
+    n = np.arange(2 * half * up) - half * up
+    window = np.i0(KAISER_BETA * np.sqrt(np.clip(1 - (n / (half * up)) ** 2, 0, 1))) / np.i0(KAISER_BETA)
+    taps = cutoff * np.sinc(cutoff * n / up) * window
+    return taps.reshape(2 * half, up).T.astype(np.float32), half
+
+
+class StreamingResampler:
+    """
+    Resamples audio chunk by chunk with a polyphase windowed-sinc filter. The filter of each pair of rates is designed
+    once, and the last input samples are carried over from one chunk to the next so that chunk boundaries are seamless.
+    Outputs are aligned with the input: call `flush` after the last chunk to get the end of the audio.
+    """
+
+    def __init__(self, orig_sr, target_sr):
+        divisor = gcd(int(orig_sr), int(target_sr))
+        self.up = int(target_sr) // divisor
+        self.down = int(orig_sr) // divisor
+        self.bank, self.half = _filter_bank(self.up, self.down) if self.up != self.down else (None, 0)
+        self.reset()
+
+    def reset(self):
+        self.history = np.zeros(max(2 * self.half - 1, 0), dtype=np.float32)
+        # position of the next output in the input, relative to the start of the next chunk, in 1/up samples
+        self.position = self.half * self.up
+        self.samples_in = 0
+        self.samples_out = 0
+
+    def __call__(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float32)
+        self.samples_in += len(chunk)
+        if self.bank is None:
+            self.samples_out += len(chunk)
+            return chunk
+        # bounds the size of the frames gathered at once
+        return np.concatenate(
+            [self._resample(chunk[i:i + MAX_BLOCK]) for i in range(0, len(chunk), MAX_BLOCK)] or [chunk]
+        )
+
+    def _resample(self, chunk):
+        audio = np.concatenate([self.history, chunk])
+        positions = np.arange(self.position, len(chunk) * self.up, self.down)
+        indices, phases = np.divmod(positions, self.up)
+        # input samples of each output, most recent first
+        frames = audio[indices[:, np.newaxis] + len(self.history) - np.arange(len(self.history) + 1)]
+        output = np.einsum("ij,ij->i", frames, self.bank[phases])
+        if len(positions):
+            self.position = positions[-1] + self.down
+        self.position -= len(chunk) * self.up
+        self.history = audio[len(audio) - len(self.history):]
+        self.samples_out += len(output)
+        return output
+
+    def flush(self):
+        """
+        Returns the outputs still held back by the filter delay, and resets the resampler.
+        """
+        output = np.zeros(0, dtype=np.float32)
+        if self.bank is not None:
+            expected = ceil(self.samples_in * self.up / self.down)
+            output = self._resample(np.zeros(self.half + 1, dtype=np.float32))
+            output = output[:max(expected - (self.samples_out - len(output)), 0)]
+        self.reset()
+        return output
+
+
+def resample(audio, orig_sr, target_sr):
+    """
+    Resamples a whole array.
+    """
+    resampler = StreamingResampler(orig_sr, target_sr)
+    return np.concatenate([resampler(audio), resampler.flush()])
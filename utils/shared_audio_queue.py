@@ -0,0 +1,209 @@
+import multiprocessing
+import os
+import queue
+import logging
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils.queues import QUEUE_POLICIES, is_control_message
+from utils.trace import Traced
+
+logger = logging.getLogger(__name__)
+
+
+class _SharedSlot:
+    """
+    Reference to a payload written in a slot of the shared memory, sent through the queue in its place.
+    """
+
+    __slots__ = ("slot", "is_bytes", "dtype", "shape", "trace")
+
+    def __init__(self, slot, is_bytes, dtype, shape, trace):
+        self.slot = slot
+        self.is_bytes = is_bytes
+        self.dtype = dtype
+        self.shape = shape
+        self.trace = trace
+
+
+class SharedAudioQueue:
+    """
+    Queue between pipeline parts running in different processes.
+    Audio payloads (numpy arrays and raw bytes, possibly wrapped in `Traced`) are copied into fixed-size slots of a
+    shared memory buffer and only a small reference goes through the underlying multiprocessing queue. Other items,
+    and audio larger than a slot, are pickled as usual.
+    Overflow policies are the ones of BoundedQueue; `slot_bytes=0` disables the shared memory.
+    As with BoundedQueue, control messages never block nor count against the size: the underlying queue is unbounded
+    and the data items are counted by a semaphore. With "drop_oldest", the producer only records that an item is to be
+    dropped, and the consumer discards the next data item it meets, so that control messages stay in order.
+    Each process using the queue calls `close` when done with it, and the process that created it also `unlink`.
+    """
+
+    def __init__(self, maxsize=0, policy="block", name=None, slot_bytes=16 * 1024, slots=64, context=None):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(
+                f"Unknown queue policy '{policy}'. Choose one of {', '.join(QUEUE_POLICIES)}."
+            )
+        context = context or multiprocessing.get_context("spawn")
+        self.policy = policy
+        self.name = name
+        self.slot_bytes = slot_bytes
+        self.slots = maxsize + 1 if maxsize > 0 else slots
+        self._queue = context.Queue()
+        self._size = context.Semaphore(maxsize) if maxsize > 0 else None
+        # data items the consumer has to discard, see put
+        self._to_drop = context.Value("i", 0)
+        self._dropped = context.Value("i", 0)
+        self._busy = context.Array("b", self.slots)
+        self._shm = None
+        if slot_bytes > 0:
+            self._shm = shared_memory.SharedMemory(create=True, size=self.slots * slot_bytes)
+        self._next_slot = 0
+        self._owner_pid = os.getpid()
+
+    def close(self):
+        """
+        Releases the shared memory in this process.
+        """
+        if self._shm is not None:
+            self._shm.close()
+        self._queue.close()
+
+    def unlink(self):
+        """
+        Frees the shared memory, once every process closed it. Only done by the process that created the queue.
+        """
+        if self._shm is not None and os.getpid() == self._owner_pid:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    @property
+    def dropped(self):
+        return self._dropped.value
+
+    def _acquire_slot(self):
+        with self._busy.get_lock():
+            for i in range(self.slots):
+                slot = (self._next_slot + i) % self.slots
+                if not self._busy[slot]:
+                    self._busy[slot] = 1
+                    self._next_slot = slot + 1
+                    return slot
+        return None
+
+    def _release_slot(self, slot):
+        with self._busy.get_lock():
+            self._busy[slot] = 0
+
+    def _slot_array(self, slot, dtype, shape):
+        return np.ndarray(shape, dtype=dtype, buffer=self._shm.buf, offset=slot * self.slot_bytes)
+
+    def _encode(self, item):
+        if self._shm is None:
+            return item
+        payload, trace = (item.payload, item.trace) if isinstance(item, Traced) else (item, None)
+        is_bytes = isinstance(payload, bytes) and not is_control_message(payload)
+        if is_bytes:
+            payload = np.frombuffer(payload, dtype=np.uint8)
+        elif not isinstance(payload, np.ndarray):
+            return item
+        if payload.nbytes > self.slot_bytes:
+            return item
+        slot = self._acquire_slot()
+        if slot is None:
+            logger.debug(f"{self.name or 'queue'}: no free shared memory slot, pickling")
+            return item
+        self._slot_array(slot, payload.dtype, payload.shape)[...] = payload
+        return _SharedSlot(slot, is_bytes, payload.dtype.str, payload.shape, trace)
+
+    def _decode(self, item):
+        if not isinstance(item, _SharedSlot):
+            return item
+        payload = self._slot_array(item.slot, item.dtype, item.shape).copy()
+        self._release_slot(item.slot)
+        if item.is_bytes:
+            payload = payload.tobytes()
+        if item.trace is not None:
+            return Traced(payload, item.trace)
+        return payload
+
+    def _peek(self, item):
+        # what `match` needs to see of a queued item, without releasing its slot
+        if isinstance(item, _SharedSlot):
+            return Traced(None, item.trace) if item.trace is not None else None
+        return item
+
+    def _discard(self, item):
+        if isinstance(item, _SharedSlot):
+            self._release_slot(item.slot)
+
+    def _count_drop(self):
+        with self._dropped.get_lock():
+            self._dropped.value += 1
+
+    def put(self, item, block=True, timeout=None):
+        if is_control_message(item):
+            self._queue.put(item)
+            return
+        if self._size is not None:
+            if self.policy == "block":
+                if not self._size.acquire(block, timeout):
+                    raise queue.Full
+            elif not self._size.acquire(False):
+                self._count_drop()
+                if self.policy == "drop_newest":
+                    return
+                # the new item takes the slot of the oldest one, which the consumer discards
+                with self._to_drop.get_lock():
+                    self._to_drop.value += 1
+        self._queue.put(self._encode(item))
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def _dequeued(self):
+        # a data item left the queue, returns whether it is one to drop
+        with self._to_drop.get_lock():
+            if self._to_drop.value:
+                self._to_drop.value -= 1
+                return True
+        if self._size is not None:
+            self._size.release()
+        return False
+
+    def get(self, block=True, timeout=None):
+        while True:
+            item = self._queue.get(block, timeout)
+            if is_control_message(item) or not self._dequeued():
+                return self._decode(item)
+            self._discard(item)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def empty(self):
+        return self._queue.empty()
+
+    def flush(self, match=None):
+        """
+        Discards every queued item except control messages and returns how many were discarded.
+        If `match` is given, only the items for which it returns True are discarded.
+        """
+        kept, flushed = [], 0
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if is_control_message(item) or (match is not None and not match(self._peek(item))):
+                kept.append(item)
+            else:
+                self._discard(item)
+                if not self._dequeued():
+                    flushed += 1
+        for item in kept:
+            self._queue.put(item)
+        return flushed
@@ -0,0 +1,19 @@
+import torch
+from transformers import StoppingCriteria
+
+
+class CancelledCriteria(StoppingCriteria):
+    """
+    Stops `generate` at the next step once `is_cancelled` returns True, e.g. on barge-in.
+    """
+
+    def __init__(self, is_cancelled):
+        self.is_cancelled = is_cancelled
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full(
+            (input_ids.shape[0],),
+            self.is_cancelled(),
+            dtype=torch.bool,
+            device=input_ids.device,
+        )
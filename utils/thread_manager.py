@@ -1,13 +1,18 @@
 import threading
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class ThreadManager:
     """
     Manages multiple threads used to execute given handler tasks.
+    `shared_queues` (SharedAudioQueue) are closed and unlinked once the handlers are stopped.
     """
 
-    def __init__(self, handlers):
+    def __init__(self, handlers, shared_queues=()):
         self.handlers = handlers
+        self.shared_queues = shared_queues
         self.threads = []
 
     def start(self):
@@ -21,3 +26,18 @@ class ThreadManager:
             handler.stop_event.set()
         for thread in self.threads:
             thread.join()
+        for shared_queue in self.shared_queues:
+            shared_queue.close()
+            shared_queue.unlink()
+        for name, snapshot in self.latency_snapshot().items():
+            logger.info(f"{name} latency: {snapshot}")
+
+    def latency_snapshot(self):
+        """
+        Latency statistics of each pipeline stage, keyed by handler class name.
+        """
+        return {
+            handler.__class__.__name__: handler.latency_snapshot()
+            for handler in self.handlers
+            if hasattr(handler, "latency_snapshot")
+        }
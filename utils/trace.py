@@ -0,0 +1,80 @@
+import logging
+import uuid
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+# Timestamps recorded for each turn, in pipeline order.
+TRACE_STAGES = (
+    "vad_end",
+    "stt_done",
+    "llm_first_token",
+    "first_sentence",
+    "tts_first_chunk",
+    "first_byte_sent",
+)
+
+
+class TraceContext:
+    """
+    Timing record of one conversational turn. It is created by the VAD when an utterance is emitted
+    and travels with the items derived from that utterance through the STT, LLM and TTS queues.
+    Only the first timestamp of each stage is kept. The record is logged once the first audio byte is sent.
+    With the multi-session server, `session` is the client session the turn belongs to.
+    """
+
+    def __init__(self, session=None):
+        self.trace_id = uuid.uuid4().hex[:8]
+        self.session = session
+        self.marks = {}
+        self.reported = False
+
+    def mark(self, stage):
+        if stage in self.marks:
+            return
+        self.marks[stage] = perf_counter()
+        if stage == TRACE_STAGES[-1]:
+            self.report()
+
+    def record(self):
+        """
+        Seconds elapsed between the end of speech and each recorded stage.
+        """
+        origin = self.marks.get(TRACE_STAGES[0])
+        if origin is None:
+            return {}
+        return {
+            stage: self.marks[stage] - origin
+            for stage in TRACE_STAGES
+            if stage in self.marks
+        }
+
+    def report(self):
+        if self.reported:
+            return
+        self.reported = True
+        timings = ", ".join(
+            f"{stage} +{elapsed:.3f}s" for stage, elapsed in self.record().items()
+        )
+        logger.info(f"Turn {self.trace_id}: {timings}")
+
+
+class Traced:
+    """
+    Queue item carrying a payload along with the TraceContext of the turn it belongs to.
+    """
+
+    __slots__ = ("payload", "trace")
+
+    def __init__(self, payload, trace):
+        self.payload = payload
+        self.trace = trace
+
+
+def unwrap(item):
+    """
+    Returns the (payload, trace) of a queue item, trace being None for untraced items.
+    """
+    if isinstance(item, Traced):
+        return item.payload, item.trace
+    return item, None